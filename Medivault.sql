@@ -27,9 +27,13 @@ CREATE TABLE prescription (
     file_path VARCHAR(255),
     extracted_text TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    -- Bumped by every edit; /api/export?since= filters on it
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE,
     INDEX idx_user_issue (user_id, issue),
     INDEX idx_user_date (user_id, prescription_date),
+    INDEX idx_user_created (user_id, created_at, prescription_id),
+    INDEX idx_user_updated (user_id, updated_at, prescription_id),
     FULLTEXT idx_issue_desc (issue, description)
 );
 
@@ -56,10 +60,15 @@ CREATE TABLE medicine (
     medicine_name VARCHAR(100) UNIQUE NOT NULL,
     common_dosage VARCHAR(50),
     common_frequency VARCHAR(50),
+    -- 0 for names added from extracted prescriptions; the fast-path parser only matches verified
+    -- names (flask verify-medicines)
+    verified TINYINT(1) NOT NULL DEFAULT 1,
     INDEX idx_name (medicine_name)
 );
 
 -- Modify prescription_medication to reference medicine table (3NF compliant)
+-- Uploads map each extracted name to a medicine (adding new ones); older rows are linked by
+-- flask normalize-medicines
 ALTER TABLE prescription_medication ADD COLUMN medicine_id INT,
 ADD FOREIGN KEY (medicine_id) REFERENCES medicine(medicine_id);
 
@@ -70,21 +79,112 @@ CREATE TABLE IF NOT EXISTS prescription_log (
     prescription_id INT,
     action_type VARCHAR(50),
     action_timestamp DATETIME,
+    FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE,
+    INDEX idx_user_action_time (user_id, action_type, action_timestamp)
+);
+
+-- Upload Job table: Durable queue for background OCR + AI processing of uploads
+CREATE TABLE IF NOT EXISTS upload_job (
+    job_id CHAR(32) PRIMARY KEY,
+    batch_id CHAR(32),
+    user_id INT NOT NULL,
+    issue VARCHAR(200) NOT NULL,
+    description TEXT,
+    file_path VARCHAR(255) NOT NULL,
+    content_hash CHAR(64),
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    stage VARCHAR(20) NOT NULL DEFAULT 'queued',
+    message VARCHAR(255),
+    prescription_id INT,
+    result JSON,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE,
+    INDEX idx_status_created (status, created_at),
+    INDEX idx_batch (batch_id)
+);
+
+-- User Stats table: Dashboard statistics maintained incrementally by triggers
+CREATE TABLE IF NOT EXISTS user_stats (
+    user_id INT PRIMARY KEY,
+    total_prescriptions INT NOT NULL DEFAULT 0,
+    total_doctors INT NOT NULL DEFAULT 0,
+    active_months INT NOT NULL DEFAULT 0,
+    total_medicines INT NOT NULL DEFAULT 0,
+    -- Bumped on every change to the user's prescriptions; used to validate cached analytics
+    data_version INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE
 );
 
+-- Per-user doctor and month counts, so distinct counts can be maintained on delete as well as insert
+CREATE TABLE IF NOT EXISTS user_doctor_count (
+    user_id INT NOT NULL,
+    doctor_name VARCHAR(100) NOT NULL,
+    prescriptions INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, doctor_name),
+    FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE
+);
+
+CREATE TABLE IF NOT EXISTS user_month_count (
+    user_id INT NOT NULL,
+    month CHAR(7) NOT NULL,
+    prescriptions INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, month),
+    FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE
+);
+
+-- AI Query Log table: Every /search query and what it matched
+CREATE TABLE IF NOT EXISTS ai_query_log (
+    query_id INT AUTO_INCREMENT PRIMARY KEY,
+    user_id INT NOT NULL,
+    query_text VARCHAR(500) NOT NULL,
+    matched_prescription_ids TEXT,
+    response_summary VARCHAR(255),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES user(user_id) ON DELETE CASCADE,
+    INDEX idx_user_created (user_id, created_at)
+);
+
+-- OCR Engine Run table: per-engine latency and agreement with the saved result, one row per engine per upload.
+-- The adaptive OCR policy learns from the most recent rows. Agreement is NULL when fewer than two engines ran.
+CREATE TABLE IF NOT EXISTS ocr_engine_run (
+    run_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    job_id CHAR(32),
+    prescription_id INT,
+    engine VARCHAR(20) NOT NULL,
+    image_class VARCHAR(20) NOT NULL,
+    seconds DECIMAL(8,3) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    characters INT NOT NULL DEFAULT 0,
+    agreement DECIMAL(4,3),
+    medicine_agreement DECIMAL(4,3),
+    dosage_agreement DECIMAL(4,3),
+    doctor_agreement DECIMAL(4,3),
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_engine_class (engine, image_class)
+);
+
 -- Show created tables
 SHOW TABLES;
 
 DELIMITER //
 
+-- The insert triggers below are skipped when the session sets @medivault_bulk_load = 1.
+-- generate_data.py does this and writes medicine_count and prescription_log itself,
+-- then rebuilds the statistics with RebuildUserStatsRange (PROCEDURE 6).
+-- The prescription_log triggers (1 and 2) are also skipped when @medivault_audit_async = 1;
+-- the application then writes those rows in batches (MEDIVAULT_PRESCRIPTION_LOG=batched).
+
 -- TRIGGER 1: Auto-log prescription creation
 CREATE TRIGGER after_prescription_insert
 AFTER INSERT ON prescription
 FOR EACH ROW
 BEGIN
-    INSERT INTO prescription_log (user_id, prescription_id, action_type, action_timestamp)
-    VALUES (NEW.user_id, NEW.prescription_id, 'CREATED', NOW());
+    IF @medivault_bulk_load IS NULL AND @medivault_audit_async IS NULL THEN
+        INSERT INTO prescription_log (user_id, prescription_id, action_type, action_timestamp)
+        VALUES (NEW.user_id, NEW.prescription_id, 'CREATED', NOW());
+    END IF;
 END//
 
 -- TRIGGER 2: Auto-log prescription deletion
@@ -92,8 +192,10 @@ CREATE TRIGGER after_prescription_delete
 AFTER DELETE ON prescription
 FOR EACH ROW
 BEGIN
-    INSERT INTO prescription_log (user_id, prescription_id, action_type, action_timestamp)
-    VALUES (OLD.user_id, OLD.prescription_id, 'DELETED', NOW());
+    IF @medivault_audit_async IS NULL THEN
+        INSERT INTO prescription_log (user_id, prescription_id, action_type, action_timestamp)
+        VALUES (OLD.user_id, OLD.prescription_id, 'DELETED', NOW());
+    END IF;
 END//
 
 -- TRIGGER 3: Auto-update medicine count on insertion
@@ -101,9 +203,109 @@ CREATE TRIGGER after_medicine_insert
 AFTER INSERT ON prescription_medication
 FOR EACH ROW
 BEGIN
-    UPDATE prescription
-    SET medicine_count = medicine_count + 1
-    WHERE prescription_id = NEW.prescription_id;
+    IF @medivault_bulk_load IS NULL THEN
+        UPDATE prescription
+        SET medicine_count = medicine_count + 1
+        WHERE prescription_id = NEW.prescription_id;
+    END IF;
+END//
+
+DELIMITER ;
+
+DELIMITER //
+
+-- TRIGGER 4: Update user_stats when a prescription is added
+CREATE TRIGGER after_prescription_insert_stats
+AFTER INSERT ON prescription
+FOR EACH ROW
+BEGIN
+    IF @medivault_bulk_load IS NULL THEN
+        INSERT INTO user_stats (user_id, total_prescriptions, total_medicines, data_version)
+        VALUES (NEW.user_id, 1, NEW.medicine_count, 1)
+        ON DUPLICATE KEY UPDATE
+            total_prescriptions = total_prescriptions + 1,
+            total_medicines = total_medicines + NEW.medicine_count,
+            data_version = data_version + 1;
+
+        -- ROW_COUNT() is 1 when the upsert inserted a new row, i.e. a first prescription for this doctor/month
+        IF NEW.doctor_name IS NOT NULL THEN
+            INSERT INTO user_doctor_count (user_id, doctor_name, prescriptions)
+            VALUES (NEW.user_id, NEW.doctor_name, 1)
+            ON DUPLICATE KEY UPDATE prescriptions = prescriptions + 1;
+            IF ROW_COUNT() = 1 THEN
+                UPDATE user_stats SET total_doctors = total_doctors + 1 WHERE user_id = NEW.user_id;
+            END IF;
+        END IF;
+
+        INSERT INTO user_month_count (user_id, month, prescriptions)
+        VALUES (NEW.user_id, DATE_FORMAT(NEW.created_at, '%Y-%m'), 1)
+        ON DUPLICATE KEY UPDATE prescriptions = prescriptions + 1;
+        IF ROW_COUNT() = 1 THEN
+            UPDATE user_stats SET active_months = active_months + 1 WHERE user_id = NEW.user_id;
+        END IF;
+    END IF;
+END//
+
+-- TRIGGER 5: Update user_stats when a prescription is deleted
+-- (cascaded prescription_medication deletes don't fire triggers, so OLD.medicine_count is used)
+CREATE TRIGGER after_prescription_delete_stats
+AFTER DELETE ON prescription
+FOR EACH ROW
+BEGIN
+    UPDATE user_stats
+    SET total_prescriptions = total_prescriptions - 1,
+        total_medicines = total_medicines - OLD.medicine_count,
+        data_version = data_version + 1
+    WHERE user_id = OLD.user_id;
+
+    IF OLD.doctor_name IS NOT NULL THEN
+        UPDATE user_doctor_count SET prescriptions = prescriptions - 1
+        WHERE user_id = OLD.user_id AND doctor_name = OLD.doctor_name;
+        DELETE FROM user_doctor_count
+        WHERE user_id = OLD.user_id AND doctor_name = OLD.doctor_name AND prescriptions <= 0;
+        IF ROW_COUNT() = 1 THEN
+            UPDATE user_stats SET total_doctors = total_doctors - 1 WHERE user_id = OLD.user_id;
+        END IF;
+    END IF;
+
+    UPDATE user_month_count SET prescriptions = prescriptions - 1
+    WHERE user_id = OLD.user_id AND month = DATE_FORMAT(OLD.created_at, '%Y-%m');
+    DELETE FROM user_month_count
+    WHERE user_id = OLD.user_id AND month = DATE_FORMAT(OLD.created_at, '%Y-%m') AND prescriptions <= 0;
+    IF ROW_COUNT() = 1 THEN
+        UPDATE user_stats SET active_months = active_months - 1 WHERE user_id = OLD.user_id;
+    END IF;
+END//
+
+-- TRIGGER 6: Update user_stats on edits (doctor changes) and medicine_count changes from TRIGGER 3
+CREATE TRIGGER after_prescription_update_stats
+AFTER UPDATE ON prescription
+FOR EACH ROW
+BEGIN
+    UPDATE user_stats
+    SET total_medicines = total_medicines + NEW.medicine_count - OLD.medicine_count,
+        data_version = data_version + 1
+    WHERE user_id = NEW.user_id;
+
+    IF NOT (OLD.doctor_name <=> NEW.doctor_name) THEN
+        IF OLD.doctor_name IS NOT NULL THEN
+            UPDATE user_doctor_count SET prescriptions = prescriptions - 1
+            WHERE user_id = OLD.user_id AND doctor_name = OLD.doctor_name;
+            DELETE FROM user_doctor_count
+            WHERE user_id = OLD.user_id AND doctor_name = OLD.doctor_name AND prescriptions <= 0;
+            IF ROW_COUNT() = 1 THEN
+                UPDATE user_stats SET total_doctors = total_doctors - 1 WHERE user_id = OLD.user_id;
+            END IF;
+        END IF;
+        IF NEW.doctor_name IS NOT NULL THEN
+            INSERT INTO user_doctor_count (user_id, doctor_name, prescriptions)
+            VALUES (NEW.user_id, NEW.doctor_name, 1)
+            ON DUPLICATE KEY UPDATE prescriptions = prescriptions + 1;
+            IF ROW_COUNT() = 1 THEN
+                UPDATE user_stats SET total_doctors = total_doctors + 1 WHERE user_id = NEW.user_id;
+            END IF;
+        END IF;
+    END IF;
 END//
 
 DELIMITER ;
@@ -143,17 +345,20 @@ BEGIN
 END//
 
 -- PROCEDURE 3: Get medicine usage statistics for a user
+-- Groups by medicine_id, so spelling variants of one medicine count together; rows not yet
+-- normalized (flask normalize-medicines) fall back to grouping by name
 CREATE PROCEDURE GetMedicineStats(IN userId INT)
 BEGIN
     SELECT
-        pm.medicine_name,
+        ANY_VALUE(COALESCE(m.medicine_name, pm.medicine_name)) as medicine_name,
         COUNT(*) as usage_count,
         GROUP_CONCAT(DISTINCT pm.dosage) as dosages_used,
         AVG(DATEDIFF(NOW(), p.created_at)) as avg_days_since_last_use
     FROM prescription p
     INNER JOIN prescription_medication pm ON p.prescription_id = pm.prescription_id
+    LEFT JOIN medicine m ON m.medicine_id = pm.medicine_id
     WHERE p.user_id = userId
-    GROUP BY pm.medicine_name
+    GROUP BY pm.medicine_id, IF(pm.medicine_id IS NULL, pm.medicine_name, NULL)
     ORDER BY usage_count DESC
     LIMIT 10;
 END//
@@ -188,3 +393,124 @@ BEGIN
 END//
 
 DELIMITER ;
+
+DELIMITER //
+
+-- PROCEDURE 4: Recompute a user's materialized statistics from the base tables
+CREATE PROCEDURE RebuildUserStats(IN userId INT)
+BEGIN
+    -- Repair medicine_count first; TRIGGER 6 applies the differences, which the full recompute below supersedes
+    UPDATE prescription p
+    SET p.medicine_count = (
+        SELECT COUNT(*) FROM prescription_medication pm WHERE pm.prescription_id = p.prescription_id
+    )
+    WHERE p.user_id = userId;
+
+    DELETE FROM user_doctor_count WHERE user_id = userId;
+    INSERT INTO user_doctor_count (user_id, doctor_name, prescriptions)
+    SELECT user_id, doctor_name, COUNT(*)
+    FROM prescription
+    WHERE user_id = userId AND doctor_name IS NOT NULL
+    GROUP BY user_id, doctor_name;
+
+    DELETE FROM user_month_count WHERE user_id = userId;
+    INSERT INTO user_month_count (user_id, month, prescriptions)
+    SELECT user_id, DATE_FORMAT(created_at, '%Y-%m'), COUNT(*)
+    FROM prescription
+    WHERE user_id = userId
+    GROUP BY user_id, DATE_FORMAT(created_at, '%Y-%m');
+
+    INSERT INTO user_stats (user_id, total_prescriptions, total_doctors, active_months, total_medicines, data_version)
+    SELECT * FROM (
+        SELECT
+            userId AS user_id,
+            (SELECT COUNT(*) FROM prescription WHERE user_id = userId) AS total_prescriptions,
+            (SELECT COUNT(*) FROM user_doctor_count WHERE user_id = userId) AS total_doctors,
+            (SELECT COUNT(*) FROM user_month_count WHERE user_id = userId) AS active_months,
+            GetTotalMedicinesUsed(userId) AS total_medicines,
+            1 AS data_version
+    ) AS rebuilt
+    ON DUPLICATE KEY UPDATE
+        total_prescriptions = rebuilt.total_prescriptions,
+        total_doctors = rebuilt.total_doctors,
+        active_months = rebuilt.active_months,
+        total_medicines = rebuilt.total_medicines,
+        data_version = user_stats.data_version + 1;
+END//
+
+-- PROCEDURE 5: List users whose materialized statistics have drifted from the base tables
+CREATE PROCEDURE CheckUserStats()
+BEGIN
+    SELECT
+        u.user_id,
+        COALESCE(s.total_prescriptions, 0) AS stored_prescriptions,
+        (SELECT COUNT(*) FROM prescription p WHERE p.user_id = u.user_id) AS actual_prescriptions,
+        COALESCE(s.total_doctors, 0) AS stored_doctors,
+        (SELECT COUNT(DISTINCT p.doctor_name) FROM prescription p WHERE p.user_id = u.user_id) AS actual_doctors,
+        COALESCE(s.active_months, 0) AS stored_months,
+        (SELECT COUNT(DISTINCT DATE_FORMAT(p.created_at, '%Y-%m')) FROM prescription p WHERE p.user_id = u.user_id) AS actual_months,
+        COALESCE(s.total_medicines, 0) AS stored_medicines,
+        GetTotalMedicinesUsed(u.user_id) AS actual_medicines
+    FROM user u
+    LEFT JOIN user_stats s ON s.user_id = u.user_id
+    HAVING stored_prescriptions <> actual_prescriptions
+        OR stored_doctors <> actual_doctors
+        OR stored_months <> actual_months
+        OR stored_medicines <> actual_medicines;
+END//
+
+DELIMITER ;
+
+DELIMITER //
+
+-- PROCEDURE 6: Set-based RebuildUserStats for a range of users, used after bulk loads that bypass the triggers
+-- (medicine_count is taken as correct; the bulk loader writes it directly)
+CREATE PROCEDURE RebuildUserStatsRange(IN fromUser INT, IN toUser INT)
+BEGIN
+    DELETE FROM user_doctor_count WHERE user_id BETWEEN fromUser AND toUser;
+    INSERT INTO user_doctor_count (user_id, doctor_name, prescriptions)
+    SELECT user_id, doctor_name, COUNT(*)
+    FROM prescription
+    WHERE user_id BETWEEN fromUser AND toUser AND doctor_name IS NOT NULL
+    GROUP BY user_id, doctor_name;
+
+    DELETE FROM user_month_count WHERE user_id BETWEEN fromUser AND toUser;
+    INSERT INTO user_month_count (user_id, month, prescriptions)
+    SELECT user_id, DATE_FORMAT(created_at, '%Y-%m'), COUNT(*)
+    FROM prescription
+    WHERE user_id BETWEEN fromUser AND toUser
+    GROUP BY user_id, DATE_FORMAT(created_at, '%Y-%m');
+
+    INSERT INTO user_stats (user_id, total_prescriptions, total_doctors, active_months, total_medicines, data_version)
+    SELECT * FROM (
+        SELECT
+            u.user_id,
+            COALESCE(p.total_prescriptions, 0) AS total_prescriptions,
+            COALESCE(d.total_doctors, 0) AS total_doctors,
+            COALESCE(m.active_months, 0) AS active_months,
+            COALESCE(p.total_medicines, 0) AS total_medicines,
+            1 AS data_version
+        FROM user u
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS total_prescriptions, SUM(medicine_count) AS total_medicines
+            FROM prescription WHERE user_id BETWEEN fromUser AND toUser GROUP BY user_id
+        ) p ON p.user_id = u.user_id
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS total_doctors
+            FROM user_doctor_count WHERE user_id BETWEEN fromUser AND toUser GROUP BY user_id
+        ) d ON d.user_id = u.user_id
+        LEFT JOIN (
+            SELECT user_id, COUNT(*) AS active_months
+            FROM user_month_count WHERE user_id BETWEEN fromUser AND toUser GROUP BY user_id
+        ) m ON m.user_id = u.user_id
+        WHERE u.user_id BETWEEN fromUser AND toUser
+    ) AS rebuilt
+    ON DUPLICATE KEY UPDATE
+        total_prescriptions = rebuilt.total_prescriptions,
+        total_doctors = rebuilt.total_doctors,
+        active_months = rebuilt.active_months,
+        total_medicines = rebuilt.total_medicines,
+        data_version = user_stats.data_version + 1;
+END//
+
+DELIMITER ;
@@ -1,533 +1,4236 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
-import mysql.connector
-import os
-from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-import pytesseract
-from PIL import Image
-import re
-import requests
-import json
-import easyocr
-from google.cloud import vision
-import io
-
-app = Flask(__name__)
-app.secret_key = 'medivault_secret_key'
-
-# Set Tesseract path
-pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
-
-# Initialize EasyOCR Reader
-print("ðŸ”„ Initializing EasyOCR...")
-try:
-    reader = easyocr.Reader(['en'], gpu=False)
-    print("âœ… EasyOCR initialized!")
-except Exception as e:
-    reader = None
-    print(f"âš ï¸ EasyOCR initialization failed: {e}")
-
-# Google Vision API setup
-CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'google-vision-key.json')
-if os.path.exists(CREDENTIALS_PATH):
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIALS_PATH
-    try:
-        vision_client = vision.ImageAnnotatorClient()
-        print("âœ… Google Vision API initialized!")
-    except Exception as e:
-        print(f"âš ï¸ Google Vision init error: {e}")
-        vision_client = None
-else:
-    print("âš ï¸ Google Vision credentials not found")
-    vision_client = None
-
-# Groq API Configuration
-GROQ_API_KEY = "groq api key here" 
-GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
-
-# Database connection
-db = mysql.connector.connect(
-    host="localhost",
-    user="root",
-    password="sql123",
-    database="MediVault",
-    ssl_disabled=True
-)
-cursor = db.cursor(dictionary=True)
-
-# Upload folder configuration
-UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def extract_text_triple_ocr(image_path):
-    """Extract text using ALL THREE OCR methods"""
-    tesseract_text = ""
-    easyocr_text = ""
-    google_vision_text = ""
-    
-    try:
-        print("ðŸ” Method 1: Tesseract OCR...")
-        image = Image.open(image_path)
-        tesseract_text = pytesseract.image_to_string(image)
-        print(f"   âœ… Extracted {len(tesseract_text)} characters")
-    except Exception as e:
-        print(f"   âš ï¸ Error: {e}")
-    
-    try:
-        if reader is not None:
-            print("ðŸ” Method 2: EasyOCR...")
-            result = reader.readtext(image_path, detail=0)
-            easyocr_text = '\n'.join(result)
-            print(f"   âœ… Extracted {len(easyocr_text)} characters")
-    except Exception as e:
-        print(f"   âš ï¸ Error: {e}")
-    
-    try:
-        if vision_client is not None:
-            print("ðŸ” Method 3: Google Vision API...")
-            with io.open(image_path, 'rb') as image_file:
-                content = image_file.read()
-            image = vision.Image(content=content)
-            response = vision_client.document_text_detection(image=image)
-            if response.full_text_annotation:
-                google_vision_text = response.full_text_annotation.text
-                print(f"   âœ… Extracted {len(google_vision_text)} characters")
-    except Exception as e:
-        print(f"   âš ï¸ Error: {e}")
-    
-    return tesseract_text, easyocr_text, google_vision_text
-
-def parse_prescription_with_groq_fusion(tesseract_text, easyocr_text, google_vision_text):
-    """Use Groq AI to intelligently fuse ALL THREE OCR results"""
-    try:
-        print("ðŸ¤– Sending ALL THREE OCR results to Groq AI...")
-        
-        prompt = f"""You are an expert medical prescription parser with THREE OCR extractions of the SAME prescription.
-
-TESSERACT OCR:
-{tesseract_text}
-
-EASYOCR:
-{easyocr_text}
-
-GOOGLE VISION API:
-{google_vision_text}
-
-Combine the best from each OCR. Return ONLY valid JSON:
-{{
-    "doctor_name": "name or empty",
-    "date": "DD/MM/YYYY or empty",
-    "medicines": [
-        {{
-            "name": "medicine name",
-            "dosage": "100mg or empty",
-            "frequency": "BID/TID/QD or empty",
-            "duration": "5 days or empty"
-        }}
-    ]
-}}
-
-Rules: Doctor names from Google Vision, medicine names from EasyOCR, dosages from Tesseract. Fix typos. Return ONLY JSON."""
-
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
-        payload = {
-            "model": "llama-3.3-70b-versatile",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.05,
-            "max_tokens": 2000
-        }
-        
-        response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=45)
-        
-        if response.status_code == 200:
-            result = response.json()
-            ai_response = result['choices'][0]['message']['content']
-            json_match = re.search(r'\{[\s\S]*\}', ai_response)
-            if json_match:
-                parsed_data = json.loads(json_match.group())
-                print(f"âœ… AI fused: {len(parsed_data.get('medicines', []))} medicines")
-                return parsed_data
-        return {"doctor_name": "", "date": "", "medicines": []}
-    except Exception as e:
-        print(f"âŒ Groq error: {e}")
-        return {"doctor_name": "", "date": "", "medicines": []}
-
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/signup', methods=['GET', 'POST'])
-def signup():
-    if request.method == 'POST':
-        name = request.form['name']
-        email = request.form['email']
-        password = generate_password_hash(request.form['password'])
-        try:
-            cursor.execute("INSERT INTO user (name, email, password) VALUES (%s, %s, %s)", (name, email, password))
-            db.commit()
-            user_id = cursor.lastrowid
-            session['user_id'] = user_id
-            session['user_name'] = name
-            flash('Account created successfully!', 'success')
-            return redirect(url_for('dashboard'))
-        except mysql.connector.Error as err:
-            flash(f'Error: {err.msg}', 'danger')
-    return render_template('signup.html')
-
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        email = request.form['email']
-        password = request.form['password']
-        cursor.execute("SELECT * FROM user WHERE email = %s", (email,))
-        user = cursor.fetchone()
-        if user and check_password_hash(user['password'], password):
-            session['user_id'] = user['user_id']
-            session['user_name'] = user['name']
-            return redirect(url_for('dashboard'))
-        else:
-            flash('Invalid credentials.', 'danger')
-    return render_template('login.html')
-
-@app.route('/dashboard')
-def dashboard():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Get prescriptions (JOIN query with medicines)
-    cursor.execute("""
-        SELECT p.prescription_id, p.issue, p.doctor_name, p.prescription_date, 
-               p.file_path, p.created_at, p.medicine_count,
-               COUNT(pm.pm_id) as actual_medicine_count
-        FROM prescription p
-        LEFT JOIN prescription_medication pm ON p.prescription_id = pm.prescription_id
-        WHERE p.user_id = %s
-        GROUP BY p.prescription_id
-        ORDER BY p.created_at DESC
-    """, (session['user_id'],))
-    prescriptions = cursor.fetchall()
-    
-    # Call stored procedure for summary statistics (AGGREGATE)
-    cursor.callproc('GetPrescriptionSummary', [session['user_id']])
-    for result in cursor.stored_results():
-        stats = result.fetchone()
-
-    cursor.execute("SELECT GetTotalMedicinesUsed(%s) as total_medicines", (session['user_id'],))
-    function_result = cursor.fetchone()
-    if stats:
-        stats['total_medicines'] = function_result['total_medicines'] if function_result else 0
-    
-    return render_template('dashboard.html', 
-                         name=session['user_name'], 
-                         prescriptions=prescriptions,
-                         stats=stats if stats else {'total_prescriptions': 0, 'total_doctors': 0, 'active_months': 0})
-
-@app.route('/analytics')
-def analytics():
-    """Analytics dashboard with AGGREGATE queries"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    # Aggregate query 1: Prescriptions per month
-    cursor.execute("""
-        SELECT 
-            DATE_FORMAT(created_at, '%Y-%m') as month,
-            COUNT(*) as count
-        FROM prescription
-        WHERE user_id = %s
-        GROUP BY month
-        ORDER BY month DESC
-        LIMIT 12
-    """, (session['user_id'],))
-    monthly_stats = cursor.fetchall()
-    
-    # Call stored procedure for medicine statistics
-    cursor.callproc('GetMedicineStats', [session['user_id']])
-    for result in cursor.stored_results():
-        medicine_stats = result.fetchall()
-    
-    # Aggregate query 2: Most common issues
-    cursor.execute("""
-        SELECT issue, COUNT(*) as count
-        FROM prescription
-        WHERE user_id = %s
-        GROUP BY issue
-        ORDER BY count DESC
-        LIMIT 5
-    """, (session['user_id'],))
-    top_issues = cursor.fetchall()
-    
-    # NESTED QUERY: Find prescriptions with above-average medicine count
-    cursor.execute("""
-        SELECT 
-            p.prescription_id,
-            p.issue,
-            p.doctor_name,
-            p.prescription_date,
-            COUNT(pm.pm_id) as medicine_count
-        FROM prescription p
-        INNER JOIN prescription_medication pm ON p.prescription_id = pm.prescription_id
-        WHERE p.user_id = %s
-        AND p.prescription_id IN (
-            SELECT p2.prescription_id
-            FROM prescription p2
-            INNER JOIN prescription_medication pm2 ON p2.prescription_id = pm2.prescription_id
-            WHERE p2.user_id = %s
-            GROUP BY p2.prescription_id
-            HAVING COUNT(pm2.pm_id) >= (
-                SELECT AVG(med_count) FROM (
-                    SELECT COUNT(pm3.pm_id) as med_count
-                    FROM prescription p3
-                    INNER JOIN prescription_medication pm3 ON p3.prescription_id = pm3.prescription_id
-                    WHERE p3.user_id = %s
-                    GROUP BY p3.prescription_id
-                ) as avg_calc
-            )
-        )
-        GROUP BY p.prescription_id
-        ORDER BY medicine_count DESC
-        LIMIT 5
-    """, (session['user_id'], session['user_id'], session['user_id']))
-    complex_prescriptions = cursor.fetchall()
-
-    return render_template('analytics.html', 
-                        monthly_stats=monthly_stats,
-                        medicine_stats=medicine_stats if medicine_stats else [],
-                        top_issues=top_issues,
-                        complex_prescriptions=complex_prescriptions)
-
-@app.route('/upload', methods=['POST'])
-def upload():
-    if 'user_id' not in session:
-        return jsonify({'status': 'error', 'message': 'Not logged in!'})
-    
-    issue = request.form.get('issue', '').strip()
-    description = request.form.get('description', '').strip()
-    
-    if not issue:
-        return jsonify({'status': 'error', 'message': 'Please specify issue!'})
-    
-    if 'file' not in request.files:
-        return jsonify({'status': 'error', 'message': 'No file!'})
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'status': 'error', 'message': 'No file selected!'})
-    
-    if file and allowed_file(file.filename):
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = secure_filename(file.filename)
-        unique_filename = f"{session['user_id']}_{timestamp}_{filename}"
-        full_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-        file.save(full_path)
-        
-        print("\n" + "="*60)
-        print("ðŸ“¸ TRIPLE OCR EXTRACTION")
-        print("="*60)
-        tesseract_text, easyocr_text, google_vision_text = extract_text_triple_ocr(full_path)
-        
-        if not any([tesseract_text.strip(), easyocr_text.strip(), google_vision_text.strip()]):
-            return jsonify({'status': 'error', 'message': 'Could not extract text!'})
-        
-        parsed_data = parse_prescription_with_groq_fusion(tesseract_text, easyocr_text, google_vision_text)
-        
-        # Date conversion
-        prescription_date = None
-        if parsed_data.get('date'):
-            try:
-                for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y']:
-                    try:
-                        prescription_date = datetime.strptime(parsed_data['date'], fmt).date()
-                        break
-                    except:
-                        continue
-            except:
-                pass
-        
-        combined_text = f"TESSERACT:\n{tesseract_text}\n\nEASYOCR:\n{easyocr_text}\n\nGOOGLE:\n{google_vision_text}"
-        relative_path = f"uploads/{unique_filename}"
-        
-        try:
-            # INSERT with trigger (auto-logs to prescription_log)
-            cursor.execute("""
-                INSERT INTO prescription 
-                (user_id, issue, description, doctor_name, prescription_date, file_path, extracted_text) 
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (session['user_id'], issue, description, parsed_data.get('doctor_name', ''), 
-                  prescription_date, relative_path, combined_text))
-            
-            prescription_id = cursor.lastrowid
-            
-            # Save medicines (triggers medicine_count update)
-            for med in parsed_data.get('medicines', []):
-                cursor.execute("""
-                    INSERT INTO prescription_medication 
-                    (prescription_id, medicine_name, dosage, frequency, duration) 
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (prescription_id, med.get('name', ''), med.get('dosage', ''), 
-                      med.get('frequency', ''), med.get('duration', '')))
-            
-            db.commit()
-            print(f"ðŸ’¾ Saved prescription ID: {prescription_id}")
-            
-            return jsonify({
-                'status': 'success', 
-                'message': f'Found {len(parsed_data.get("medicines", []))} medicines!',
-                'prescription_id': prescription_id
-            })
-        except mysql.connector.Error as err:
-            print(f"âŒ Database error: {err}")
-            return jsonify({'status': 'error', 'message': f'Database error: {err.msg}'})
-    return jsonify({'status': 'error', 'message': 'Invalid file type!'})
-
-@app.route('/prescription/<int:prescription_id>')
-def view_prescription(prescription_id):
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    cursor.execute("""
-        SELECT * FROM prescription 
-        WHERE prescription_id = %s AND user_id = %s
-    """, (prescription_id, session['user_id']))
-    prescription = cursor.fetchone()
-    
-    if not prescription:
-        flash('Prescription not found!', 'danger')
-        return redirect(url_for('dashboard'))
-    
-    cursor.execute("""
-        SELECT * FROM prescription_medication 
-        WHERE prescription_id = %s
-    """, (prescription_id,))
-    medicines = cursor.fetchall()
-    
-    cursor.execute("SELECT GetDaysSinceLastIssue(%s, %s) as days_since_last", 
-                (session['user_id'], prescription['issue']))
-    days_result = cursor.fetchone()
-    prescription['days_since_last_issue'] = days_result['days_since_last'] if days_result else -1
-
-    return render_template('view_prescription.html', prescription=prescription, medicines=medicines)
-
-@app.route('/prescription/<int:prescription_id>/edit', methods=['GET', 'POST'])
-def edit_prescription(prescription_id):
-    """UPDATE operation with GUI"""
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-    
-    if request.method == 'POST':
-        issue = request.form.get('issue')
-        description = request.form.get('description')
-        doctor_name = request.form.get('doctor_name')
-        
-        cursor.execute("""
-            UPDATE prescription 
-            SET issue = %s, description = %s, doctor_name = %s
-            WHERE prescription_id = %s AND user_id = %s
-        """, (issue, description, doctor_name, prescription_id, session['user_id']))
-        db.commit()
-        
-        flash('Prescription updated successfully!', 'success')
-        return redirect(url_for('view_prescription', prescription_id=prescription_id))
-    
-    cursor.execute("""
-        SELECT * FROM prescription 
-        WHERE prescription_id = %s AND user_id = %s
-    """, (prescription_id, session['user_id']))
-    prescription = cursor.fetchone()
-    
-    return render_template('edit_prescription.html', prescription=prescription)
-
-@app.route('/prescription/<int:prescription_id>/delete', methods=['POST'])
-def delete_prescription(prescription_id):
-    """DELETE operation with GUI"""
-    if 'user_id' not in session:
-        return jsonify({'status': 'error', 'message': 'Not logged in!'})
-    
-    try:
-        # Get file path before deletion
-        cursor.execute("""
-            SELECT file_path FROM prescription 
-            WHERE prescription_id = %s AND user_id = %s
-        """, (prescription_id, session['user_id']))
-        result = cursor.fetchone()
-        
-        if result:
-            # Delete prescription (trigger will log this)
-            cursor.execute("""
-                DELETE FROM prescription 
-                WHERE prescription_id = %s AND user_id = %s
-            """, (prescription_id, session['user_id']))
-            db.commit()
-            
-            # Delete file
-            file_path = os.path.join('static', result['file_path'])
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            
-            return jsonify({'status': 'success', 'message': 'Prescription deleted!'})
-        return jsonify({'status': 'error', 'message': 'Prescription not found!'})
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)})
-
-@app.route('/search', methods=['POST'])
-def search():
-    """Search using stored procedure (NESTED query with JOIN)"""
-    if 'user_id' not in session:
-        return jsonify({'status': 'error', 'message': 'Not logged in!'})
-    
-    query = request.json.get('query', '').strip()
-    
-    if not query:
-        return jsonify({'status': 'error', 'message': 'Enter search query!'})
-    
-    # Call stored procedure with nested query
-    cursor.callproc('SearchMedicines', [session['user_id'], query])
-    
-    results = []
-    for result in cursor.stored_results():
-        search_results = result.fetchall()
-        for row in search_results:
-            results.append({
-                'prescription_id': row['prescription_id'],
-                'issue': row['issue'],
-                'doctor': row['doctor_name'] or 'Not specified',
-                'date': row['prescription_date'].strftime('%d %b %Y') if row['prescription_date'] else 'Not specified',
-                'medicine_name': row['medicine_name'],
-                'dosage': row['dosage'],
-                'frequency': row['frequency']
-            })
-    
-    # Log query
-    cursor.execute("""
-        INSERT INTO ai_query_log (user_id, query_text, matched_prescription_ids, response_summary)
-        VALUES (%s, %s, %s, %s)
-    """, (session['user_id'], query, 
-          ','.join([str(r['prescription_id']) for r in results]),
-          f'Found {len(results)} results'))
-    db.commit()
-    
-    return jsonify({
-        'status': 'success',
-        'query': query,
-        'results': results,
-        'count': len(results)
-    })
-
-@app.route('/logout')
-def logout():
-    session.clear()
-    flash('Logged out successfully.', 'info')
-    return redirect(url_for('index'))
-
-if __name__ == "__main__":
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, g, make_response, Response
+import click
+import logging
+import mysql.connector
+from mysql.connector import pooling
+import os
+from werkzeug.utils import secure_filename
+from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
+from PIL import Image, ImageOps, ImageSequence
+import numpy as np
+import re
+import requests
+from requests.adapters import HTTPAdapter
+import json
+import functools
+import contextvars
+import io
+import time
+import uuid
+import importlib.metadata
+import atexit
+import queue
+import threading
+import hashlib
+import mmap
+import zipfile
+import zlib
+import csv
+import bisect
+import difflib
+import random
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import DB_CONFIG
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
+
+app = Flask(__name__)
+app.secret_key = 'medivault_secret_key'
+
+# Logging: MEDIVAULT_LOG_FORMAT=json writes one JSON object per line, 'text' writes "event key=value ..."
+LOG_LEVEL = os.environ.get('MEDIVAULT_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('MEDIVAULT_LOG_FORMAT', 'text')
+# Requests and upload jobs slower than this log their whole span tree; 0 turns the slow log off
+SLOW_REQUEST_MS = int(os.environ.get('MEDIVAULT_SLOW_REQUEST_MS', '1000'))
+# Histogram buckets (seconds) for every span exported on /metrics
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# ---------------------------------------------------------------------------
+# Instrumentation: structured logging, timing spans and Prometheus metrics
+# ---------------------------------------------------------------------------
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname.lower(),
+            'event': record.getMessage()
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    @staticmethod
+    def format_value(value):
+        if isinstance(value, (dict, list)) or (isinstance(value, str) and (' ' in value or not value)):
+            return json.dumps(value, default=str)
+        return value
+
+    def format(self, record):
+        fields = ' '.join(f"{key}={self.format_value(value)}" for key, value in getattr(record, 'fields', {}).items())
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.getMessage()} {fields}".rstrip()
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+class StructuredLogger:
+    """Logs an event name plus key/value fields, tagged with the current trace id"""
+
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+
+    def _log(self, level, event, fields):
+        if not self.logger.isEnabledFor(level):
+            return
+        exc_info = fields.pop('exc_info', None)
+        current = current_span.get()
+        if current is not None:
+            fields.setdefault('trace_id', current.trace_id)
+        self.logger.log(level, event, extra={'fields': fields}, exc_info=exc_info)
+
+    def debug(self, event, **fields):
+        self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self._log(logging.WARNING, event, fields)
+
+    def error(self, event, **fields):
+        self._log(logging.ERROR, event, fields)
+
+log = StructuredLogger('medivault')
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+log.logger.addHandler(_log_handler)
+log.logger.setLevel(LOG_LEVEL)
+log.logger.propagate = False
+
+def prometheus_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+class Counter:
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{prometheus_labels(dict(zip(self.label_names, key)))} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=METRICS_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in sorted(self.series.items()):
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series['counts']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{prometheus_labels({**labels, 'le': le})} {cumulative}")
+                lines.append(f"{self.name}_sum{prometheus_labels(labels)} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{prometheus_labels(labels)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """Counters and histograms plus gauges read from existing stats() methods at scrape time"""
+
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help_text, label_names=()):
+        metric = Counter(name, help_text, tuple(label_names))
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, label_names=(), buckets=METRICS_BUCKETS):
+        metric = Histogram(name, help_text, tuple(label_names), buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix, help_text, stats_fn):
+        """Export every number in stats_fn()'s dict as a gauge named prefix_key
+
+        One level of nested dicts becomes a 'key' label, e.g. Groq call counts.
+        """
+        self.collectors.append((prefix, help_text, stats_fn))
+
+    def _collect(self, prefix, help_text, stats_fn):
+        lines = []
+        try:
+            stats = stats_fn()
+        except Exception as e:
+            log.warning('metrics.collect_failed', collector=prefix, error=str(e))
+            return lines
+        for key, value in stats.items():
+            name = f"{prefix}_{key}"
+            if isinstance(value, dict):
+                samples = [(prometheus_labels({'key': sub_key}), sub_value) for sub_key, sub_value in value.items()]
+            else:
+                samples = [('', value)]
+            samples = [(labels, int(value) if isinstance(value, bool) else value) for labels, value in samples
+                       if isinstance(value, (int, float))]
+            if samples:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+                lines += [f"{name}{labels} {value}" for labels, value in samples]
+        return lines
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines += metric.render()
+        for collector in self.collectors:
+            lines += self._collect(*collector)
+        return '\n'.join(lines) + '\n'
+
+metrics = MetricsRegistry()
+span_seconds = metrics.histogram('medivault_span_duration_seconds',
+                                 'Duration of instrumented operations (routes, OCR engines, Groq calls, SQL)',
+                                 ('kind', 'name'))
+http_requests = metrics.counter('medivault_http_requests_total', 'HTTP requests by route and status',
+                                ('route', 'method', 'status'))
+slow_traces = metrics.counter('medivault_slow_traces_total', 'Requests and jobs slower than SLOW_REQUEST_MS',
+                              ('kind',))
+
+class Span:
+    """One timed operation; spans opened while it is current become its children"""
+
+    def __init__(self, name, kind, parent=None, **attrs):
+        self.name = name
+        self.kind = kind
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.attrs = attrs
+        self.children = []
+        self.started = time.perf_counter()
+        self.seconds = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+        span_seconds.observe(self.seconds, kind=self.kind, name=self.name)
+        if self.parent is None and SLOW_REQUEST_MS and self.seconds * 1000 >= SLOW_REQUEST_MS:
+            slow_traces.inc(kind=self.kind)
+            log.warning('slow_trace', trace_id=self.trace_id, kind=self.kind, name=self.name,
+                        ms=round(self.seconds * 1000, 1), tree=self.tree())
+
+    def tree(self):
+        """Nested {name, kind, ms, attrs, children} of this span and everything under it"""
+        node = {
+            'name': self.name,
+            'kind': self.kind,
+            # Children abandoned by a deadline may still be running
+            'ms': round(self.seconds * 1000, 1) if self.seconds is not None else None
+        }
+        if self.attrs:
+            node['attrs'] = self.attrs
+        if self.children:
+            node['children'] = [child.tree() for child in list(self.children)]
+        return node
+
+current_span = contextvars.ContextVar('medivault_span', default=None)
+
+@contextmanager
+def span(name, kind='internal', **attrs):
+    """Time the enclosed block as a child of the current span (or a new trace)"""
+    current = Span(name, kind, current_span.get(), **attrs)
+    token = current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.set(error=type(e).__name__)
+        raise
+    finally:
+        current_span.reset(token)
+        current.finish()
+
+def with_current_span(fn):
+    """Wrap fn so spans it opens on a pool thread attach to the caller's span"""
+    parent = current_span.get()
+
+    def run(*args, **kwargs):
+        token = current_span.set(parent)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            current_span.reset(token)
+    return run
+
+SQL_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1024)
+def sql_span_name(operation):
+    """Low-cardinality label for a statement, e.g. 'SELECT prescription'"""
+    words = operation.split(None, 1)
+    verb = words[0].upper() if words else 'SQL'
+    table = SQL_TABLE_PATTERN.search(operation)
+    return f"{verb} {table.group(1)}" if table else verb
+
+class InstrumentedCursor:
+    """Cursor proxy that times each statement as a 'sql' span and each stored procedure as a 'proc' span"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, operation, *args, **kwargs):
+        with span(sql_span_name(operation), kind='sql'):
+            return self._cursor.execute(operation, *args, **kwargs)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        with span(sql_span_name(operation), kind='sql') as current:
+            current.set(rows=len(seq_params))
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+
+    def callproc(self, procname, *args, **kwargs):
+        with span(procname, kind='proc'):
+            return self._cursor.callproc(procname, *args, **kwargs)
+
+class InstrumentedConnection:
+    """Pooled connection proxy whose cursors are instrumented"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        with span('COMMIT', kind='sql'):
+            self._conn.commit()
+
+@app.before_request
+def start_request_span():
+    g.request_span = Span(request.endpoint or 'unmatched', 'route', method=request.method)
+    g.request_span_token = current_span.set(g.request_span)
+
+@app.after_request
+def record_request_status(response):
+    request_span = g.get('request_span')
+    if request_span is not None:
+        request_span.set(status=response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_span(exception):
+    request_span = g.pop('request_span', None)
+    if request_span is None:
+        return
+    current_span.reset(g.pop('request_span_token'))
+    if exception is not None:
+        request_span.set(status=500, error=type(exception).__name__)
+    request_span.finish()
+    http_requests.inc(route=request_span.name, method=request.method, status=request_span.attrs.get('status', 500))
+
+# Set Tesseract path
+TESSERACT_CMD = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+
+# Google Vision API setup
+CREDENTIALS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'google-vision-key.json')
+
+# OCR engines this deployment runs, e.g. MEDIVAULT_OCR_ENGINES=tesseract,google_vision
+OCR_ENABLED_ENGINES = [name.strip() for name in
+                       os.environ.get('MEDIVAULT_OCR_ENGINES', 'tesseract,easyocr,google_vision').split(',')
+                       if name.strip()]
+# Load the enabled engines on a background thread at startup instead of on the first upload
+OCR_WARMUP = os.environ.get('MEDIVAULT_OCR_WARMUP', '0') == '1'
+
+class OCRBackend:
+    """An OCR engine that is imported and initialised on first use
+
+    The heavy imports (easyocr/torch, google.cloud.vision) live inside the
+    loaders, so processes that never run OCR never pay for them. get() is
+    safe to call from several threads; the loader runs exactly once.
+    """
+
+    def __init__(self, name, label, loader):
+        self.name = name
+        self.label = label
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.client = None
+        self.error = None
+        self.load_seconds = None
+
+    @property
+    def enabled(self):
+        return self.name in OCR_ENABLED_ENGINES
+
+    def get(self):
+        """The engine client, or None if it is disabled or failed to load"""
+        if not self.enabled:
+            return None
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    log.info('ocr.backend_loading', engine=self.name)
+                    started = time.perf_counter()
+                    try:
+                        self.client = self.loader()
+                        if self.client is not None:
+                            log.info('ocr.backend_loaded', engine=self.name)
+                    except Exception as e:
+                        self.error = str(e)
+                        log.warning('ocr.backend_failed', engine=self.name, error=str(e))
+                    self.load_seconds = round(time.perf_counter() - started, 3)
+                    self.loaded = True
+        return self.client
+
+    def status(self):
+        return {
+            'enabled': self.enabled,
+            'loaded': self.loaded,
+            'available': self.client is not None,
+            'load_seconds': self.load_seconds,
+            'error': self.error
+        }
+
+def load_tesseract():
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return pytesseract
+
+def load_easyocr():
+    import easyocr
+    return easyocr.Reader(['en'], gpu=False)
+
+def load_google_vision():
+    if not os.path.exists(CREDENTIALS_PATH):
+        log.warning('ocr.vision_credentials_missing', path=CREDENTIALS_PATH)
+        return None
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIALS_PATH
+    from google.cloud import vision
+    return vision.ImageAnnotatorClient()
+
+ocr_backends = {
+    'tesseract': OCRBackend('tesseract', 'Tesseract OCR', load_tesseract),
+    'easyocr': OCRBackend('easyocr', 'EasyOCR', load_easyocr),
+    'google_vision': OCRBackend('google_vision', 'Google Vision API', load_google_vision),
+}
+
+def warm_up_ocr_backends():
+    """Load every enabled engine in the background so the first upload doesn't wait for it"""
+    def warm_up():
+        for backend in ocr_backends.values():
+            backend.get()
+    threading.Thread(target=warm_up, name='ocr-warmup', daemon=True).start()
+
+# OCR execution: 'parallel' runs all engines at once on a shared pool, 'sequential' runs them one after another
+OCR_EXECUTION_MODE = os.environ.get('MEDIVAULT_OCR_EXECUTION', 'parallel')
+# Per-engine deadlines in seconds (parallel mode only); late engines are abandoned
+OCR_ENGINE_TIMEOUTS = {
+    'tesseract': 30,
+    'easyocr': 60,
+    'google_vision': 20,
+}
+OCR_DEFAULT_TIMEOUT = 60
+# Python package behind each engine; its installed version is part of the OCR cache key
+OCR_ENGINE_PACKAGES = {'tesseract': 'pytesseract', 'easyocr': 'easyocr', 'google_vision': 'google-cloud-vision'}
+# Engine selection: 'fixed' runs every enabled engine on every upload. 'adaptive' first runs the cheapest
+# engine that has agreed well with the saved results for this kind of image (printed or handwritten), and
+# only runs the others when its output looks poor. MEDIVAULT_OCR_POLICY=fixed gives deterministic runs.
+OCR_POLICY = os.environ.get('MEDIVAULT_OCR_POLICY', 'adaptive')
+# Scored uploads every engine needs, per image class, before the adaptive policy skips any of them
+OCR_POLICY_MIN_SAMPLES = 20
+# Mean agreement with the saved result an engine needs to be trusted on its own
+OCR_POLICY_MIN_AGREEMENT = 0.85
+# Below this confidence in the first engine's text, the remaining engines are run as well
+OCR_POLICY_ESCALATE_CONFIDENCE = 0.6
+# Share of uploads that still run every engine, so the statistics keep up with drift
+OCR_POLICY_EXPLORE_RATE = 0.05
+# Weight of each new sample in the running averages, and how many past runs are loaded at startup
+OCR_POLICY_SMOOTHING = 0.05
+OCR_POLICY_HISTORY_ROWS = 5000
+# Printed/handwritten classification from text line regularity on a downsampled page
+OCR_CLASSIFY_SAMPLE_SIZE = 800
+OCR_PRINTED_MAX_LINE_CV = 0.5
+OCR_PRINTED_MIN_BLANK_ROWS = 0.3
+# Calls each engine may have running at once (parallel mode), counting calls abandoned at their deadline
+# that are still finishing. An engine at its cap is shed for new uploads instead of queueing behind them
+OCR_ENGINE_MAX_IN_FLIGHT = {
+    'tesseract': 4,
+    'easyocr': 2,
+    'google_vision': 4,
+}
+OCR_DEFAULT_MAX_IN_FLIGHT = 2
+# Batch uploads preprocess their images this many at a time
+OCR_PREPROCESS_WORKERS = 4
+
+class OCREngineSlots:
+    """One thread pool per OCR engine, sized to the engine's cap on calls in flight
+
+    An engine call cannot be interrupted, so a call abandoned at its
+    deadline keeps its thread until the engine returns. Giving each engine
+    its own pool means a run of slow Vision or EasyOCR calls can only use up
+    that engine's threads; once it has max_in_flight calls running, new calls
+    to it are refused (shed) at once rather than queued behind stuck ones.
+    """
+
+    def __init__(self, limits, default_limit):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.lock = threading.Lock()
+        self.executors = {}
+        self.in_flight = {}
+        self.shed = {}
+
+    def submit(self, name, fn, *args):
+        """Future for fn(*args) on the engine's pool, or None if the engine is at its cap"""
+        limit = self.limits.get(name, self.default_limit)
+        with self.lock:
+            if self.in_flight.get(name, 0) >= limit:
+                self.shed[name] = self.shed.get(name, 0) + 1
+                return None
+            self.in_flight[name] = self.in_flight.get(name, 0) + 1
+            if name not in self.executors:
+                self.executors[name] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f'ocr-{name}')
+            executor = self.executors[name]
+        future = executor.submit(fn, *args)
+        future.add_done_callback(lambda done: self._finished(name))
+        return future
+
+    def _finished(self, name):
+        with self.lock:
+            self.in_flight[name] -= 1
+
+    def stats(self):
+        with self.lock:
+            return {'in_flight': dict(self.in_flight), 'shed': dict(self.shed)}
+
+ocr_engine_slots = OCREngineSlots(OCR_ENGINE_MAX_IN_FLIGHT, OCR_DEFAULT_MAX_IN_FLIGHT)
+metrics.register_stats('medivault_ocr_engine', 'OCR engine calls in flight and calls shed at the cap',
+                       ocr_engine_slots.stats)
+
+# Groq API Configuration
+GROQ_API_KEY = "groq api key here" 
+# MEDIVAULT_GROQ_API_URL can point the fusion client at a local stub server
+GROQ_API_URL = os.environ.get('MEDIVAULT_GROQ_API_URL', "https://api.groq.com/openai/v1/chat/completions")
+GROQ_MODEL = "llama-3.3-70b-versatile"
+GROQ_TIMEOUT = 45
+GROQ_POOL_SIZE = 10
+GROQ_MAX_CONCURRENCY = 4
+GROQ_MAX_RETRIES = 3
+# Consecutive failed calls before the circuit opens, and seconds before a trial call is allowed
+GROQ_BREAKER_THRESHOLD = 5
+GROQ_BREAKER_COOLDOWN = 30
+
+# Database connection pool (connection settings live in config.py)
+DB_POOL_SIZE = 10
+# Seconds a request waits for a free connection before giving up
+DB_POOL_WAIT_TIMEOUT = 10
+# Connections idle longer than this are pinged (and reconnected if stale) before reuse
+DB_HEALTH_CHECK_INTERVAL = 30
+
+class DatabasePool:
+    """Thread-safe MySQL connection pool that waits for a free connection
+
+    mysql.connector's own pool raises immediately when it is exhausted, so a
+    semaphore in front of it makes callers queue instead, and lets us measure
+    how long they queue for. The connections are opened on first use, so
+    importing the module (CLI commands, benchmarks, tests) needs no database.
+    """
+
+    def __init__(self, size, wait_timeout, health_check_interval, **config):
+        self.size = size
+        self.wait_timeout = wait_timeout
+        self.health_check_interval = health_check_interval
+        self.config = config
+        self._pool = None
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.last_used = {}
+        self.in_use = 0
+        self.acquisitions = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            with self.lock:
+                if self._pool is None:
+                    self._pool = pooling.MySQLConnectionPool(pool_name='medivault', pool_size=self.size,
+                                                             pool_reset_session=True, **self.config)
+        return self._pool
+
+    def acquire(self):
+        with span('acquire', kind='db_pool'):
+            started = time.perf_counter()
+            if not self.slots.acquire(timeout=self.wait_timeout):
+                with self.lock:
+                    self.timeouts += 1
+                raise mysql.connector.errors.PoolError(
+                    f"No database connection available after {self.wait_timeout}s")
+            waited = time.perf_counter() - started
+            try:
+                conn = self.pool.get_connection()
+                self._check_health(conn)
+            except Exception:
+                self.slots.release()
+                raise
+        with self.lock:
+            self.in_use += 1
+            self.acquisitions += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+        return InstrumentedConnection(conn)
+
+    def _check_health(self, conn):
+        now = time.monotonic()
+        if now - self.last_used.get(conn.connection_id, 0) < self.health_check_interval:
+            return
+        old_id = conn.connection_id
+        conn.ping(reconnect=True, attempts=3, delay=1)
+        if conn.connection_id != old_id:
+            with self.lock:
+                self.reconnects += 1
+                self.last_used.pop(old_id, None)
+
+    def release(self, conn):
+        with self.lock:
+            self.in_use -= 1
+            self.last_used[conn.connection_id] = time.monotonic()
+        try:
+            # Returns the connection to the pool (rolling back anything uncommitted)
+            conn.close()
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': self.size,
+                'in_use': self.in_use,
+                'acquisitions': self.acquisitions,
+                'wait_seconds_total': round(self.wait_seconds_total, 4),
+                'wait_seconds_avg': round(self.wait_seconds_total / self.acquisitions, 4) if self.acquisitions else 0.0,
+                'wait_seconds_max': round(self.wait_seconds_max, 4),
+                'timeouts': self.timeouts,
+                'reconnects': self.reconnects
+            }
+
+db_pool = DatabasePool(DB_POOL_SIZE, DB_POOL_WAIT_TIMEOUT, DB_HEALTH_CHECK_INTERVAL, **DB_CONFIG)
+metrics.register_stats('medivault_db_pool', 'Database connection pool statistics', db_pool.stats)
+
+def get_db():
+    """Connection for the current request, returned to the pool on teardown"""
+    if 'db' not in g:
+        g.db = db_pool.acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
+
+# Upload folder configuration
+UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+
+# Background upload pipeline: number of worker threads and how many jobs may wait before uploads are refused
+UPLOAD_WORKERS = 2
+UPLOAD_QUEUE_SIZE = 20
+UPLOAD_RETRY_AFTER = 15
+# A 'running' job not updated for this long is assumed orphaned by a dead worker and re-queued
+UPLOAD_JOB_STALE_SECONDS = 600
+# OCR + fusion result cache; bump OCR_CACHE_VERSION to invalidate entries after prompt or engine changes
+OCR_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'ocr')
+OCR_CACHE_MEMORY_ENTRIES = 256
+OCR_CACHE_DISK_MAX_BYTES = 200 * 1024 * 1024
+OCR_CACHE_VERSION = 1
+# Image preprocessing before OCR; each step can be switched off
+PREPROCESS_STEPS = {
+    'downscale': True,
+    'grayscale': True,
+    'deskew': True,
+    'binarize': True,
+    'crop': False,
+}
+PREPROCESS_TARGET_DPI = 300
+# Long edge of an A5 page at 300 DPI
+PREPROCESS_MAX_LONG_EDGE = 2480
+PREPROCESS_MAX_SKEW = 5.0
+PREPROCESS_SKEW_STEP = 0.5
+# A tilt is only corrected when it scores this much (relative) above leaving the page as it is
+PREPROCESS_SKEW_MIN_GAIN = 0.05
+PREPROCESS_SKEW_SAMPLE_SIZE = 800
+PREPROCESS_CROP_INK_FRACTION = 0.005
+PREPROCESS_CROP_MARGIN = 20
+
+# Batch ingestion (/upload/batch): a batch is one upload queue entry, run by one worker in one pass
+BATCH_MAX_FILES = 50
+BATCH_MAX_MEMBER_BYTES = 20 * 1024 * 1024
+BATCH_TESSERACT_WORKERS = 4
+BATCH_FUSION_WORKERS = 4
+VISION_BATCH_SIZE = 8
+# Search index (/search)
+SEARCH_INDEX_MAX_USERS = 500
+# A user's index is brought up to date when user_stats.data_version changes, by reloading prescriptions
+# updated since the last sync; the sync point is set this many seconds early to cover late commits
+SEARCH_SYNC_OVERLAP = 60
+SEARCH_PAGE_SIZE = 10
+SEARCH_FIELD_WEIGHTS = {'medicine': 3.0, 'issue': 2.5, 'doctor': 2.0, 'text': 1.0}
+SEARCH_PREFIX_FACTOR = 0.8
+SEARCH_FUZZY_FACTOR = 0.6
+SEARCH_FUZZY_MIN_SIMILARITY = 0.4
+SEARCH_MAX_EXPANSIONS = 50
+# Analytics page cache and latency budget
+ANALYTICS_CACHE_MAX_USERS = 1000
+ANALYTICS_CACHE_TTL = 3600
+ANALYTICS_LATENCY_BUDGET_MS = 200
+# Local fast-path parser: OCR engines that must have text, and the confidence needed to skip the LLM.
+# Any prescription-looking line (dosage, frequency or dosage form) that matches no catalog medicine
+# sends the upload to the LLM, so the fast path never drops a medicine it does not know.
+FAST_PATH_MIN_ENGINES = 2
+FAST_PATH_MIN_CONFIDENCE = 0.85
+FAST_PATH_MIN_COVERAGE = 1.0
+# With the adaptive OCR policy most uploads have a single engine's text; that is parsed locally only
+# when the text itself scores this high (ocr_text_confidence) and every medicine has a dosage
+FAST_PATH_SINGLE_ENGINE_MIN_CONFIDENCE = 0.9
+FAST_PATH_CATALOG_RELOAD = 300
+# Medicine normalization: extracted names map to medicine rows by normalized name, else by trigram
+# similarity (names shorter than MEDICINE_MATCH_MIN_LENGTH must match exactly); others become new,
+# unverified rows if they look like a medicine name. Only verified names feed the fast-path parser.
+MEDICINE_MATCH_MIN_SIMILARITY = 0.6
+MEDICINE_MATCH_MIN_LENGTH = 4
+MEDICINE_NAME_MAX_WORDS = 5
+# What the LLM writes when it cannot read a name; never added to the medicine table
+MEDICINE_NAME_PLACEHOLDERS = {'unknown', 'none', 'na', 'nil', 'illegible', 'unreadable', 'not readable',
+                              'unclear', 'not clear', 'medicine', 'medicine name', 'name', 'empty'}
+# Upload storage: request bodies are streamed to disk in chunks; files above the mmap threshold are
+# memory-mapped for OCR instead of read onto the heap
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MMAP_THRESHOLD = 8 * 1024 * 1024
+# Downscaled JPEG copies served to the dashboard ('thumb') and prescription page ('preview')
+THUMBNAIL_FOLDER = os.path.join(UPLOAD_FOLDER, 'thumbs')
+THUMBNAIL_SIZES = {'thumb': 480, 'preview': 1280}
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_WORKERS = 2
+# Dashboard prescription list: rows rendered server-side, and the most one /api/prescriptions call may return
+LISTING_PAGE_SIZE = 24
+LISTING_MAX_PAGE_SIZE = 100
+# Audit writes (ai_query_log, prescription_log) are buffered and flushed by a background thread in
+# multi-row INSERTs once AUDIT_FLUSH_ROWS are waiting or AUDIT_FLUSH_INTERVAL seconds have passed
+AUDIT_QUEUE_SIZE = 10000
+AUDIT_FLUSH_ROWS = 500
+AUDIT_FLUSH_INTERVAL = 1.0
+# A full buffer blocks the request this long before the row is dropped (and counted)
+AUDIT_ENQUEUE_TIMEOUT = 0.5
+AUDIT_FLUSH_RETRIES = 3
+# Seconds the process waits at exit for the buffer to drain
+AUDIT_DRAIN_TIMEOUT = 10
+# prescription_log: 'trigger' writes it inside the INSERT/DELETE transaction, 'batched' turns the
+# triggers off per session and queues the rows on the audit writer after commit
+PRESCRIPTION_LOG_MODE = os.environ.get('MEDIVAULT_PRESCRIPTION_LOG', 'trigger')
+# Prescription export (/api/export): rows per fetch from the streaming cursor, bytes per response chunk,
+# and how many exports may run at once
+EXPORT_FETCH_ROWS = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_MAX_CONCURRENT = 2
+EXPORT_GZIP_LEVEL = 6
+EXPORT_RETRY_AFTER = 30
+# X-Export-Next-Since is set this many seconds before the export started, so the next export also
+# picks up rows that committed late: transactions still open at the time, and prescription_log rows
+# another process had not flushed yet. The overlap repeats a few records, which consumers upsert.
+EXPORT_SINCE_OVERLAP = 60
+# Seconds an export waits for this process's buffered prescription_log rows to be written
+EXPORT_AUDIT_FLUSH_TIMEOUT = 5
+UPLOAD_STAGE_PROGRESS = {'queued': 5, 'ocr': 25, 'fusion': 60, 'saving': 85, 'done': 100}
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+# ---------------------------------------------------------------------------
+# Upload storage and thumbnails
+# ---------------------------------------------------------------------------
+
+def store_upload_stream(stream, full_path):
+    """Copy an upload to disk chunk by chunk, hashing it on the way
+
+    Returns the SHA-256 hex digest, which doubles as the content part of the
+    OCR cache key so the file never has to be read back just to hash it.
+    """
+    digest = hashlib.sha256()
+    tmp_path = f"{full_path}.{threading.get_ident()}.part"
+    try:
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        os.replace(tmp_path, full_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return digest.hexdigest()
+
+def store_upload_bytes(data, full_path):
+    with open(full_path, 'wb') as out:
+        out.write(data)
+    return hashlib.sha256(data).hexdigest()
+
+def file_sha256(path):
+    """Hash of a file already on disk (jobs queued before their hash was recorded)"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_image_buffer(path):
+    """The encoded upload as bytes, or a read-only memory map for large files"""
+    with open(path, 'rb') as image_file:
+        if os.fstat(image_file.fileno()).st_size < UPLOAD_MMAP_THRESHOLD:
+            return image_file.read()
+        # The map stays valid after the file object is closed
+        return mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+def thumbnail_path(relative_path, size_name):
+    base_name = os.path.splitext(os.path.basename(relative_path))[0]
+    return os.path.join(THUMBNAIL_FOLDER, size_name, f"{base_name}.jpg")
+
+def generate_thumbnails(full_path, relative_path):
+    """Write every THUMBNAIL_SIZES rendition of an upload, decoding it only once"""
+    largest = max(THUMBNAIL_SIZES.values())
+    try:
+        with Image.open(full_path) as original:
+            # JPEG can decode straight at a reduced scale, which is most of the saving on phone photos
+            original.draft('RGB', (largest, largest))
+            image = ImageOps.exif_transpose(original).convert('RGB')
+        for size_name, edge in sorted(THUMBNAIL_SIZES.items(), key=lambda item: -item[1]):
+            image.thumbnail((edge, edge), Image.LANCZOS)
+            path = thumbnail_path(relative_path, size_name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+            os.replace(tmp_path, path)
+    except (OSError, ValueError) as e:
+        log.warning('upload.thumbnail_failed', file_path=relative_path, error=str(e))
+
+thumbnail_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnail')
+
+def schedule_thumbnails(full_path, relative_path):
+    thumbnail_executor.submit(generate_thumbnails, full_path, relative_path)
+
+def remove_thumbnails(relative_path):
+    for size_name in THUMBNAIL_SIZES:
+        path = thumbnail_path(relative_path, size_name)
+        if os.path.exists(path):
+            os.remove(path)
+
+@app.template_global()
+def thumbnail_url(file_path, size_name='thumb'):
+    """Static URL of an upload's thumbnail, or of the original until the thumbnail exists"""
+    if os.path.exists(thumbnail_path(file_path, size_name)):
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        return url_for('static', filename=f"uploads/thumbs/{size_name}/{base_name}.jpg")
+    return url_for('static', filename=file_path)
+
+# ---------------------------------------------------------------------------
+# Image preprocessing (runs once per upload, shared by every OCR engine)
+# ---------------------------------------------------------------------------
+
+class OCRImage:
+    """A decoded upload handed to every OCR engine
+
+    Engines read whichever representation they need (PIL image, NumPy array
+    or encoded bytes); each is built once and shared between engine threads.
+    The encoded file is read once into source_buffer (memory-mapped when
+    large) and never re-read from disk.
+    """
+
+    def __init__(self, image, source_buffer, modified):
+        self.image = image
+        self.source_buffer = source_buffer
+        self.modified = modified
+        self.lock = threading.Lock()
+        self._array = None
+        self._encoded = None
+
+    @property
+    def size(self):
+        return self.image.size
+
+    def array(self):
+        with self.lock:
+            if self._array is None:
+                self._array = np.asarray(self.image)
+            return self._array
+
+    def encoded_bytes(self):
+        """PNG of the processed image, or the original file bytes if preprocessing changed nothing"""
+        with self.lock:
+            if self._encoded is None:
+                if self.modified:
+                    buffer = io.BytesIO()
+                    self.image.save(buffer, format='PNG', optimize=False)
+                    self._encoded = buffer.getvalue()
+                else:
+                    self._encoded = bytes(self.source_buffer)
+            return self._encoded
+
+def otsu_threshold(gray):
+    """Otsu's global threshold for a uint8 grayscale array"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weight = np.cumsum(hist) / gray.size
+    mean = np.cumsum(hist * np.arange(256)) / gray.size
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mean[-1] * weight - mean) ** 2 / (weight * (1 - weight))
+    return int(np.argmax(np.nan_to_num(between)))
+
+def downscale_for_ocr(image):
+    # Phone photos rarely carry a real DPI, so fall back to capping the long edge
+    dpi = image.info.get('dpi', (0, 0))[0] or 0
+    scale = PREPROCESS_TARGET_DPI / dpi if dpi > PREPROCESS_TARGET_DPI else 1.0
+    scale = min(scale, PREPROCESS_MAX_LONG_EDGE / max(image.size))
+    if scale >= 1.0:
+        return image
+    new_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(new_size, Image.LANCZOS)
+
+def estimate_skew_angle(gray_image):
+    """Angle (degrees) that makes text lines horizontal, by projection-profile search
+
+    0 unless another angle beats the unrotated page by PREPROCESS_SKEW_MIN_GAIN,
+    so blank, evenly filled or already straight pages are left alone.
+    """
+    small = gray_image.copy()
+    small.thumbnail((PREPROCESS_SKEW_SAMPLE_SIZE, PREPROCESS_SKEW_SAMPLE_SIZE))
+    pixels = np.asarray(small)
+    dark = pixels <= otsu_threshold(pixels)
+    # No ink, or more ink than paper: there are no text lines to line up
+    if not 0 < dark.mean() < 0.5:
+        return 0.0
+    ink = Image.fromarray(np.where(dark, 255, 0).astype(np.uint8))
+
+    def score(angle):
+        rotated = np.asarray(ink.rotate(angle, resample=Image.NEAREST, fillcolor=0))
+        # Aligned text lines give sharply alternating row sums, i.e. a high variance
+        return float(np.var(rotated.sum(axis=1, dtype=np.float64)))
+
+    best_angle, best_score = 0.0, score(0.0) * (1 + PREPROCESS_SKEW_MIN_GAIN)
+    for angle in np.arange(-PREPROCESS_MAX_SKEW, PREPROCESS_MAX_SKEW + 0.01, PREPROCESS_SKEW_STEP):
+        if angle == 0:
+            continue
+        angle_score = score(float(angle))
+        if angle_score > best_score:
+            best_angle, best_score = float(angle), angle_score
+    return best_angle
+
+def crop_to_text(image):
+    pixels = np.asarray(image.convert('L'))
+    dark = pixels <= otsu_threshold(pixels)
+    # Rows/columns with a little ink are text; ignore isolated specks
+    rows = np.flatnonzero(dark.mean(axis=1) > PREPROCESS_CROP_INK_FRACTION)
+    cols = np.flatnonzero(dark.mean(axis=0) > PREPROCESS_CROP_INK_FRACTION)
+    if rows.size == 0 or cols.size == 0:
+        return image
+    margin = PREPROCESS_CROP_MARGIN
+    box = (max(int(cols[0]) - margin, 0), max(int(rows[0]) - margin, 0),
+           min(int(cols[-1]) + margin + 1, image.width), min(int(rows[-1]) + margin + 1, image.height))
+    return image.crop(box)
+
+def preprocess_for_ocr(image_path):
+    """Decode an upload once and apply the enabled PREPROCESS_STEPS
+
+    Returns (OCRImage, report); the report has before/after pixel counts and
+    per-step timings in milliseconds.
+    """
+    started = time.perf_counter()
+    source_buffer = read_image_buffer(image_path)
+    source = source_buffer if isinstance(source_buffer, mmap.mmap) else io.BytesIO(source_buffer)
+    with Image.open(source) as original:
+        # Apply the phone's EXIF rotation so engines see the page upright
+        image = ImageOps.exif_transpose(original)
+        image.info['dpi'] = original.info.get('dpi', (0, 0))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    before_pixels = image.width * image.height
+    step_ms = {}
+
+    def step(name, fn):
+        nonlocal image
+        if not PREPROCESS_STEPS.get(name):
+            return
+        step_started = time.perf_counter()
+        image = fn(image)
+        step_ms[name] = round((time.perf_counter() - step_started) * 1000, 1)
+
+    step('downscale', downscale_for_ocr)
+    step('grayscale', lambda img: img.convert('L'))
+
+    def deskew(img):
+        angle = estimate_skew_angle(img.convert('L'))
+        if abs(angle) < PREPROCESS_SKEW_STEP / 2:
+            return img
+        return img.rotate(angle, resample=Image.BICUBIC, expand=True,
+                          fillcolor=255 if img.mode == 'L' else (255, 255, 255))
+    step('deskew', deskew)
+
+    def binarize(img):
+        gray = np.asarray(img.convert('L'))
+        return Image.fromarray(np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8))
+    step('binarize', binarize)
+    step('crop', crop_to_text)
+
+    after_pixels = image.width * image.height
+    report = {
+        'before_pixels': before_pixels,
+        'after_pixels': after_pixels,
+        'steps_ms': step_ms,
+        'seconds': round(time.perf_counter() - started, 3),
+        'status': 'ok'
+    }
+    return OCRImage(image, source_buffer, modified=bool(step_ms)), report
+
+def estimate_time_saved(timings, report):
+    """Rough per-engine saving, assuming engine time scales with pixel count"""
+    if not report['after_pixels'] or report['after_pixels'] >= report['before_pixels']:
+        return
+    factor = report['before_pixels'] / report['after_pixels'] - 1
+    for name, timing in timings.items():
+        if name in ocr_backends and timing['status'] == 'ok':
+            timing['estimated_seconds_saved'] = round(timing['seconds'] * factor, 3)
+
+# ---------------------------------------------------------------------------
+# OCR engines
+# ---------------------------------------------------------------------------
+
+def ocr_with_tesseract(ocr_image):
+    pytesseract = ocr_backends['tesseract'].get()
+    if pytesseract is None:
+        return ""
+    return pytesseract.image_to_string(ocr_image.image)
+
+def ocr_with_easyocr(ocr_image):
+    reader = ocr_backends['easyocr'].get()
+    if reader is None:
+        return ""
+    result = reader.readtext(ocr_image.array(), detail=0)
+    return '\n'.join(result)
+
+def ocr_with_google_vision(ocr_image):
+    vision_client = ocr_backends['google_vision'].get()
+    if vision_client is None:
+        return ""
+    from google.cloud import vision
+    image = vision.Image(content=ocr_image.encoded_bytes())
+    response = vision_client.document_text_detection(image=image)
+    if response.full_text_annotation:
+        return response.full_text_annotation.text
+    return ""
+
+OCR_ENGINES = [
+    ('tesseract', 'Tesseract OCR', ocr_with_tesseract),
+    ('easyocr', 'EasyOCR', ocr_with_easyocr),
+    ('google_vision', 'Google Vision API', ocr_with_google_vision),
+]
+
+def run_ocr_engine(engine_fn, ocr_input):
+    """Run one OCR engine and return (text, seconds, status)"""
+    started = time.perf_counter()
+    with span(engine_fn.__name__, kind='ocr') as engine_span:
+        try:
+            text = engine_fn(ocr_input)
+            engine_span.set(status='ok')
+            return text, time.perf_counter() - started, 'ok'
+        except Exception as e:
+            engine_span.set(status='error')
+            log.warning('ocr.engine_error', engine=engine_fn.__name__, error=str(e))
+            return "", time.perf_counter() - started, 'error'
+
+def run_ocr_engines(engines, ocr_image, texts, timings):
+    """Run engines (parallel or sequential per OCR_EXECUTION_MODE), filling texts and timings in place"""
+    if OCR_EXECUTION_MODE == 'parallel':
+        log.info('ocr.started', mode='parallel', engines=[name for name, label, engine_fn in engines])
+        started = time.monotonic()
+        futures = {name: ocr_engine_slots.submit(name, with_current_span(run_ocr_engine), engine_fn, ocr_image)
+                   for name, label, engine_fn in engines}
+        for name, label, engine_fn in engines:
+            if futures[name] is None:
+                log.warning('ocr.engine_shed', engine=name)
+                texts[name] = ""
+                timings[name] = {'seconds': 0.0, 'status': 'shed'}
+                continue
+            deadline = OCR_ENGINE_TIMEOUTS.get(name, OCR_DEFAULT_TIMEOUT)
+            remaining = max(deadline - (time.monotonic() - started), 0)
+            try:
+                text, seconds, status = futures[name].result(timeout=remaining)
+            except FuturesTimeoutError:
+                # Not cancellable once running; the worker finishes in the background and its result is dropped
+                futures[name].cancel()
+                text, seconds, status = "", time.monotonic() - started, 'timeout'
+                log.warning('ocr.engine_timeout', engine=name, deadline_seconds=deadline)
+            texts[name] = text
+            timings[name] = {'seconds': round(seconds, 3), 'status': status}
+    else:
+        for index, (name, label, engine_fn) in enumerate(engines, start=1):
+            log.info('ocr.started', mode='sequential', engine=name, step=index)
+            text, seconds, status = run_ocr_engine(engine_fn, ocr_image)
+            texts[name] = text
+            timings[name] = {'seconds': round(seconds, 3), 'status': status}
+
+def extract_text_triple_ocr(image_path):
+    """Extract text using the three OCR engines
+
+    The image is preprocessed once and the result is shared by all engines.
+    Returns (tesseract_text, easyocr_text, google_vision_text, timings) where
+    timings maps each engine to {'seconds': ..., 'status': ...},
+    'preprocess' to the preprocessing report and 'policy' to the engine
+    selection (image class, first engine, whether it escalated). In parallel
+    mode an engine that misses its deadline is abandoned with status
+    'timeout', and an engine that already has too many calls in flight is
+    not run, with status 'shed'; under the adaptive policy an engine that
+    was not needed has status 'skipped'.
+    """
+    texts = {name: "" for name, label, engine_fn in OCR_ENGINES}
+    timings = {name: {'seconds': 0.0, 'status': 'disabled'} for name, label, engine_fn in OCR_ENGINES}
+    active_engines = [engine for engine in OCR_ENGINES if ocr_backends[engine[0]].enabled]
+
+    with span('preprocess', kind='ocr'):
+        ocr_image, timings['preprocess'] = preprocess_for_ocr(image_path)
+    log.info('ocr.preprocessed', before_pixels=timings['preprocess']['before_pixels'],
+             after_pixels=timings['preprocess']['after_pixels'])
+
+    image_class = classify_image(ocr_image)
+    first = None
+    if OCR_POLICY == 'adaptive':
+        first = ocr_policy.first_engine(image_class, [name for name, label, engine_fn in active_engines])
+    timings['policy'] = {'policy': OCR_POLICY, 'image_class': image_class, 'first_engine': first,
+                         'escalated': False, 'status': 'ok'}
+
+    if first is None:
+        run_ocr_engines(active_engines, ocr_image, texts, timings)
+    else:
+        run_ocr_engines([engine for engine in active_engines if engine[0] == first], ocr_image, texts, timings)
+        rest = [engine for engine in active_engines if engine[0] != first]
+        confidence = ocr_text_confidence(texts[first])
+        timings['policy']['confidence'] = round(confidence, 3)
+        if confidence < OCR_POLICY_ESCALATE_CONFIDENCE:
+            log.info('ocr.escalated', engine=first, image_class=image_class, confidence=round(confidence, 2))
+            timings['policy']['escalated'] = True
+            run_ocr_engines(rest, ocr_image, texts, timings)
+        else:
+            for name, label, engine_fn in rest:
+                timings[name] = {'seconds': 0.0, 'status': 'skipped'}
+        ocr_policy.count('escalated' if timings['policy']['escalated'] else 'single')
+
+    for name, label, engine_fn in active_engines:
+        backend = ocr_backends[name]
+        # An engine that failed to load returns no text; flag it so the partial result is not cached
+        if timings[name]['status'] == 'ok' and backend.loaded and backend.client is None:
+            timings[name]['status'] = 'unavailable'
+
+    estimate_time_saved(timings, timings['preprocess'])
+    for name, label, engine_fn in OCR_ENGINES:
+        if texts[name]:
+            log.info('ocr.engine_done', engine=name, characters=len(texts[name]), seconds=timings[name]['seconds'])
+
+    return texts['tesseract'], texts['easyocr'], texts['google_vision'], timings
+
+def ocr_batch_with_tesseract(ocr_images):
+    # Tesseract is a subprocess per image, so plain thread parallelism scales well
+    with ThreadPoolExecutor(max_workers=BATCH_TESSERACT_WORKERS, thread_name_prefix='tesseract') as pool:
+        return [text for text, seconds, status in
+                pool.map(with_current_span(lambda ocr_image: run_ocr_engine(ocr_with_tesseract, ocr_image)), ocr_images)]
+
+def ocr_batch_with_easyocr(ocr_images):
+    reader = ocr_backends['easyocr'].get()
+    if reader is None:
+        return [""] * len(ocr_images)
+    texts = [""] * len(ocr_images)
+    # readtext_batched needs equally sized inputs; scans from one device usually are
+    by_size = {}
+    for index, ocr_image in enumerate(ocr_images):
+        by_size.setdefault(ocr_image.size, []).append(index)
+    for indexes in by_size.values():
+        if len(indexes) == 1:
+            texts[indexes[0]] = run_ocr_engine(ocr_with_easyocr, ocr_images[indexes[0]])[0]
+            continue
+        try:
+            results = reader.readtext_batched([ocr_images[i].array() for i in indexes], detail=0)
+            for index, result in zip(indexes, results):
+                texts[index] = '\n'.join(result)
+        except Exception as e:
+            log.warning('ocr.batch_error', engine='easyocr', error=str(e))
+    return texts
+
+def ocr_batch_with_google_vision(ocr_images):
+    vision_client = ocr_backends['google_vision'].get()
+    if vision_client is None:
+        return [""] * len(ocr_images)
+    from google.cloud import vision
+    texts = []
+    for start in range(0, len(ocr_images), VISION_BATCH_SIZE):
+        annotate_requests = [vision.AnnotateImageRequest(
+            image=vision.Image(content=ocr_image.encoded_bytes()),
+            features=[vision.Feature(type_=vision.Feature.Type.DOCUMENT_TEXT_DETECTION)])
+            for ocr_image in ocr_images[start:start + VISION_BATCH_SIZE]]
+        response = vision_client.batch_annotate_images(requests=annotate_requests)
+        for result in response.responses:
+            texts.append(result.full_text_annotation.text if result.full_text_annotation else "")
+    return texts
+
+OCR_BATCH_ENGINES = {
+    'tesseract': ocr_batch_with_tesseract,
+    'easyocr': ocr_batch_with_easyocr,
+    'google_vision': ocr_batch_with_google_vision,
+}
+
+def extract_text_batch(image_paths):
+    """Batch version of extract_text_triple_ocr for many images at once
+
+    Each image is preprocessed, then each engine processes the whole batch
+    (EasyOCR batched inference, parallel Tesseract, batched Vision requests)
+    and the three engines run concurrently. Returns a list of
+    (tesseract_text, easyocr_text, google_vision_text), one per image, plus
+    batch-level timings per engine.
+    """
+    texts = {name: [""] * len(image_paths) for name in OCR_BATCH_ENGINES}
+    timings = {name: {'seconds': 0.0, 'status': 'disabled'} for name in OCR_BATCH_ENGINES}
+    if not image_paths:
+        return [], timings
+
+    preprocess_started = time.perf_counter()
+    with span('preprocess', kind='ocr', images=len(image_paths)):
+        with ThreadPoolExecutor(max_workers=OCR_PREPROCESS_WORKERS, thread_name_prefix='preprocess') as pool:
+            prepared = list(pool.map(preprocess_for_ocr, image_paths))
+    ocr_images = [ocr_image for ocr_image, report in prepared]
+    timings['preprocess'] = {
+        'before_pixels': sum(report['before_pixels'] for ocr_image, report in prepared),
+        'after_pixels': sum(report['after_pixels'] for ocr_image, report in prepared),
+        'seconds': round(time.perf_counter() - preprocess_started, 3),
+        'status': 'ok'
+    }
+
+    started = time.monotonic()
+    futures = {name: ocr_engine_slots.submit(name, with_current_span(run_ocr_engine), batch_fn, ocr_images)
+               for name, batch_fn in OCR_BATCH_ENGINES.items() if ocr_backends[name].enabled}
+    for name, future in futures.items():
+        if future is None:
+            log.warning('ocr.engine_shed', engine=name, batch_size=len(image_paths))
+            timings[name] = {'seconds': 0.0, 'status': 'shed'}
+            continue
+        # The per-image deadline scales with the batch size
+        deadline = OCR_ENGINE_TIMEOUTS.get(name, OCR_DEFAULT_TIMEOUT) * len(image_paths)
+        remaining = max(deadline - (time.monotonic() - started), 0)
+        try:
+            batch_texts, seconds, status = future.result(timeout=remaining)
+        except FuturesTimeoutError:
+            future.cancel()
+            batch_texts, seconds, status = None, time.monotonic() - started, 'timeout'
+            log.warning('ocr.engine_timeout', engine=name, deadline_seconds=deadline, batch_size=len(image_paths))
+        if batch_texts:
+            texts[name] = batch_texts
+        timings[name] = {'seconds': round(seconds, 3), 'status': status}
+
+    estimate_time_saved(timings, timings['preprocess'])
+    results = list(zip(texts['tesseract'], texts['easyocr'], texts['google_vision']))
+    return results, timings
+
+# ---------------------------------------------------------------------------
+# OCR engine policy (per-engine scoring and adaptive selection)
+# ---------------------------------------------------------------------------
+
+# How the fusion prompt refers to each engine's section
+OCR_PROMPT_NAMES = {'tesseract': 'Tesseract', 'easyocr': 'EasyOCR', 'google_vision': 'Google Vision'}
+# Which engine the fusion prompt trusts for each field until the policy has learned better
+OCR_DEFAULT_FIELD_ENGINES = {'doctor': 'google_vision', 'medicine': 'easyocr', 'dosage': 'tesseract'}
+
+def classify_image(ocr_image):
+    """'printed', 'handwritten' or 'unknown' (too few text lines to tell)
+
+    Printed pages have evenly sized text lines with clean blank rows between
+    them; handwriting has uneven line heights and little empty space. A cheap
+    heuristic on a downsampled copy, only used to pick OCR engines.
+    """
+    with span('classify', kind='ocr'):
+        small = ocr_image.image.convert('L')
+        small.thumbnail((OCR_CLASSIFY_SAMPLE_SIZE, OCR_CLASSIFY_SAMPLE_SIZE))
+        pixels = np.asarray(small)
+        text_rows = (pixels <= otsu_threshold(pixels)).mean(axis=1) > PREPROCESS_CROP_INK_FRACTION
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], text_rows.astype(np.int8), [0]))))
+        heights = edges[1::2] - edges[::2]
+        if heights.size < 3:
+            return 'unknown'
+        line_cv = float(heights.std() / heights.mean())
+        blank_rows = 1.0 - float(text_rows.mean())
+        if line_cv <= OCR_PRINTED_MAX_LINE_CV and blank_rows >= OCR_PRINTED_MIN_BLANK_ROWS:
+            return 'printed'
+        return 'handwritten'
+
+def ocr_text_confidence(text, cur=None):
+    """How usable one engine's text looks on its own, 0-1
+
+    Half from the share of tokens that look like real words or numbers
+    (garbled OCR produces fragments like 'rn@l1'), half from whether the
+    rule-based parser finds known medicines, with dosages, in it. Pass cur
+    when holding a connection (see MedicineCatalog.index).
+    """
+    tokens = text.split()
+    if not tokens:
+        return 0.0
+    clean = sum(1 for token in tokens
+                if re.fullmatch(r"[A-Za-z][a-z]+[.,:;)]?|\(?\d+(?:[./:-]\d+)*[A-Za-z%]*[.,)]?", token))
+    medicines = parse_engine_text(text, medicine_catalog.index(cur))['medicines']
+    medicine_signal = 0.0
+    if medicines:
+        medicine_signal = 0.5 + 0.5 * sum(1 for fields in medicines.values() if fields['dosage']) / len(medicines)
+    return 0.5 * clean / len(tokens) + 0.5 * medicine_signal
+
+def engine_agreement(text, parsed_data):
+    """Share of the saved result that one engine's text contains, overall and per field
+
+    Medicine names and the doctor's name match token by token, allowing
+    small OCR typos; dosages match with spacing ignored ('500 mg' = '500mg').
+    A field is None when the saved result has nothing for it.
+    """
+    tokens = set(re.findall(r'[a-z0-9]+', text.lower()))
+    token_list = list(tokens)
+    compact = re.sub(r'\s+', '', text.lower())
+
+    def name_score(value):
+        value_tokens = [token for token in re.findall(r'[a-z0-9]+', value.lower()) if token != 'dr']
+        if not value_tokens:
+            return None
+        hits = sum(1 for token in value_tokens if token in tokens or
+                   (len(token) >= 4 and difflib.get_close_matches(token, token_list, n=1, cutoff=0.8)))
+        return hits / len(value_tokens)
+
+    items = {'medicine': [], 'dosage': [], 'doctor': []}
+    for medicine in parsed_data.get('medicines', []):
+        score = name_score(medicine.get('name') or '')
+        if score is not None:
+            items['medicine'].append(score)
+        dosage = re.sub(r'\s+', '', (medicine.get('dosage') or '').lower())
+        if dosage:
+            items['dosage'].append(1.0 if dosage in compact else 0.0)
+    doctor_score = name_score(parsed_data.get('doctor_name') or '')
+    if doctor_score is not None:
+        items['doctor'].append(doctor_score)
+
+    scores = {field: sum(values) / len(values) if values else None for field, values in items.items()}
+    every = [score for values in items.values() for score in values]
+    scores['overall'] = sum(every) / len(every) if every else None
+    return scores
+
+class OCRPolicy:
+    """Per-engine latency and agreement statistics, and the adaptive choice built on them
+
+    Statistics are kept per (engine, image class) as running averages:
+    latency of successful runs, and agreement of the engine's text with the
+    result that was saved, overall and per field. Agreement is only scored
+    when at least two engines ran, since a result fused from one engine
+    trivially agrees with it. Past runs are loaded from ocr_engine_run on
+    first use, so a restart does not start learning from scratch.
+    """
+
+    FIELDS = ('overall', 'medicine', 'dosage', 'doctor')
+
+    def __init__(self, min_samples, min_agreement, explore_rate, smoothing, history_rows):
+        self.min_samples = min_samples
+        self.min_agreement = min_agreement
+        self.explore_rate = explore_rate
+        self.smoothing = smoothing
+        self.history_rows = history_rows
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.engines = {}
+        self.decisions = {'all_learning': 0, 'all_required': 0, 'explore': 0, 'single': 0, 'escalated': 0}
+
+    def _entry(self, engine, image_class):
+        key = (engine, image_class)
+        if key not in self.engines:
+            self.engines[key] = {'runs': 0, 'failures': 0, 'seconds': None, 'scored': 0,
+                                 'agreement': {field: None for field in self.FIELDS}}
+        return self.engines[key]
+
+    def _average(self, current, value):
+        return value if current is None else current + self.smoothing * (value - current)
+
+    def _load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+        try:
+            with db_pool.connection() as conn:
+                cur = conn.cursor(dictionary=True)
+                cur.execute("""
+                    SELECT engine, image_class, COUNT(*) AS runs, AVG(seconds) AS seconds,
+                           COUNT(agreement) AS scored, AVG(agreement) AS overall,
+                           AVG(medicine_agreement) AS medicine, AVG(dosage_agreement) AS dosage,
+                           AVG(doctor_agreement) AS doctor
+                    FROM (SELECT * FROM ocr_engine_run WHERE status = 'ok'
+                          ORDER BY run_id DESC LIMIT %s) recent
+                    GROUP BY engine, image_class
+                """, (self.history_rows,))
+                rows = cur.fetchall()
+                cur.close()
+        except mysql.connector.Error as e:
+            log.warning('ocr.policy_history_unavailable', error=str(e))
+            return
+        with self.lock:
+            for row in rows:
+                entry = self._entry(row['engine'], row['image_class'])
+                entry['runs'] += row['runs']
+                entry['scored'] += row['scored']
+                entry['seconds'] = self._average(entry['seconds'], float(row['seconds']))
+                for field in self.FIELDS:
+                    if row[field] is not None:
+                        entry['agreement'][field] = self._average(entry['agreement'][field], float(row[field]))
+        log.info('ocr.policy_loaded', groups=len(rows))
+
+    def record(self, engine, image_class, seconds, status, scores):
+        with self.lock:
+            entry = self._entry(engine, image_class)
+            if status != 'ok':
+                entry['failures'] += 1
+                return
+            entry['runs'] += 1
+            entry['seconds'] = self._average(entry['seconds'], seconds)
+            if scores is not None and scores['overall'] is not None:
+                entry['scored'] += 1
+                for field in self.FIELDS:
+                    if scores[field] is not None:
+                        entry['agreement'][field] = self._average(entry['agreement'][field], scores[field])
+
+    def count(self, decision):
+        with self.lock:
+            self.decisions[decision] += 1
+
+    def first_engine(self, image_class, engines):
+        """Engine to run on its own first, or None to run every engine"""
+        self._load()
+        if random.random() < self.explore_rate:
+            self.count('explore')
+            return None
+        with self.lock:
+            entries = [(engine, self.engines.get((engine, image_class))) for engine in engines]
+            if any(entry is None or entry['scored'] < self.min_samples for engine, entry in entries):
+                self.decisions['all_learning'] += 1
+                return None
+            for engine, entry in sorted(entries, key=lambda item: item[1]['seconds']):
+                if entry['agreement']['overall'] >= self.min_agreement:
+                    return engine
+            # No single engine is good enough for this kind of image
+            self.decisions['all_required'] += 1
+            return None
+
+    def field_engine(self, field, available):
+        """Engine whose text agrees best with saved results on field, across image classes"""
+        with self.lock:
+            totals = {}
+            for (engine, image_class), entry in self.engines.items():
+                score = entry['agreement'][field]
+                if engine in available and score is not None:
+                    scored, weighted = totals.get(engine, (0, 0.0))
+                    totals[engine] = (scored + entry['scored'], weighted + score * entry['scored'])
+        trained = {engine: weighted / scored for engine, (scored, weighted) in totals.items()
+                   if scored >= self.min_samples}
+        if len(trained) < len(available) or not trained:
+            return OCR_DEFAULT_FIELD_ENGINES[field]
+        return max(trained, key=trained.get)
+
+    def stats(self):
+        with self.lock:
+            engines = {}
+            for (engine, image_class), entry in sorted(self.engines.items()):
+                engines.setdefault(engine, {})[image_class] = {
+                    'runs': entry['runs'],
+                    'failures': entry['failures'],
+                    'scored': entry['scored'],
+                    'seconds': round(entry['seconds'], 3) if entry['seconds'] is not None else None,
+                    'agreement': {field: round(score, 3) if score is not None else None
+                                  for field, score in entry['agreement'].items()}
+                }
+            return {'policy': OCR_POLICY, 'decisions': dict(self.decisions), 'engines': engines}
+
+ocr_policy = OCRPolicy(OCR_POLICY_MIN_SAMPLES, OCR_POLICY_MIN_AGREEMENT, OCR_POLICY_EXPLORE_RATE,
+                       OCR_POLICY_SMOOTHING, OCR_POLICY_HISTORY_ROWS)
+metrics.register_stats('medivault_ocr_policy', 'OCR engine selection decisions',
+                       lambda: {'decisions': ocr_policy.stats()['decisions']})
+
+def record_ocr_run(job_id, prescription_id, texts, timings, parsed_data):
+    """Score every engine that ran against the saved result; update the policy and ocr_engine_run"""
+    image_class = timings['policy']['image_class']
+    ran = [name for name in texts if timings[name]['status'] == 'ok']
+    now = datetime.now()
+    for name, text in texts.items():
+        timing = timings[name]
+        if timing['status'] in ('disabled', 'skipped', 'shed'):
+            continue
+        scores = engine_agreement(text, parsed_data) if len(ran) >= 2 and timing['status'] == 'ok' else None
+        ocr_policy.record(name, image_class, timing['seconds'], timing['status'], scores)
+        scores = scores or {field: None for field in OCRPolicy.FIELDS}
+        audit_writer.write('ocr_engine_run', (job_id, prescription_id, name, image_class, timing['seconds'],
+                                              timing['status'], len(text), scores['overall'], scores['medicine'],
+                                              scores['dosage'], scores['doctor'], now))
+
+def fusion_prompt_rules(texts):
+    """The 'which engine to trust for what' line of the fusion prompt, from the learned agreement"""
+    available = [name for name, text in texts.items() if text.strip()] or list(OCR_PROMPT_NAMES)
+    doctor, medicine, dosage = (OCR_PROMPT_NAMES[ocr_policy.field_engine(field, available)]
+                                for field in ('doctor', 'medicine', 'dosage'))
+    return f"Doctor names from {doctor}, medicine names from {medicine}, dosages from {dosage}."
+
+# ---------------------------------------------------------------------------
+# Groq fusion client
+# ---------------------------------------------------------------------------
+
+class FusionError(Exception):
+    """The Groq call failed after retries, or the circuit breaker is open"""
+
+class GroqClient:
+    """Chat-completions client for the fusion call
+
+    Keeps a keep-alive connection pool, bounds concurrent calls, retries 429
+    and 5xx responses with exponential backoff and full jitter, opens a
+    circuit breaker after repeated failures, and coalesces identical
+    in-flight prompts into a single request. api_url can point at a local
+    stub server for testing.
+    """
+
+    RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_url, api_key, model, timeout=45, pool_size=10, max_concurrency=4,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0,
+                 breaker_threshold=5, breaker_cooldown=30, latency_buckets=(0.5, 1, 2, 5, 10, 20, 45)):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = {}
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self.latency_buckets = tuple(latency_buckets)
+        self.latency_counts = [0] * (len(self.latency_buckets) + 1)
+        self.latency_sum = 0.0
+        self.calls = {'ok': 0, 'error': 0, 'coalesced': 0, 'rejected': 0, 'retries': 0}
+
+    def complete(self, prompt, temperature=0.05, max_tokens=2000):
+        """Return the assistant message for prompt, sharing the result with identical concurrent calls"""
+        key = hashlib.sha256(f"{self.model}\0{temperature}\0{max_tokens}\0{prompt}".encode('utf-8')).hexdigest()
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.calls['coalesced'] += 1
+                leader = False
+            else:
+                future = self.in_flight[key] = Future()
+                leader = True
+        if not leader:
+            return future.result()
+        try:
+            result = self._call(prompt, temperature, max_tokens)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.in_flight.pop(key, None)
+
+    def _allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.breaker_cooldown or self.trial_in_progress:
+                self.calls['rejected'] += 1
+                return False
+            # Half-open: let one trial request through
+            self.trial_in_progress = True
+            return True
+
+    def _record_outcome(self, ok, seconds):
+        with self.lock:
+            self.trial_in_progress = False
+            self.latency_sum += seconds
+            self.latency_counts[bisect.bisect_left(self.latency_buckets, seconds)] += 1
+            if ok:
+                self.calls['ok'] += 1
+                self.consecutive_failures = 0
+                self.opened_at = None
+            else:
+                self.calls['error'] += 1
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.breaker_threshold:
+                    self.opened_at = time.monotonic()
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _call(self, prompt, temperature, max_tokens):
+        if not self._allow_request():
+            raise FusionError("Groq circuit breaker is open")
+        payload = {
+            "model": self.model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": temperature,
+            "max_tokens": max_tokens
+        }
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        started = time.perf_counter()
+        error = None
+        ok = False
+        # The outcome is recorded on every exit, so an unexpected exception cannot leave a half-open trial stuck
+        try:
+            for attempt in range(self.max_retries + 1):
+                response = None
+                # A slot is held per attempt only, so a caller sleeping through backoff does not block others
+                try:
+                    with self.slots:
+                        with span('chat_completions', kind='groq', attempt=attempt) as attempt_span:
+                            response = self.session.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+                            attempt_span.set(status=response.status_code)
+                        if response.status_code == 200:
+                            content = response.json()['choices'][0]['message']['content']
+                            ok = True
+                            return content
+                    error = FusionError(f"Groq returned HTTP {response.status_code}")
+                    if response.status_code not in self.RETRYABLE_STATUS:
+                        break
+                except requests.RequestException as e:
+                    error = FusionError(f"Groq request failed: {e}")
+                except (ValueError, KeyError, IndexError) as e:
+                    error = FusionError(f"Unexpected Groq response: {e}")
+                    break
+                if attempt < self.max_retries:
+                    with self.lock:
+                        self.calls['retries'] += 1
+                    time.sleep(self._backoff(attempt, response))
+            raise error
+        finally:
+            self._record_outcome(ok, time.perf_counter() - started)
+
+    def stats(self):
+        with self.lock:
+            cumulative = 0
+            histogram = {}
+            for bound, count in zip(self.latency_buckets + (float('inf'),), self.latency_counts):
+                cumulative += count
+                histogram['+Inf' if bound == float('inf') else str(bound)] = cumulative
+            return {
+                'calls': dict(self.calls),
+                'circuit': 'closed' if self.opened_at is None else 'open',
+                'consecutive_failures': self.consecutive_failures,
+                'latency_seconds_sum': round(self.latency_sum, 3),
+                'latency_seconds_buckets': histogram
+            }
+
+groq_client = GroqClient(GROQ_API_URL, GROQ_API_KEY, GROQ_MODEL, timeout=GROQ_TIMEOUT,
+                         pool_size=GROQ_POOL_SIZE, max_concurrency=GROQ_MAX_CONCURRENCY,
+                         max_retries=GROQ_MAX_RETRIES, breaker_threshold=GROQ_BREAKER_THRESHOLD,
+                         breaker_cooldown=GROQ_BREAKER_COOLDOWN)
+# Latency is already exported as the 'groq' span histogram
+metrics.register_stats('medivault_groq', 'Groq fusion client statistics', lambda: {
+    **{key: value for key, value in groq_client.stats().items() if key != 'latency_seconds_buckets'},
+    'circuit_open': groq_client.opened_at is not None
+})
+
+def parse_prescription_with_groq_fusion(tesseract_text, easyocr_text, google_vision_text):
+    """Use Groq AI to intelligently fuse ALL THREE OCR results
+
+    Raises FusionError when Groq is unavailable or its answer is not JSON,
+    so the caller can fail the upload instead of saving an empty prescription.
+    """
+    log.info('fusion.llm_request', model=GROQ_MODEL)
+    rules = fusion_prompt_rules({'tesseract': tesseract_text, 'easyocr': easyocr_text,
+                                 'google_vision': google_vision_text})
+    
+    prompt = f"""You are an expert medical prescription parser with THREE OCR extractions of the SAME prescription.
+
+TESSERACT OCR:
+{tesseract_text}
+
+EASYOCR:
+{easyocr_text}
+
+GOOGLE VISION API:
+{google_vision_text}
+
+Combine the best from each OCR. Return ONLY valid JSON:
+{{
+    "doctor_name": "name or empty",
+    "date": "DD/MM/YYYY or empty",
+    "medicines": [
+        {{
+            "name": "medicine name",
+            "dosage": "100mg or empty",
+            "frequency": "BID/TID/QD or empty",
+            "duration": "5 days or empty"
+        }}
+    ]
+}}
+
+Rules: {rules} Fix typos. Return ONLY JSON."""
+
+    try:
+        ai_response = groq_client.complete(prompt)
+    except FusionError as e:
+        log.error('fusion.llm_failed', error=str(e))
+        raise
+    json_match = re.search(r'\{[\s\S]*\}', ai_response)
+    try:
+        parsed_data = json.loads(json_match.group()) if json_match else None
+    except ValueError:
+        parsed_data = None
+    if not isinstance(parsed_data, dict):
+        log.error('fusion.llm_failed', error='no JSON object in response')
+        raise FusionError("Groq response did not contain a JSON object")
+    log.info('fusion.llm_done', medicines=len(parsed_data.get('medicines', [])))
+    return parsed_data
+
+# ---------------------------------------------------------------------------
+# Local fast-path parser (skips the LLM for clean, agreeing OCR output)
+# ---------------------------------------------------------------------------
+
+DOSAGE_PATTERN = re.compile(r'\b(\d+(?:\.\d+)?)\s?(mg|mcg|g|ml|iu|units?)\b', re.IGNORECASE)
+FREQUENCY_PATTERNS = [
+    (re.compile(r'\b(?:QID|QDS|four times)\b', re.IGNORECASE), 'QID'),
+    (re.compile(r'\b(?:TID|TDS|thrice|three times)\b|\b1\s?-\s?1\s?-\s?1\b', re.IGNORECASE), 'TID'),
+    (re.compile(r'\b(?:BID|BD|twice)\b|\b1\s?-\s?0\s?-\s?1\b', re.IGNORECASE), 'BID'),
+    (re.compile(r'\b(?:HS|at bedtime|at night)\b|\b0\s?-\s?0\s?-\s?1\b', re.IGNORECASE), 'HS'),
+    (re.compile(r'\b(?:QD|OD|once daily|once a day|daily)\b|\b(?:1\s?-\s?0\s?-\s?0|0\s?-\s?1\s?-\s?0)\b', re.IGNORECASE), 'QD'),
+    (re.compile(r'\b(?:SOS|PRN|as needed|when required)\b', re.IGNORECASE), 'SOS'),
+]
+DURATION_PATTERN = re.compile(r'\b(?:x|for)?\s*(\d+)\s*(days?|weeks?|months?)\b', re.IGNORECASE)
+DATE_PATTERN = re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b')
+DOCTOR_PATTERN = re.compile(r'\bDr\.?[ \t]+([A-Z][A-Za-z]+(?:[ \t]+[A-Z][A-Za-z]*\.?){0,2})')
+
+# Dosage forms written around medicine names ('Tab. Dolo 650', 'Syp Cetirizine'); not part of the name
+MEDICINE_FORM_PATTERN = re.compile(
+    r'\b(?:tabs?|tablets?|caps?|capsules?|syp|syrup|inj|injection|oint|ointment|cream|gel|drops?|susp|suspension)\b\.?',
+    re.IGNORECASE)
+
+def clean_medicine_name(name):
+    """Display form of an extracted name for the medicine table: no dosage form or strength"""
+    text = DOSAGE_PATTERN.sub(' ', MEDICINE_FORM_PATTERN.sub(' ', name or ''))
+    return ' '.join(text.split()).strip(' .,;:-')[:100]
+
+def medicine_key(name):
+    """Normalized name used for matching: lower case words, no dosage form or strength"""
+    return ' '.join(re.findall(r'[a-z0-9]+', clean_medicine_name(name).lower()))
+
+def plausible_medicine_name(name):
+    """Whether an extracted name unknown to the catalog looks real enough to add to the medicine table
+
+    Rejects OCR debris ('rn@l1', 'xqzt'), instructions the LLM mistook for a
+    name and placeholders like 'Unknown': the name must start with a
+    letter, have a word of three or more letters with a vowel in it, use
+    only the characters medicine names do, and be at most
+    MEDICINE_NAME_MAX_WORDS words long.
+    """
+    display = clean_medicine_name(name)
+    key = medicine_key(display)
+    words = key.split()
+    if not words or key in MEDICINE_NAME_PLACEHOLDERS or len(words) > MEDICINE_NAME_MAX_WORDS:
+        return False
+    if not re.fullmatch(r"[A-Za-z0-9 +\-/.,()'&%]+", display):
+        return False
+    return words[0][0].isalpha() and any(len(word) >= 3 and word.isalpha() and re.search(r'[aeiouy]', word)
+                                         for word in words)
+
+class MedicineCatalog:
+    """The medicine master table in memory, for the fast-path parser and for name normalization
+
+    by_first_token indexes verified names by first word for line matching.
+    by_key maps every normalized name to medicine_id, and a trigram index
+    over those keys finds the closest known medicine for OCR and LLM
+    spelling variants. Names resolve() adds from extracted prescriptions are
+    unverified: they normalize later spellings but the fast-path parser does
+    not trust them until `flask verify-medicines` marks them. The whole
+    catalog is reloaded every reload_interval seconds to pick up medicines
+    added by other processes; medicines added through resolve() are indexed
+    straight away.
+    """
+
+    def __init__(self, reload_interval, min_similarity):
+        self.reload_interval = reload_interval
+        self.min_similarity = min_similarity
+        self.lock = threading.Lock()
+        self.by_first_token = {}
+        self.by_key = {}
+        self.trigrams = {}
+        self.loaded_at = None
+        self.matches = {'exact': 0, 'fuzzy': 0, 'created': 0, 'rejected': 0, 'unmatched': 0}
+
+    def index(self, cur=None):
+        """Verified names by first token, reloading first if stale
+
+        Pass cur when the caller has a connection open, so the reload reads on
+        it instead of taking a second pooled connection mid-transaction.
+        """
+        with self.lock:
+            if self.loaded_at is not None and time.monotonic() - self.loaded_at < self.reload_interval:
+                return self.by_first_token
+        self.reload(cur)
+        return self.by_first_token
+
+    def reload(self, cur=None):
+        sql = "SELECT medicine_id, medicine_name, verified FROM medicine"
+        if cur is not None:
+            cur.execute(sql)
+            rows = self._tuples(cur.fetchall())
+        else:
+            with db_pool.connection() as conn:
+                own_cur = conn.cursor()
+                own_cur.execute(sql)
+                rows = own_cur.fetchall()
+                own_cur.close()
+        by_first_token, by_key, trigrams = {}, {}, {}
+        for medicine_id, name, verified in rows:
+            self._add(by_first_token, by_key, trigrams, medicine_id, name, verified)
+        with self.lock:
+            self.by_first_token, self.by_key, self.trigrams = by_first_token, by_key, trigrams
+            self.loaded_at = time.monotonic()
+
+    def invalidate(self):
+        """Reload on next use; called after a rollback may have discarded medicines added by resolve()"""
+        with self.lock:
+            self.loaded_at = None
+
+    @staticmethod
+    def _tuples(rows):
+        # The caller's cursor may be a dictionary cursor
+        return [(row['medicine_id'], row['medicine_name'], row['verified']) if isinstance(row, dict) else row
+                for row in rows]
+
+    @staticmethod
+    def _add(by_first_token, by_key, trigrams, medicine_id, name, verified=True):
+        tokens = tuple(re.findall(r'[a-z0-9]+', name.lower()))
+        if tokens and verified:
+            # Longest names first so "Dolo 650" wins over "Dolo"; a new list, as the parser may be reading the old one
+            by_first_token[tokens[0]] = sorted(by_first_token.get(tokens[0], []) + [(tokens, name)],
+                                               key=lambda candidate: len(candidate[0]), reverse=True)
+        key = medicine_key(name)
+        if key and key not in by_key:
+            by_key[key] = medicine_id
+            for trigram in token_trigrams(key):
+                trigrams.setdefault(trigram, set()).add(key)
+
+    def match(self, name):
+        """medicine_id of the known medicine an extracted name refers to, or None
+
+        Exact on the normalized name, else the most similar name by trigram
+        overlap above min_similarity. Numbers in the name must agree, since
+        'Dolo 500' and 'Dolo 650' are different products.
+        """
+        key = medicine_key(name)
+        if not key:
+            return None, None
+        with self.lock:
+            if key in self.by_key:
+                return self.by_key[key], 'exact'
+            if len(key) < MEDICINE_MATCH_MIN_LENGTH:
+                return None, None
+            key_trigrams = token_trigrams(key)
+            shared = {}
+            for trigram in key_trigrams:
+                for candidate in self.trigrams.get(trigram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            numbers = re.findall(r'\d+', key)
+            best, best_similarity = None, 0.0
+            for candidate, count in shared.items():
+                similarity = count / (len(key_trigrams) + len(token_trigrams(candidate)) - count)
+                if (similarity >= self.min_similarity and similarity > best_similarity
+                        and re.findall(r'\d+', candidate) == numbers):
+                    best, best_similarity = candidate, similarity
+            if best is None:
+                return None, None
+            return self.by_key[best], 'fuzzy'
+
+    def resolve(self, cur, names):
+        """{name: medicine_id} for extracted names, adding unknown medicines to the medicine table
+
+        Runs on the caller's cursor and transaction, so new medicines commit
+        (or roll back) with the prescription that introduced them. Unknown
+        names are added unverified, and only if plausible_medicine_name()
+        accepts them; the rest stay unlinked. The name as extracted is still
+        what gets stored in prescription_medication.
+        """
+        self.index(cur)
+        resolved = {}
+        missing = {}
+        outcomes = []
+        for name in set(names):
+            medicine_id, how = self.match(name)
+            if medicine_id is not None:
+                resolved[name] = medicine_id
+                outcomes.append(how)
+                continue
+            display = clean_medicine_name(name)
+            if display and plausible_medicine_name(display):
+                missing.setdefault(display.casefold(), (display, []))[1].append(name)
+            else:
+                outcomes.append('rejected' if display else 'unmatched')
+        if missing:
+            cur.executemany("INSERT IGNORE INTO medicine (medicine_name, verified) VALUES (%s, 0)",
+                            [(display,) for display, found in missing.values()])
+            cur.execute(f"SELECT medicine_id, medicine_name, verified FROM medicine WHERE medicine_name IN "
+                        f"({', '.join(['%s'] * len(missing))})", [display for display, found in missing.values()])
+            rows = self._tuples(cur.fetchall())
+            with self.lock:
+                for medicine_id, medicine_name, verified in rows:
+                    self._add(self.by_first_token, self.by_key, self.trigrams, medicine_id, medicine_name, verified)
+                    for name in missing.get(medicine_name.casefold(), (None, []))[1]:
+                        resolved[name] = medicine_id
+                        outcomes.append('created')
+        with self.lock:
+            for how in outcomes:
+                self.matches[how] += 1
+        return resolved
+
+    def stats(self):
+        with self.lock:
+            return {'medicines': len(self.by_key), 'matches': dict(self.matches)}
+
+medicine_catalog = MedicineCatalog(FAST_PATH_CATALOG_RELOAD, MEDICINE_MATCH_MIN_SIMILARITY)
+metrics.register_stats('medivault_medicine_catalog', 'Medicine name normalization', medicine_catalog.stats)
+
+def warm_up_medicine_catalog():
+    try:
+        medicine_catalog.index()
+    except Exception as e:
+        log.warning('medicine_catalog.warmup_failed', error=str(e))
+
+def match_frequency(text):
+    for pattern, frequency in FREQUENCY_PATTERNS:
+        if pattern.search(text):
+            return frequency
+    return ''
+
+def looks_like_rx_line(line):
+    """Whether a line reads like a medicine entry: it carries a dosage, a frequency or a dosage form"""
+    return bool(DOSAGE_PATTERN.search(line) or MEDICINE_FORM_PATTERN.search(line) or match_frequency(line))
+
+def parse_engine_text(text, catalog):
+    """Rule-based parse of one OCR engine's text
+
+    Besides the fields, reports rx_lines (lines that look like medicine
+    entries) and unmatched_rx_lines: those with no catalog medicine on them,
+    except frequency-only lines below a medicine, which are its instructions.
+    A strength or dosage form starts a new entry, so it needs its own match.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    matches_by_line = []
+    for line in lines:
+        tokens = re.findall(r'[a-z0-9]+', line.lower())
+        matches = []
+        for position, token in enumerate(tokens):
+            match = next((name for name_tokens, name in catalog.get(token, ())
+                          if tuple(tokens[position:position + len(name_tokens)]) == name_tokens), None)
+            if match is not None and match not in matches:
+                matches.append(match)
+        matches_by_line.append(matches)
+    
+    medicines = {}
+    for number, (line, matches) in enumerate(zip(lines, matches_by_line)):
+        context = line
+        # Instructions are often on the line below the medicine name
+        if number + 1 < len(lines) and not matches_by_line[number + 1]:
+            context += ' ' + lines[number + 1]
+        for match in matches:
+            if match in medicines:
+                continue
+            dosage = DOSAGE_PATTERN.search(context)
+            duration = DURATION_PATTERN.search(context)
+            medicines[match] = {
+                'dosage': f"{dosage.group(1)}{dosage.group(2).lower()}" if dosage else '',
+                'frequency': match_frequency(context),
+                'duration': f"{duration.group(1)} {duration.group(2).lower()}" if duration else ''
+            }
+    rx_lines = 0
+    unmatched_rx_lines = []
+    for number, (line, matches) in enumerate(zip(lines, matches_by_line)):
+        if not looks_like_rx_line(line):
+            continue
+        rx_lines += 1
+        if matches:
+            continue
+        instructions = (number > 0 and matches_by_line[number - 1]
+                        and not DOSAGE_PATTERN.search(line) and not MEDICINE_FORM_PATTERN.search(line))
+        if not instructions:
+            unmatched_rx_lines.append(line)
+    doctor = DOCTOR_PATTERN.search(text)
+    date = DATE_PATTERN.search(text)
+    date_text = ''
+    if date:
+        day, month, year = date.groups()
+        date_text = f"{int(day):02d}/{int(month):02d}/{year if len(year) == 4 else '20' + year}"
+    return {
+        'medicines': medicines,
+        'doctor_name': f"Dr. {doctor.group(1).strip()}" if doctor else '',
+        'date': date_text,
+        'rx_lines': rx_lines,
+        'unmatched_rx_lines': unmatched_rx_lines
+    }
+
+def majority(values):
+    """Most common value and how many times it occurs"""
+    counts = {}
+    for value in values:
+        counts[value] = counts.get(value, 0) + 1
+    value = max(counts, key=counts.get)
+    return value, counts[value]
+
+def parse_coverage(parses):
+    """Share of the prescription-looking lines, over every engine, that matched a catalog medicine"""
+    rx_lines = sum(parse['rx_lines'] for parse in parses)
+    if not rx_lines:
+        return 1.0
+    return 1 - sum(len(parse['unmatched_rx_lines']) for parse in parses) / rx_lines
+
+def fast_path_parse(texts, cur=None):
+    """Parse locally from agreement between the OCR engines
+
+    Returns (parsed_data, confidence), or (None, 0.0) when the LLM must
+    decide. Confidence is the mean of every agreement signal (the share of
+    engines that found each medicine and the share agreeing on each
+    dosage/frequency/duration, doctor and date) scaled by the coverage:
+    the share of prescription-looking lines that matched the catalog.
+    Coverage below FAST_PATH_MIN_COVERAGE means a medicine the catalog does
+    not know, so the LLM is used.
+
+    A single engine's text (the adaptive OCR policy did not escalate) has
+    no agreement to measure; it is parsed locally only when it scores at
+    least FAST_PATH_SINGLE_ENGINE_MIN_CONFIDENCE on its own and every
+    medicine has a dosage.
+
+    A stale catalog is reloaded on cur, or on a pooled connection of its
+    own when cur is None; callers already holding a connection must pass
+    its cursor, or a full pool deadlocks.
+    """
+    catalog = medicine_catalog.index(cur)
+    present = [text for text in texts if text and text.strip()]
+    parses = [parse_engine_text(text, catalog) for text in present]
+    if not parses:
+        return None, 0.0
+    coverage = parse_coverage(parses)
+    if coverage < FAST_PATH_MIN_COVERAGE:
+        return None, 0.0
+    
+    if len(parses) == 1:
+        parse = parses[0]
+        if not parse['medicines'] or not all(fields['dosage'] for fields in parse['medicines'].values()):
+            return None, 0.0
+        confidence = ocr_text_confidence(present[0], cur) * coverage
+        if confidence < FAST_PATH_SINGLE_ENGINE_MIN_CONFIDENCE:
+            return None, 0.0
+        return {
+            'doctor_name': parse['doctor_name'],
+            'date': parse['date'],
+            'medicines': [{'name': name, **fields} for name, fields in parse['medicines'].items()]
+        }, confidence
+    if len(parses) < FAST_PATH_MIN_ENGINES:
+        return None, 0.0
+    
+    candidates = {}
+    for parse in parses:
+        for name, fields in parse['medicines'].items():
+            candidates.setdefault(name, []).append(fields)
+    if not candidates:
+        return None, 0.0
+    
+    agreements = []
+    medicines = []
+    for name, found in candidates.items():
+        support = len(found) / len(parses)
+        agreements.append(support)
+        if support < 0.5:
+            continue
+        medicine = {'name': name}
+        for field in ('dosage', 'frequency', 'duration'):
+            values = [fields[field] for fields in found if fields[field]]
+            medicine[field] = ''
+            if values:
+                medicine[field], count = majority(values)
+                agreements.append(count / len(found))
+        medicines.append(medicine)
+    
+    parsed_data = {'doctor_name': '', 'date': '', 'medicines': medicines}
+    for field in ('doctor_name', 'date'):
+        values = [parse[field] for parse in parses if parse[field]]
+        if values:
+            parsed_data[field], count = majority(values)
+            agreements.append(count / len(parses))
+    
+    return parsed_data, sum(agreements) / len(agreements) * coverage
+
+fusion_stats = {'fast_path': 0, 'llm': 0}
+fusion_stats_lock = threading.Lock()
+metrics.register_stats('medivault_fusion', 'Uploads fused by the local fast path and by the LLM',
+                       lambda: {'uploads': dict(fusion_stats)})
+
+def fuse_prescription(tesseract_text, easyocr_text, google_vision_text):
+    """Structured data from the three OCR texts: local parser if confident, else Groq
+
+    Returns (parsed_data, method) with method 'fast_path' or 'llm'. Raises
+    FusionError when the LLM is needed but unavailable.
+    """
+    try:
+        with span('fast_path', kind='fusion'):
+            parsed_data, confidence = fast_path_parse([tesseract_text, easyocr_text, google_vision_text])
+    except Exception as e:
+        log.warning('fusion.fast_path_error', error=str(e))
+        parsed_data, confidence = None, 0.0
+    
+    if parsed_data is not None and confidence >= FAST_PATH_MIN_CONFIDENCE:
+        method = 'fast_path'
+        log.info('fusion.fast_path', medicines=len(parsed_data['medicines']), confidence=round(confidence, 2))
+    else:
+        method = 'llm'
+        parsed_data = parse_prescription_with_groq_fusion(tesseract_text, easyocr_text, google_vision_text)
+    with fusion_stats_lock:
+        fusion_stats[method] += 1
+    return parsed_data, method
+
+def parse_prescription_date(date_text):
+    """Convert the AI-extracted date string into a date, or None"""
+    if not date_text:
+        return None
+    for fmt in ['%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y']:
+        try:
+            return datetime.strptime(date_text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+def medicine_names(parsed_data):
+    return [med.get('name', '') for med in parsed_data.get('medicines', [])]
+
+def medication_rows(prescription_id, parsed_data, medicine_ids):
+    return [(prescription_id, medicine_ids.get(med.get('name', '')), med.get('name', ''), med.get('dosage', ''),
+             med.get('frequency', ''), med.get('duration', ''))
+            for med in parsed_data.get('medicines', [])]
+
+def insert_prescription_row(cur, user_id, issue, description, parsed_data, relative_path, combined_text):
+    # INSERT with trigger (auto-logs to prescription_log)
+    cur.execute("""
+        INSERT INTO prescription 
+        (user_id, issue, description, doctor_name, prescription_date, file_path, extracted_text) 
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+    """, (user_id, issue, description, parsed_data.get('doctor_name', ''), 
+          parse_prescription_date(parsed_data.get('date')), relative_path, combined_text))
+    return cur.lastrowid
+
+def insert_medication_rows(cur, rows):
+    # Save medicines (triggers medicine_count update)
+    if rows:
+        cur.executemany("""
+            INSERT INTO prescription_medication 
+            (prescription_id, medicine_id, medicine_name, dosage, frequency, duration) 
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """, rows)
+
+def save_prescription(cur, user_id, issue, description, parsed_data, relative_path, combined_text):
+    """Insert a prescription and its medicines; the caller commits"""
+    defer_prescription_log(cur)
+    medicine_ids = medicine_catalog.resolve(cur, medicine_names(parsed_data))
+    prescription_id = insert_prescription_row(cur, user_id, issue, description, parsed_data,
+                                               relative_path, combined_text)
+    insert_medication_rows(cur, medication_rows(prescription_id, parsed_data, medicine_ids))
+    return prescription_id
+
+def save_prescription_batch(cur, user_id, items):
+    """Insert many prescriptions, then all of their medicines in one executemany; the caller commits
+
+    items are dicts with issue, description, parsed_data, relative_path and
+    combined_text. Returns the new prescription ids in the same order.
+    """
+    defer_prescription_log(cur)
+    names = [name for item in items for name in medicine_names(item['parsed_data'])]
+    medicine_ids = medicine_catalog.resolve(cur, names)
+    prescription_ids = []
+    rows = []
+    for item in items:
+        prescription_id = insert_prescription_row(cur, user_id, item['issue'], item['description'],
+                                                  item['parsed_data'], item['relative_path'],
+                                                  item['combined_text'])
+        prescription_ids.append(prescription_id)
+        rows.extend(medication_rows(prescription_id, item['parsed_data'], medicine_ids))
+    insert_medication_rows(cur, rows)
+    return prescription_ids
+
+def combine_ocr_texts(tesseract_text, easyocr_text, google_vision_text):
+    return f"TESSERACT:\n{tesseract_text}\n\nEASYOCR:\n{easyocr_text}\n\nGOOGLE:\n{google_vision_text}"
+
+# ---------------------------------------------------------------------------
+# OCR + fusion result cache
+# ---------------------------------------------------------------------------
+
+class ResultCache:
+    """Content-addressed cache of OCR texts and fused JSON, keyed by image hash
+
+    Two tiers: an in-memory LRU of recent entries and a JSON file per entry
+    on disk. The disk tier is trimmed to max_disk_bytes, least recently used first.
+    """
+
+    def __init__(self, directory, max_memory_entries, max_disk_bytes):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.disk_bytes = sum(os.path.getsize(path) for path in self._disk_files())
+
+    def key_for(self, content_hash, config):
+        """Key from the image's SHA-256 (computed while the upload was stored) and the OCR config"""
+        digest = hashlib.sha256(content_hash.encode('ascii'))
+        digest.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _disk_files(self):
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json'):
+                    yield os.path.join(root, name)
+
+    def _remember(self, key, entry):
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_memory_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.memory_hits += 1
+                return self.memory[key]
+            path = self._path(key)
+            try:
+                with open(path, 'r', encoding='utf-8') as cache_file:
+                    entry = json.load(cache_file)
+                # Touch so disk eviction sees this entry as recently used
+                os.utime(path)
+            except (OSError, ValueError):
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key, entry):
+        data = json.dumps(entry).encode('utf-8')
+        path = self._path(key)
+        with self.lock:
+            self._remember(key, entry)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as cache_file:
+                cache_file.write(data)
+            os.replace(tmp_path, path)
+            self.disk_bytes += len(data) - previous_size
+            if self.disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        files = sorted(self._disk_files(), key=os.path.getmtime)
+        # Trim to 90% so we don't evict again on the very next write
+        target = self.max_disk_bytes * 0.9
+        for path in files:
+            if self.disk_bytes <= target:
+                break
+            size = os.path.getsize(path)
+            os.remove(path)
+            self.disk_bytes -= size
+            self.evictions += 1
+            self.memory.pop(os.path.basename(path)[:-len('.json')], None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_entries': len(self.memory),
+                'disk_bytes': self.disk_bytes
+            }
+
+ocr_cache = ResultCache(OCR_CACHE_DIR, OCR_CACHE_MEMORY_ENTRIES, OCR_CACHE_DISK_MAX_BYTES)
+metrics.register_stats('medivault_ocr_cache', 'OCR and fusion result cache statistics', ocr_cache.stats)
+
+@functools.lru_cache(maxsize=None)
+def ocr_engine_version(name):
+    """Installed version of an engine's package, read from its metadata without importing it"""
+    try:
+        return importlib.metadata.version(OCR_ENGINE_PACKAGES[name])
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+def ocr_cache_config():
+    """Everything besides the image bytes that changes the cached output
+
+    Built from configuration only; looking up the cache must not load the
+    engines. Results from an engine that failed to load are never cached
+    (see extract_text_triple_ocr), so availability need not be part of the key.
+    """
+    return {
+        'version': OCR_CACHE_VERSION,
+        'engines': {name: ocr_engine_version(name) for name in sorted(OCR_ENABLED_ENGINES) if name in ocr_backends},
+        'preprocess': [PREPROCESS_STEPS, PREPROCESS_TARGET_DPI, PREPROCESS_MAX_LONG_EDGE],
+        'fusion_model': GROQ_MODEL,
+        'policy': OCR_POLICY
+    }
+
+def fusion_succeeded(parsed_data):
+    # An empty result may just be a bad read; don't cache it so a re-upload gets another try
+    return bool(parsed_data.get('medicines') or parsed_data.get('doctor_name') or parsed_data.get('date'))
+
+# ---------------------------------------------------------------------------
+# Search index
+# ---------------------------------------------------------------------------
+
+def search_tokens(text):
+    return [token for token in re.findall(r'[a-z0-9]+', (text or '').lower()) if len(token) >= 2]
+
+def token_trigrams(token):
+    padded = f"^{token}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class UserSearchIndex:
+    """Inverted index over one user's prescriptions
+
+    postings maps token -> {prescription_id: best field weight}; a trigram
+    index over the vocabulary gives typo-tolerant lookups and a sorted copy of
+    the vocabulary gives prefix lookups, so query cost depends on the
+    vocabulary rather than on how many prescriptions the user has.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.postings = {}
+        self.trigrams = {}
+        self.sorted_vocabulary = None
+        # user_stats.data_version the index reflects, and the database time to reload changes from
+        self.version = None
+        self.synced_at = None
+
+    def add(self, doc):
+        self.remove(doc['prescription_id'])
+        fields = {
+            # The catalog name too, so a search for 'paracetamol' finds an OCR'd 'Paracetmol'
+            'medicine': ' '.join(f"{med['medicine_name'] or ''} {med.get('catalog_name') or ''}"
+                                 for med in doc['medicines']),
+            'issue': doc['issue'],
+            'doctor': doc['doctor_name'],
+            'text': doc['extracted_text']
+        }
+        weights = {}
+        for field, text in fields.items():
+            for token in search_tokens(text):
+                weights[token] = max(weights.get(token, 0), SEARCH_FIELD_WEIGHTS[field])
+        doc['tokens'] = weights
+        self.docs[doc['prescription_id']] = doc
+        for token, weight in weights.items():
+            if token not in self.postings:
+                self.postings[token] = {}
+                for trigram in token_trigrams(token):
+                    self.trigrams.setdefault(trigram, set()).add(token)
+                self.sorted_vocabulary = None
+            self.postings[token][doc['prescription_id']] = weight
+
+    def remove(self, prescription_id):
+        doc = self.docs.pop(prescription_id, None)
+        if doc is None:
+            return
+        for token in doc['tokens']:
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(prescription_id, None)
+            if not postings:
+                del self.postings[token]
+                for trigram in token_trigrams(token):
+                    self.trigrams[trigram].discard(token)
+                self.sorted_vocabulary = None
+
+    def matching_tokens(self, term):
+        """Vocabulary tokens that match a query term, with a match-quality factor"""
+        matches = {}
+        if term in self.postings:
+            matches[term] = 1.0
+        if self.sorted_vocabulary is None:
+            self.sorted_vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self.sorted_vocabulary, term)
+        for token in self.sorted_vocabulary[start:start + SEARCH_MAX_EXPANSIONS]:
+            if not token.startswith(term):
+                break
+            matches.setdefault(token, SEARCH_PREFIX_FACTOR)
+        if len(term) >= 3:
+            term_trigrams = token_trigrams(term)
+            shared = {}
+            for trigram in term_trigrams:
+                for token in self.trigrams.get(trigram, ()):
+                    shared[token] = shared.get(token, 0) + 1
+            for token, count in shared.items():
+                similarity = count / (len(term_trigrams) + len(token_trigrams(token)) - count)
+                if similarity >= SEARCH_FUZZY_MIN_SIMILARITY:
+                    matches.setdefault(token, SEARCH_FUZZY_FACTOR * similarity)
+        return matches
+
+    def search(self, query):
+        """Ranked list of (prescription_id, score); documents matching more query terms rank first"""
+        scores = {}
+        for term in set(search_tokens(query)):
+            term_scores = {}
+            for token, factor in self.matching_tokens(term).items():
+                for prescription_id, weight in self.postings[token].items():
+                    term_scores[prescription_id] = max(term_scores.get(prescription_id, 0), weight * factor)
+            for prescription_id, score in term_scores.items():
+                matched, total = scores.get(prescription_id, (0, 0.0))
+                scores[prescription_id] = (matched + 1, total + score)
+        ranked = sorted(scores.items(),
+                        key=lambda item: (item[1][0], item[1][1], self.docs[item[0]]['created_at']),
+                        reverse=True)
+        return [(prescription_id, round(total, 3)) for prescription_id, (matched, total) in ranked]
+
+def user_data_version(cur, user_id):
+    """user_stats.data_version: the prescription triggers bump it on every insert, edit and delete"""
+    cur.execute("SELECT data_version FROM user_stats WHERE user_id = %s", (user_id,))
+    row = cur.fetchone()
+    return row['data_version'] if row else 0
+
+class SearchIndex:
+    """Per-user search indexes, built lazily from MySQL and kept in sync on writes
+
+    Writes made by this process update the index directly. Before each
+    search the user's data_version is checked, as AnalyticsCache does; when
+    another worker process has changed the data, only the prescriptions
+    updated since the last sync are reloaded, and deleted ones are found
+    with an id-only query.
+    """
+
+    def __init__(self, max_users):
+        self.max_users = max_users
+        self.users = OrderedDict()
+        self.lock = threading.RLock()
+        self.syncs = {'current': 0, 'built': 0, 'incremental': 0}
+
+    def load_documents(self, cur, user_id, prescription_id=None, updated_since=None):
+        sql = """
+            SELECT p.prescription_id, p.issue, p.doctor_name, p.prescription_date,
+                   p.extracted_text, p.created_at,
+                   pm.medicine_name, pm.dosage, pm.frequency, m.medicine_name AS catalog_name
+            FROM prescription p
+            LEFT JOIN prescription_medication pm ON p.prescription_id = pm.prescription_id
+            LEFT JOIN medicine m ON m.medicine_id = pm.medicine_id
+            WHERE p.user_id = %s
+        """
+        params = [user_id]
+        if prescription_id is not None:
+            sql += " AND p.prescription_id = %s"
+            params.append(prescription_id)
+        if updated_since is not None:
+            sql += " AND p.updated_at >= %s"
+            params.append(updated_since)
+        cur.execute(sql + " ORDER BY p.prescription_id, pm.pm_id", params)
+        docs = OrderedDict()
+        for row in cur.fetchall():
+            doc = docs.get(row['prescription_id'])
+            if doc is None:
+                doc = docs[row['prescription_id']] = {
+                    'prescription_id': row['prescription_id'],
+                    'issue': row['issue'],
+                    'doctor_name': row['doctor_name'],
+                    'prescription_date': row['prescription_date'],
+                    'extracted_text': row['extracted_text'],
+                    'created_at': row['created_at'],
+                    'medicines': []
+                }
+            if row['medicine_name'] is not None:
+                doc['medicines'].append({'medicine_name': row['medicine_name'], 'catalog_name': row['catalog_name'],
+                                         'dosage': row['dosage'], 'frequency': row['frequency']})
+        return list(docs.values())
+
+    def for_user(self, cur, user_id):
+        version = user_data_version(cur, user_id)
+        with self.lock:
+            index = self.users.get(user_id)
+            if index is not None:
+                self.users.move_to_end(user_id)
+                if index.version == version:
+                    self.syncs['current'] += 1
+                    return index
+        cur.execute("SELECT NOW() - INTERVAL %s SECOND AS synced_at", (SEARCH_SYNC_OVERLAP,))
+        synced_at = cur.fetchone()['synced_at']
+        
+        if index is None:
+            index = UserSearchIndex()
+            for doc in self.load_documents(cur, user_id):
+                index.add(doc)
+            index.version, index.synced_at = version, synced_at
+            with self.lock:
+                self.syncs['built'] += 1
+                self.users[user_id] = index
+                self.users.move_to_end(user_id)
+                while len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            return index
+        
+        changed = self.load_documents(cur, user_id, updated_since=index.synced_at)
+        cur.execute("SELECT prescription_id FROM prescription WHERE user_id = %s", (user_id,))
+        existing = {row['prescription_id'] for row in cur.fetchall()}
+        with self.lock:
+            self.syncs['incremental'] += 1
+            for prescription_id in [prescription_id for prescription_id in index.docs
+                                    if prescription_id not in existing]:
+                index.remove(prescription_id)
+            for doc in changed:
+                index.add(doc)
+            index.version, index.synced_at = version, synced_at
+        return index
+
+    def refresh_prescription(self, cur, user_id, prescription_id):
+        """Re-index one prescription after an insert or edit (no-op if the user isn't loaded)"""
+        with self.lock:
+            if user_id not in self.users:
+                return
+        docs = self.load_documents(cur, user_id, prescription_id)
+        with self.lock:
+            index = self.users.get(user_id)
+            if index is None:
+                return
+            if docs:
+                index.add(docs[0])
+            else:
+                index.remove(prescription_id)
+
+    def remove_prescription(self, user_id, prescription_id):
+        with self.lock:
+            index = self.users.get(user_id)
+            if index is not None:
+                index.remove(prescription_id)
+
+    def search(self, cur, user_id, query, page, per_page):
+        index = self.for_user(cur, user_id)
+        with self.lock:
+            ranked = index.search(query)
+            start = (page - 1) * per_page
+            hits = [(index.docs[prescription_id], score) for prescription_id, score in ranked[start:start + per_page]]
+        return hits, len(ranked)
+
+    def stats(self):
+        with self.lock:
+            return {'users': len(self.users), 'syncs': dict(self.syncs)}
+
+search_index = SearchIndex(SEARCH_INDEX_MAX_USERS)
+metrics.register_stats('medivault_search_index', 'Per-user search index syncs', search_index.stats)
+
+# ---------------------------------------------------------------------------
+# Analytics
+# ---------------------------------------------------------------------------
+
+class LatencyBudget:
+    """Tracks how often a code path exceeds its latency budget"""
+
+    def __init__(self, name, budget_ms):
+        self.name = name
+        self.budget_ms = budget_ms
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.over_budget = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms):
+        with self.lock:
+            self.requests += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+            over = elapsed_ms > self.budget_ms
+            if over:
+                self.over_budget += 1
+        if over:
+            log.warning('latency_budget.exceeded', budget=self.name, ms=round(elapsed_ms, 1), budget_ms=self.budget_ms)
+        return over
+
+    def stats(self):
+        with self.lock:
+            return {
+                'budget_ms': self.budget_ms,
+                'requests': self.requests,
+                'over_budget': self.over_budget,
+                'avg_ms': round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+                'max_ms': round(self.max_ms, 1)
+            }
+
+class AnalyticsCache:
+    """Per-user analytics results, valid while the user's data_version is unchanged"""
+
+    def __init__(self, max_users, ttl):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, version):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            # The TTL keeps the "days since last use" column from going stale on an unchanged account
+            if entry and entry['version'] == version and time.monotonic() - entry['stored_at'] < self.ttl:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry['result']
+            self.misses += 1
+            return None
+
+    def put(self, user_id, version, result):
+        with self.lock:
+            self.entries[user_id] = {'version': version, 'result': result, 'stored_at': time.monotonic()}
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+analytics_cache = AnalyticsCache(ANALYTICS_CACHE_MAX_USERS, ANALYTICS_CACHE_TTL)
+analytics_budget = LatencyBudget('/analytics', ANALYTICS_LATENCY_BUDGET_MS)
+metrics.register_stats('medivault_analytics', 'Analytics latency budget and cache statistics', lambda: {
+    **analytics_budget.stats(), 'cache_hits': analytics_cache.hits, 'cache_misses': analytics_cache.misses
+})
+
+def compute_user_analytics(cur, user_id):
+    """All analytics page aggregates from one query and one pass over its rows
+
+    Produces the same lists the page used to get from four separate queries
+    (monthly counts, GetMedicineStats, top issues and the nested
+    above-average query). Issues group case-insensitively like MySQL's
+    collation; medicines group by medicine_id under their catalog name, and
+    by name for rows the normalization backfill has not reached yet.
+    Per-prescription medicine counts come from the trigger-maintained
+    medicine_count column rather than being recounted here.
+    """
+    cur.execute("""
+        SELECT p.prescription_id, p.issue, p.doctor_name, p.prescription_date, p.created_at,
+               p.medicine_count, pm.medicine_id, pm.medicine_name, pm.dosage, m.medicine_name AS catalog_name
+        FROM prescription p
+        LEFT JOIN prescription_medication pm ON p.prescription_id = pm.prescription_id
+        LEFT JOIN medicine m ON m.medicine_id = pm.medicine_id
+        WHERE p.user_id = %s
+        ORDER BY p.prescription_id
+    """, (user_id,))
+    
+    today = datetime.now().date()
+    months = {}
+    issues = {}
+    medicines = {}
+    prescriptions = OrderedDict()
+    for row in cur:
+        if row['prescription_id'] not in prescriptions:
+            prescriptions[row['prescription_id']] = {
+                'prescription_id': row['prescription_id'],
+                'issue': row['issue'],
+                'doctor_name': row['doctor_name'],
+                'prescription_date': row['prescription_date'],
+                'medicine_count': row['medicine_count']
+            }
+            month = row['created_at'].strftime('%Y-%m')
+            months[month] = months.get(month, 0) + 1
+            issue = issues.setdefault(row['issue'].casefold(), {'issue': row['issue'], 'count': 0})
+            issue['count'] += 1
+        if row['medicine_name'] is None:
+            continue
+        key = row['medicine_id'] if row['catalog_name'] is not None else row['medicine_name'].casefold()
+        med = medicines.setdefault(key, {
+            'medicine_name': row['catalog_name'] or row['medicine_name'], 'usage_count': 0, 'dosages': [],
+            'days_total': 0
+        })
+        med['usage_count'] += 1
+        med['days_total'] += (today - row['created_at'].date()).days
+        if row['dosage'] and row['dosage'] not in med['dosages']:
+            med['dosages'].append(row['dosage'])
+    
+    monthly_stats = [{'month': month, 'count': count}
+                     for month, count in sorted(months.items(), reverse=True)[:12]]
+    top_issues = sorted(issues.values(), key=lambda issue: issue['count'], reverse=True)[:5]
+    medicine_stats = [{
+        'medicine_name': med['medicine_name'],
+        'usage_count': med['usage_count'],
+        'dosages_used': ','.join(med['dosages']) or None,
+        'avg_days_since_last_use': med['days_total'] / med['usage_count']
+    } for med in sorted(medicines.values(), key=lambda med: med['usage_count'], reverse=True)[:10]]
+    
+    # Prescriptions with at least the average number of medicines (among those that have any)
+    with_medicines = [pres for pres in prescriptions.values() if pres['medicine_count'] > 0]
+    average = sum(pres['medicine_count'] for pres in with_medicines) / len(with_medicines) if with_medicines else 0
+    complex_prescriptions = sorted((pres for pres in with_medicines if pres['medicine_count'] >= average),
+                                   key=lambda pres: pres['medicine_count'], reverse=True)[:5]
+    
+    return {
+        'monthly_stats': monthly_stats,
+        'medicine_stats': medicine_stats,
+        'top_issues': top_issues,
+        'complex_prescriptions': complex_prescriptions
+    }
+
+# ---------------------------------------------------------------------------
+# Prescription listing (keyset pagination on created_at, prescription_id)
+# ---------------------------------------------------------------------------
+
+def encode_listing_cursor(row):
+    return f"{row['created_at'].strftime('%Y-%m-%dT%H:%M:%S')}_{row['prescription_id']}"
+
+def decode_listing_cursor(cursor_value):
+    """Parse a 'before' cursor; raises ValueError if it is malformed"""
+    created_at, prescription_id = cursor_value.rsplit('_', 1)
+    return datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S'), int(prescription_id)
+
+def list_prescriptions(cur, user_id, before=None, limit=LISTING_PAGE_SIZE):
+    """One page of a user's prescriptions, newest first
+
+    before is a decoded cursor (created_at, prescription_id); rows strictly
+    older than it are returned, so the cost of a page does not grow with how
+    far the user has scrolled. Returns (rows, next_cursor), next_cursor being
+    None on the last page.
+    """
+    params = [user_id]
+    keyset = ""
+    if before is not None:
+        keyset = "AND (created_at < %s OR (created_at = %s AND prescription_id < %s))"
+        params += [before[0], before[0], before[1]]
+    # One extra row tells us whether another page exists
+    cur.execute(f"""
+        SELECT prescription_id, issue, doctor_name, prescription_date,
+               file_path, created_at, medicine_count
+        FROM prescription
+        WHERE user_id = %s {keyset}
+        ORDER BY created_at DESC, prescription_id DESC
+        LIMIT %s
+    """, params + [limit + 1])
+    rows = cur.fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_listing_cursor(rows[-1])
+
+def listing_item(row):
+    """JSON form of a dashboard card, matching what dashboard.html renders"""
+    shown_date = row['prescription_date'] or row['created_at']
+    return {
+        'prescription_id': row['prescription_id'],
+        'issue': row['issue'],
+        'doctor_name': row['doctor_name'],
+        'date': shown_date.strftime('%d %b %Y'),
+        'created_at': row['created_at'].isoformat(),
+        'medicine_count': row['medicine_count'] or 0,
+        'thumbnail_url': thumbnail_url(row['file_path']),
+        'view_url': url_for('view_prescription', prescription_id=row['prescription_id']),
+        'edit_url': url_for('edit_prescription', prescription_id=row['prescription_id'])
+    }
+
+# ---------------------------------------------------------------------------
+# Prescription export (streamed NDJSON / CSV)
+# ---------------------------------------------------------------------------
+
+EXPORT_CSV_COLUMNS = ['record_type', 'prescription_id', 'created_at', 'updated_at', 'deleted_at', 'issue',
+                      'description',
+                      'doctor_name', 'prescription_date', 'file_path', 'medicine_count', 'medicine_id',
+                      'medicine_name', 'dosage', 'frequency', 'duration', 'notes']
+# Each running export holds a pooled connection until the client has read everything
+export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+def export_deletions(cur, user_id, since):
+    """Prescriptions deleted since the last export, from the audit log"""
+    cur.execute("""
+        SELECT prescription_id, MAX(action_timestamp) AS deleted_at
+        FROM prescription_log
+        WHERE user_id = %s AND action_type = 'DELETED' AND action_timestamp >= %s
+        GROUP BY prescription_id
+        ORDER BY deleted_at
+    """, (user_id, since))
+    return cur.fetchall()
+
+def execute_export_query(cur, user_id, since, include_text):
+    """One joined query for prescriptions and medicines, least recently changed first; rows are read later with fetchmany
+
+    Filtering on updated_at picks up edits as well as new prescriptions.
+    Ordering by the (user_id, updated_at, prescription_id) index lets MySQL
+    stream rows in index order instead of sorting the whole result first.
+    Every medicine row of a prescription is therefore adjacent.
+    """
+    params = [user_id]
+    since_filter = ""
+    if since is not None:
+        since_filter = "AND p.updated_at >= %s"
+        params.append(since)
+    cur.execute(f"""
+        SELECT p.prescription_id, p.created_at, p.updated_at, p.issue, p.description, p.doctor_name,
+               p.prescription_date, p.file_path, p.medicine_count
+               {', p.extracted_text' if include_text else ''},
+               pm.medicine_id, pm.medicine_name, pm.dosage, pm.frequency, pm.duration, pm.notes
+        FROM prescription p
+        LEFT JOIN prescription_medication pm ON pm.prescription_id = p.prescription_id
+        WHERE p.user_id = %s {since_filter}
+        ORDER BY p.updated_at, p.prescription_id
+    """, params)
+
+def export_prescriptions_iter(cur, include_text):
+    """Group the streamed join rows into one record per prescription"""
+    record = None
+    while True:
+        rows = cur.fetchmany(EXPORT_FETCH_ROWS)
+        if not rows:
+            break
+        for row in rows:
+            if record is None or row['prescription_id'] != record['prescription_id']:
+                if record is not None:
+                    yield record
+                record = {key: row[key] for key in ('prescription_id', 'created_at', 'updated_at', 'issue',
+                                                    'description', 'doctor_name', 'prescription_date',
+                                                    'file_path', 'medicine_count')}
+                if include_text:
+                    record['extracted_text'] = row['extracted_text']
+                record['medicines'] = []
+            if row['medicine_name'] is not None:
+                record['medicines'].append({key: row[key] for key in ('medicine_id', 'medicine_name', 'dosage',
+                                                                      'frequency', 'duration', 'notes')})
+    if record is not None:
+        yield record
+
+def export_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+def export_ndjson_lines(deletions, records):
+    for row in deletions:
+        yield json.dumps({'record_type': 'deleted', **row}, default=export_value) + '\n'
+    for record in records:
+        yield json.dumps({'record_type': 'prescription', **record}, default=export_value) + '\n'
+
+def export_csv_lines(deletions, records, include_text):
+    """One row per medicine (or one row for a prescription without any), and one per deletion"""
+    columns = EXPORT_CSV_COLUMNS + (['extracted_text'] if include_text else [])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    def cell(value):
+        return '' if value is None else export_value(value) if hasattr(value, 'isoformat') else value
+
+    writer.writerow(columns)
+    for row in deletions:
+        values = {'record_type': 'deleted', **row}
+        writer.writerow([cell(values.get(column)) for column in columns])
+    yield drain()
+    for record in records:
+        for medicine in record['medicines'] or [{}]:
+            values = {'record_type': 'prescription', **record, **medicine}
+            writer.writerow([cell(values.get(column)) for column in columns])
+        yield drain()
+
+def export_chunks(lines, compress):
+    """Join lines into EXPORT_CHUNK_BYTES pieces, gzip-compressed on the fly if asked"""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31) if compress else None
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b''.join(pending)
+            pending, size = [], 0
+            if compressor is not None:
+                chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+    chunk = b''.join(pending)
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+# ---------------------------------------------------------------------------
+# Audit log writer (buffered, flushed off the request path)
+# ---------------------------------------------------------------------------
+
+AUDIT_TABLE_COLUMNS = {
+    'ai_query_log': ('user_id', 'query_text', 'matched_prescription_ids', 'response_summary', 'created_at'),
+    'prescription_log': ('user_id', 'prescription_id', 'action_type', 'action_timestamp'),
+    'ocr_engine_run': ('job_id', 'prescription_id', 'engine', 'image_class', 'seconds', 'status', 'characters',
+                       'agreement', 'medicine_agreement', 'dosage_agreement', 'doctor_agreement', 'created_at'),
+}
+
+class AuditWriter:
+    """Buffers audit rows and writes them in multi-row INSERTs from a background thread
+
+    Requests only pay for a queue put. Rows carry their own timestamps, so
+    flushing late does not change what is recorded. The queue is bounded: when
+    the database falls behind, writers block for enqueue_timeout and then drop
+    the row. flush() waits for the rows queued so far, for readers that need
+    them in the table; close() (registered with atexit) drains what is left.
+    """
+
+    def __init__(self, queue_size, flush_rows, flush_interval, enqueue_timeout):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+
+    def write(self, table, row):
+        self._ensure_started()
+        try:
+            self.queue.put((table, row), timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            log.warning('audit.dropped', table=table, queue_size=self.queue.maxsize)
+            return
+        with self.lock:
+            self.enqueued += 1
+
+    def flush(self, timeout):
+        """Wait until every row queued before this call has been written (or given up on)
+
+        Returns False if that did not happen within timeout.
+        """
+        if self.queue.empty() and (self.thread is None or not self.thread.is_alive()):
+            return True
+        self._ensure_started()
+        # A marker behind the queued rows; the flusher sets it once the batch holding it is written
+        marker = threading.Event()
+        try:
+            self.queue.put((None, marker), timeout=timeout)
+        except queue.Full:
+            return False
+        return marker.wait(timeout)
+
+    def _ensure_started(self):
+        # Started lazily so a forking server gets one flusher per worker process
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+            elif self.stopping.is_set():
+                return
+
+    def _collect(self):
+        """Wait for a first row, then gather more until flush_rows or flush_interval is reached"""
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_rows:
+            remaining = 0 if self.stopping.is_set() else deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        markers = [row for table, row in batch if table is None]
+        batch = [(table, row) for table, row in batch if table is not None]
+        try:
+            if batch:
+                self._write(batch)
+        finally:
+            for marker in markers:
+                marker.set()
+
+    def _write(self, batch):
+        by_table = {}
+        for table, row in batch:
+            by_table.setdefault(table, []).append(row)
+        for attempt in range(1, AUDIT_FLUSH_RETRIES + 1):
+            try:
+                with span('flush', kind='audit', rows=len(batch)), db_pool.connection() as conn:
+                    cur = conn.cursor()
+                    for table, rows in by_table.items():
+                        columns = AUDIT_TABLE_COLUMNS[table]
+                        # executemany rewrites a plain INSERT ... VALUES into a single multi-row statement
+                        cur.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                        f"VALUES ({', '.join(['%s'] * len(columns))})", rows)
+                    conn.commit()
+                    cur.close()
+                break
+            except Exception as e:
+                log.warning('audit.flush_failed', rows=len(batch), attempt=attempt, error=str(e))
+                if attempt == AUDIT_FLUSH_RETRIES:
+                    with self.lock:
+                        self.failed += len(batch)
+                    log.error('audit.rows_lost', rows=len(batch))
+                    return
+                time.sleep(min(2 ** attempt * 0.1, 2))
+        with self.lock:
+            self.written += len(batch)
+            self.flushes += 1
+
+    def close(self, timeout=AUDIT_DRAIN_TIMEOUT):
+        """Flush everything queued so far and stop the thread"""
+        self.stopping.set()
+        if self.thread is not None and self.thread.is_alive():
+            self.thread.join(timeout)
+        if not self.queue.empty():
+            log.warning('audit.drain_incomplete', rows=self.queue.qsize())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'capacity': self.queue.maxsize,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'dropped': self.dropped,
+                'failed': self.failed,
+                'flushes': self.flushes,
+                'rows_per_flush': round(self.written / self.flushes, 1) if self.flushes else 0.0
+            }
+
+audit_writer = AuditWriter(AUDIT_QUEUE_SIZE, AUDIT_FLUSH_ROWS, AUDIT_FLUSH_INTERVAL, AUDIT_ENQUEUE_TIMEOUT)
+atexit.register(audit_writer.close)
+metrics.register_stats('medivault_audit', 'Buffered audit log writer statistics', audit_writer.stats)
+
+def defer_prescription_log(cur):
+    """In batched mode, switch the prescription_log triggers off for this session
+
+    The pool resets the session when the connection is returned, so the
+    variable never outlives the request. The caller queues the rows with
+    log_prescription_events() once it has committed.
+    """
+    if PRESCRIPTION_LOG_MODE == 'batched':
+        cur.execute("SET @medivault_audit_async = 1")
+
+def log_prescription_events(user_id, prescription_ids, action_type):
+    if PRESCRIPTION_LOG_MODE != 'batched':
+        return
+    now = datetime.now()
+    for prescription_id in prescription_ids:
+        audit_writer.write('prescription_log', (user_id, prescription_id, action_type, now))
+
+def log_search_query(user_id, query, prescription_ids):
+    # Truncated to the column: one oversized row would fail the whole multi-row flush
+    audit_writer.write('ai_query_log', (user_id, query[:500], ','.join(str(pid) for pid in prescription_ids),
+                                        f'Found {len(prescription_ids)} results', datetime.now()))
+
+# ---------------------------------------------------------------------------
+# Background upload pipeline
+# ---------------------------------------------------------------------------
+
+# Jobs are persisted in the upload_job table; this queue only dispatches job ids to the workers
+upload_queue = queue.Queue(maxsize=UPLOAD_QUEUE_SIZE)
+metrics.register_stats('medivault_upload_queue', 'Background upload queue depth and capacity',
+                       lambda: {'depth': upload_queue.qsize(), 'capacity': UPLOAD_QUEUE_SIZE})
+upload_workers = []
+upload_workers_lock = threading.Lock()
+
+def queue_full_response():
+    response = jsonify({
+        'status': 'error',
+        'message': f'Server is busy processing other prescriptions. Please retry in {UPLOAD_RETRY_AFTER} seconds.',
+        'retry_after': UPLOAD_RETRY_AFTER
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(UPLOAD_RETRY_AFTER)
+    return response
+
+def update_upload_job(job_id, stage, status='running', message=None, prescription_id=None, result=None, conn=None):
+    """Record a job's progress, on conn (the caller commits) or on a pooled connection of its own"""
+    if conn is None:
+        with db_pool.connection() as own_conn:
+            update_upload_job(job_id, stage, status, message, prescription_id, result, conn=own_conn)
+            own_conn.commit()
+        return
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE upload_job
+        SET stage = %s, status = %s, message = %s, prescription_id = %s, result = %s
+        WHERE job_id = %s
+    """, (stage, status, message, prescription_id,
+          json.dumps(result) if result is not None else None, job_id))
+    cur.close()
+
+def claim_upload_job(job_id):
+    """The job's row if this worker claimed it, or None if another worker (or process) already has it"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            UPDATE upload_job SET status = 'running', stage = 'ocr'
+            WHERE job_id = %s AND status = 'queued'
+        """, (job_id,))
+        conn.commit()
+        job = None
+        if cur.rowcount == 1:
+            cur.execute("SELECT * FROM upload_job WHERE job_id = %s", (job_id,))
+            job = cur.fetchone()
+            # Refresh a stale catalog here, so the OCR and fast-path stages do not reload it mid-job
+            medicine_catalog.index(cur)
+        cur.close()
+    return job
+
+def claim_batch_jobs(batch_id):
+    """Claim the still-queued jobs of a batch; returns every job of the batch this worker now runs"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.execute("""
+            UPDATE upload_job SET status = 'running', stage = 'ocr'
+            WHERE batch_id = %s AND status = 'queued'
+        """, (batch_id,))
+        conn.commit()
+        cur.execute("""
+            SELECT * FROM upload_job
+            WHERE batch_id = %s AND status = 'running' AND stage = 'ocr'
+            ORDER BY created_at, job_id
+        """, (batch_id,))
+        jobs = cur.fetchall()
+        cur.close()
+    return jobs
+
+def set_upload_jobs_stage(job_ids, stage):
+    """Move several running jobs to the next stage in one statement"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute(f"UPDATE upload_job SET stage = %s WHERE job_id IN ({', '.join(['%s'] * len(job_ids))})",
+                    [stage] + list(job_ids))
+        conn.commit()
+        cur.close()
+
+def finish_upload_jobs(conn, outcomes):
+    """Record the final state of several jobs on conn; outcomes maps job_id to update_upload_job's arguments"""
+    cur = conn.cursor()
+    cur.executemany("""
+        UPDATE upload_job
+        SET stage = %s, status = %s, message = %s, prescription_id = %s, result = %s
+        WHERE job_id = %s
+    """, [('done', outcome['status'], outcome['message'], outcome.get('prescription_id'),
+           json.dumps(outcome['result']), job_id) for job_id, outcome in outcomes.items()])
+    cur.close()
+
+def run_batch_job(jobs):
+    """OCR -> fusion -> insert for the images of one /upload/batch request, in one pass
+
+    Cache misses go through extract_text_batch together (EasyOCR batched
+    inference, parallel Tesseract, batched Vision requests). Fusion runs
+    BATCH_FUSION_WORKERS at a time, fast path first. The prescriptions, their
+    medicines and every job's final state are written in one transaction.
+    Batch runs are not scored for the adaptive OCR policy: every engine runs
+    on every image, with batch-level timings only.
+    """
+    job_ids = [job['job_id'] for job in jobs]
+    config = ocr_cache_config()
+    for job in jobs:
+        job['full_path'] = os.path.join(app.static_folder, job['file_path'])
+        job['cache_key'] = ocr_cache.key_for(job['content_hash'] or file_sha256(job['full_path']), config)
+        job['cached'] = ocr_cache.get(job['cache_key'])
+    
+    misses = [job for job in jobs if not job['cached']]
+    log.info('batch.ocr_started', jobs=len(jobs), cache_misses=len(misses))
+    ocr_results, ocr_timings = extract_text_batch([job['full_path'] for job in misses])
+    for job, texts in zip(misses, ocr_results):
+        job['ocr'] = list(texts)
+    for job in jobs:
+        if job['cached']:
+            job['ocr'] = list(job['cached']['ocr'])
+    cacheable = all(timing['status'] in ('ok', 'disabled') for timing in ocr_timings.values())
+    
+    outcomes = {}
+    readable = []
+    for job in jobs:
+        if any(text.strip() for text in job['ocr']):
+            readable.append(job)
+        else:
+            outcomes[job['job_id']] = {'status': 'failed', 'message': 'Could not extract text!',
+                                       'result': {'ocr_timings': ocr_timings}}
+    
+    set_upload_jobs_stage(job_ids, 'fusion')
+    
+    def fuse(job):
+        if job['cached'] and job['cached'].get('fused'):
+            return job['cached']['fused'], 'cache'
+        try:
+            parsed_data, fusion_method = fuse_prescription(*job['ocr'])
+        except FusionError as e:
+            log.warning('upload.fusion_failed', job_id=job['job_id'], error=str(e))
+            parsed_data, fusion_method = None, None
+        if job['cached'] or cacheable:
+            ocr_cache.put(job['cache_key'], {
+                'ocr': job['ocr'],
+                'ocr_timings': ocr_timings,
+                'fused': parsed_data if parsed_data is not None and fusion_succeeded(parsed_data) else None
+            })
+        return parsed_data, fusion_method
+    
+    with ThreadPoolExecutor(max_workers=BATCH_FUSION_WORKERS, thread_name_prefix='fusion') as pool:
+        for job, (parsed_data, fusion_method) in zip(readable, pool.map(with_current_span(fuse), readable)):
+            job['parsed_data'], job['fusion'] = parsed_data, fusion_method
+    fused = [job for job in readable if job['parsed_data'] is not None]
+    for job in readable:
+        if job['parsed_data'] is None:
+            outcomes[job['job_id']] = {'status': 'failed',
+                                       'message': 'AI extraction is unavailable right now, please upload again in a minute.',
+                                       'result': {'ocr_timings': ocr_timings, 'retryable': True}}
+    
+    set_upload_jobs_stage(job_ids, 'saving')
+    user_id = jobs[0]['user_id']
+    with db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        try:
+            prescription_ids = save_prescription_batch(cur, user_id, [{
+                'issue': job['issue'],
+                'description': job['description'],
+                'parsed_data': job['parsed_data'],
+                'relative_path': job['file_path'],
+                'combined_text': combine_ocr_texts(*job['ocr'])
+            } for job in fused]) if fused else []
+            for job, prescription_id in zip(fused, prescription_ids):
+                medicine_count = len(job['parsed_data'].get('medicines', []))
+                outcomes[job['job_id']] = {
+                    'status': 'done', 'message': f'Found {medicine_count} medicines!',
+                    'prescription_id': prescription_id,
+                    'result': {'ocr_timings': ocr_timings, 'medicine_count': medicine_count,
+                               'cache_hit': job['cached'] is not None, 'fusion': job['fusion'],
+                               'batch_size': len(jobs)}
+                }
+            finish_upload_jobs(conn, outcomes)
+            conn.commit()
+        except mysql.connector.Error as err:
+            conn.rollback()
+            medicine_catalog.invalidate()
+            log.error('batch.save_failed', jobs=len(jobs), error=str(err))
+            prescription_ids = []
+            for job in fused:
+                outcomes[job['job_id']] = {'status': 'failed', 'message': f'Database error: {err.msg}',
+                                           'result': {'ocr_timings': ocr_timings}}
+            finish_upload_jobs(conn, outcomes)
+            conn.commit()
+            cur.close()
+            return
+        log_prescription_events(user_id, prescription_ids, 'CREATED')
+        for prescription_id in prescription_ids:
+            search_index.refresh_prescription(cur, user_id, prescription_id)
+        cur.close()
+    log.info('batch.saved', jobs=len(jobs), prescriptions=len(prescription_ids))
+
+def run_upload_job(job_id):
+    """OCR -> fusion -> insert for one queued upload, or for the whole batch it belongs to
+
+    A pooled connection is only held for the claim, the progress updates
+    and the final insert, never across OCR or the Groq call, so a slow
+    upload does not tie up a pool slot and every DB step gets a connection
+    that passed the pool's health check.
+    """
+    job = claim_upload_job(job_id)
+    if job is None:
+        return
+    if job['batch_id'] is not None:
+        run_batch_job(claim_batch_jobs(job['batch_id']))
+        return
+    full_path = os.path.join(app.static_folder, job['file_path'])
+    
+    cache_key = ocr_cache.key_for(job['content_hash'] or file_sha256(full_path), ocr_cache_config())
+    cached = ocr_cache.get(cache_key)
+    
+    if cached:
+        log.info('upload.cache_hit', job_id=job_id)
+        tesseract_text, easyocr_text, google_vision_text = cached['ocr']
+        ocr_timings = cached['ocr_timings']
+    else:
+        log.info('upload.ocr_started', job_id=job_id)
+        tesseract_text, easyocr_text, google_vision_text, ocr_timings = extract_text_triple_ocr(full_path)
+    
+    if not any([tesseract_text.strip(), easyocr_text.strip(), google_vision_text.strip()]):
+        update_upload_job(job_id, 'done', status='failed', message='Could not extract text!',
+                          result={'ocr_timings': ocr_timings})
+        return
+    
+    update_upload_job(job_id, 'fusion')
+    if cached and cached.get('fused'):
+        parsed_data = cached['fused']
+        fusion_method = 'cache'
+    else:
+        # Partial OCR (an engine timed out or failed) is not cached so the next upload gets a full retry
+        cacheable = cached or all(timing['status'] in ('ok', 'disabled', 'skipped') for timing in ocr_timings.values())
+        try:
+            parsed_data, fusion_method = fuse_prescription(tesseract_text, easyocr_text, google_vision_text)
+        except FusionError as e:
+            # Keep the OCR text so the retry only repeats the AI step
+            if cacheable and not cached:
+                ocr_cache.put(cache_key, {
+                    'ocr': [tesseract_text, easyocr_text, google_vision_text],
+                    'ocr_timings': ocr_timings,
+                    'fused': None
+                })
+            log.warning('upload.fusion_failed', job_id=job_id, error=str(e))
+            update_upload_job(job_id, 'done', status='failed',
+                              message='AI extraction is unavailable right now, please upload again in a minute.',
+                              result={'ocr_timings': ocr_timings, 'retryable': True})
+            return
+        if cacheable:
+            ocr_cache.put(cache_key, {
+                'ocr': [tesseract_text, easyocr_text, google_vision_text],
+                'ocr_timings': ocr_timings,
+                'fused': parsed_data if fusion_succeeded(parsed_data) else None
+            })
+    
+    update_upload_job(job_id, 'saving')
+    combined_text = combine_ocr_texts(tesseract_text, easyocr_text, google_vision_text)
+    medicine_count = len(parsed_data.get('medicines', []))
+    with db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        try:
+            prescription_id = save_prescription(cur, job['user_id'], job['issue'], job['description'],
+                                                parsed_data, job['file_path'], combined_text)
+            # Marked done in the same transaction, so a crash cannot requeue a saved upload
+            update_upload_job(job_id, 'done', status='done', message=f'Found {medicine_count} medicines!',
+                              prescription_id=prescription_id,
+                              result={'ocr_timings': ocr_timings, 'medicine_count': medicine_count,
+                                      'cache_hit': cached is not None, 'fusion': fusion_method}, conn=conn)
+            conn.commit()
+        except mysql.connector.Error as err:
+            conn.rollback()
+            medicine_catalog.invalidate()
+            log.error('upload.save_failed', job_id=job_id, error=str(err))
+            update_upload_job(job_id, 'done', status='failed', message=f'Database error: {err.msg}',
+                              result={'ocr_timings': ocr_timings}, conn=conn)
+            conn.commit()
+            cur.close()
+            return
+        log_prescription_events(job['user_id'], [prescription_id], 'CREATED')
+        search_index.refresh_prescription(cur, job['user_id'], prescription_id)
+        cur.close()
+    
+    log.info('upload.saved', job_id=job_id, prescription_id=prescription_id)
+    if not cached:
+        record_ocr_run(job_id, prescription_id, {'tesseract': tesseract_text, 'easyocr': easyocr_text,
+                                                 'google_vision': google_vision_text}, ocr_timings, parsed_data)
+
+def process_upload_job(job_id):
+    """Run one job, marking it failed if anything unexpected goes wrong"""
+    try:
+        with span('upload_job', kind='job', job_id=job_id):
+            try:
+                run_upload_job(job_id)
+            except Exception as e:
+                log.error('upload.job_failed', job_id=job_id, error=str(e), exc_info=True)
+                medicine_catalog.invalidate()
+                update_upload_job(job_id, 'done', status='failed', message='Processing failed, please upload again.')
+    except Exception as e:
+        log.error('upload.job_mark_failed', job_id=job_id, error=str(e))
+
+def upload_worker():
+    while True:
+        job_id = upload_queue.get()
+        try:
+            process_upload_job(job_id)
+        finally:
+            upload_queue.task_done()
+
+def requeue_pending_upload_jobs():
+    """Put jobs left over from a previous run (or a crashed worker) back on the queue"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE upload_job SET status = 'queued', stage = 'queued'
+            WHERE status = 'running' AND updated_at < NOW() - INTERVAL %s SECOND
+        """, (UPLOAD_JOB_STALE_SECONDS,))
+        conn.commit()
+        cur.execute("SELECT job_id, batch_id FROM upload_job WHERE status = 'queued' ORDER BY created_at")
+        rows = cur.fetchall()
+        cur.close()
+    # One queue entry per batch: whichever of its jobs is picked up claims the rest
+    pending = []
+    batches = set()
+    for job_id, batch_id in rows:
+        if batch_id is None or batch_id not in batches:
+            pending.append(job_id)
+            batches.add(batch_id)
+    if pending:
+        log.info('upload.requeued', jobs=len(pending))
+    for job_id in pending:
+        # Blocks while the queue is full; this runs on its own thread
+        upload_queue.put(job_id)
+
+def ensure_upload_workers():
+    """Start the worker threads once per process, on the first request it serves"""
+    if upload_workers:
+        return
+    with upload_workers_lock:
+        if upload_workers:
+            return
+        for i in range(UPLOAD_WORKERS):
+            worker = threading.Thread(target=upload_worker, name=f'upload-worker-{i}', daemon=True)
+            worker.start()
+            upload_workers.append(worker)
+        threading.Thread(target=requeue_pending_upload_jobs, name='upload-requeue', daemon=True).start()
+        threading.Thread(target=warm_up_medicine_catalog, name='medicine-catalog-warmup', daemon=True).start()
+
+@app.before_request
+def start_background_workers():
+    ensure_upload_workers()
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/signup', methods=['GET', 'POST'])
+def signup():
+    if request.method == 'POST':
+        name = request.form['name']
+        email = request.form['email']
+        password = generate_password_hash(request.form['password'])
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute("INSERT INTO user (name, email, password) VALUES (%s, %s, %s)", (name, email, password))
+            db.commit()
+            user_id = cursor.lastrowid
+            session['user_id'] = user_id
+            session['user_name'] = name
+            flash('Account created successfully!', 'success')
+            return redirect(url_for('dashboard'))
+        except mysql.connector.Error as err:
+            flash(f'Error: {err.msg}', 'danger')
+    return render_template('signup.html')
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        email = request.form['email']
+        password = request.form['password']
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM user WHERE email = %s", (email,))
+        user = cursor.fetchone()
+        if user and check_password_hash(user['password'], password):
+            session['user_id'] = user['user_id']
+            session['user_name'] = user['name']
+            return redirect(url_for('dashboard'))
+        else:
+            flash('Invalid credentials.', 'danger')
+    return render_template('login.html')
+
+@app.route('/dashboard')
+def dashboard():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    # First page only; the rest is fetched from /api/prescriptions as the user scrolls
+    prescriptions, next_cursor = list_prescriptions(cursor, session['user_id'])
+    
+    # Summary statistics, maintained incrementally by triggers (see user_stats in Medivault.sql)
+    cursor.execute("""
+        SELECT total_prescriptions, total_doctors, active_months, total_medicines
+        FROM user_stats
+        WHERE user_id = %s
+    """, (session['user_id'],))
+    stats = cursor.fetchone()
+    
+    return render_template('dashboard.html', 
+                         name=session['user_name'], 
+                         prescriptions=prescriptions,
+                         next_cursor=next_cursor,
+                         stats=stats if stats else {'total_prescriptions': 0, 'total_doctors': 0, 'active_months': 0, 'total_medicines': 0})
+
+@app.route('/analytics')
+def analytics():
+    """Analytics dashboard: every aggregate comes from one cached single-pass computation"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    started = time.perf_counter()
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    version = user_data_version(cursor, session['user_id'])
+    result = analytics_cache.get(session['user_id'], version)
+    cache_hit = result is not None
+    if result is None:
+        result = compute_user_analytics(cursor, session['user_id'])
+        analytics_cache.put(session['user_id'], version, result)
+    
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    analytics_budget.record(elapsed_ms)
+    
+    response = make_response(render_template('analytics.html', **result))
+    response.headers['Server-Timing'] = f'analytics;dur={elapsed_ms:.1f};desc="{"cache" if cache_hit else "computed"}"'
+    return response
+
+@app.route('/upload', methods=['POST'])
+def upload():
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    issue = request.form.get('issue', '').strip()
+    description = request.form.get('description', '').strip()
+    
+    if not issue:
+        return jsonify({'status': 'error', 'message': 'Please specify issue!'})
+    
+    if 'file' not in request.files:
+        return jsonify({'status': 'error', 'message': 'No file!'})
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'status': 'error', 'message': 'No file selected!'})
+    
+    if file and allowed_file(file.filename):
+        # Backpressure: refuse new work before touching disk when the queue is already full
+        if upload_queue.full():
+            return queue_full_response()
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = secure_filename(file.filename)
+        unique_filename = f"{session['user_id']}_{timestamp}_{filename}"
+        full_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        content_hash = store_upload_stream(file.stream, full_path)
+        relative_path = f"uploads/{unique_filename}"
+        
+        job_id = uuid.uuid4().hex
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        try:
+            cursor.execute("""
+                INSERT INTO upload_job (job_id, user_id, issue, description, file_path, content_hash)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (job_id, session['user_id'], issue, description, relative_path, content_hash))
+            db.commit()
+        except mysql.connector.Error as err:
+            log.error('upload.job_insert_failed', error=str(err))
+            os.remove(full_path)
+            return jsonify({'status': 'error', 'message': f'Database error: {err.msg}'})
+
+        try:
+            upload_queue.put_nowait(job_id)
+        except queue.Full:
+            cursor.execute("DELETE FROM upload_job WHERE job_id = %s", (job_id,))
+            db.commit()
+            os.remove(full_path)
+            return queue_full_response()
+
+        schedule_thumbnails(full_path, relative_path)
+        log.info('upload.queued', job_id=job_id, queue_depth=upload_queue.qsize())
+        return jsonify({
+            'status': 'queued',
+            'message': 'Prescription uploaded, analysis queued.',
+            'job_id': job_id,
+            'status_url': url_for('upload_status', job_id=job_id)
+        }), 202
+    return jsonify({'status': 'error', 'message': 'Invalid file type!'})
+
+def collect_batch_images(files, user_id):
+    """Save every image in the request, expanding zip archives and multi-page TIFFs
+
+    Returns (images, outcomes): images are dicts for the files that were
+    saved; outcomes already holds a failure entry for anything rejected.
+    """
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    images = []
+    outcomes = []
+
+    def save_image(name, data=None, file=None, page=None):
+        filename = secure_filename(name) or 'image.png'
+        unique_filename = f"{user_id}_{timestamp}_{len(images)}_{filename}"
+        full_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
+        if page is not None:
+            encoded = io.BytesIO()
+            page.save(encoded, format='PNG')
+            content_hash = store_upload_bytes(encoded.getvalue(), full_path)
+        elif file is not None:
+            content_hash = store_upload_stream(file.stream, full_path)
+        else:
+            content_hash = store_upload_bytes(data, full_path)
+        relative_path = f"uploads/{unique_filename}"
+        images.append({'filename': name, 'full_path': full_path, 'relative_path': relative_path,
+                       'content_hash': content_hash})
+
+    for file in files:
+        if len(images) >= BATCH_MAX_FILES:
+            outcomes.append({'filename': file.filename, 'status': 'failed',
+                             'message': f'Batch limit of {BATCH_MAX_FILES} images reached'})
+            continue
+        extension = file.filename.rsplit('.', 1)[-1].lower() if '.' in file.filename else ''
+        if extension == 'zip':
+            try:
+                with zipfile.ZipFile(file.stream) as archive:
+                    for member in archive.infolist():
+                        if member.is_dir() or not allowed_file(member.filename):
+                            continue
+                        if len(images) >= BATCH_MAX_FILES:
+                            outcomes.append({'filename': member.filename, 'status': 'failed',
+                                             'message': f'Batch limit of {BATCH_MAX_FILES} images reached'})
+                            continue
+                        if member.file_size > BATCH_MAX_MEMBER_BYTES:
+                            outcomes.append({'filename': member.filename, 'status': 'failed',
+                                             'message': 'File too large!'})
+                            continue
+                        save_image(os.path.basename(member.filename), data=archive.read(member))
+            except zipfile.BadZipFile:
+                outcomes.append({'filename': file.filename, 'status': 'failed', 'message': 'Invalid zip archive!'})
+        elif extension in ('tif', 'tiff'):
+            try:
+                with Image.open(file.stream) as document:
+                    for page_number, page in enumerate(ImageSequence.Iterator(document), start=1):
+                        if len(images) >= BATCH_MAX_FILES:
+                            break
+                        base_name = file.filename.rsplit('.', 1)[0]
+                        save_image(f"{base_name}_page{page_number}.png", page=page.convert('RGB'))
+            except (OSError, ValueError):
+                outcomes.append({'filename': file.filename, 'status': 'failed', 'message': 'Invalid TIFF file!'})
+        elif allowed_file(file.filename):
+            save_image(file.filename, file=file)
+        else:
+            outcomes.append({'filename': file.filename, 'status': 'failed', 'message': 'Invalid file type!'})
+    return images, outcomes
+
+def discard_batch_images(images):
+    """Delete the saved files of batch images that did not get a queued job"""
+    for image in images:
+        try:
+            os.remove(image['full_path'])
+        except OSError as e:
+            log.warning('batch.discard_failed', path=image['full_path'], error=str(e))
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """Ingest a stack of prescriptions (several images, a zip, or a multi-page TIFF) in one request
+
+    Each image gets an upload_job row, so each result has a status_url to
+    poll, but the batch takes a single queue entry and one worker runs it
+    in one pass: batched OCR, then one transaction for every prescription.
+    """
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    issue = request.form.get('issue', '').strip()
+    description = request.form.get('description', '').strip()
+    
+    if not issue:
+        return jsonify({'status': 'error', 'message': 'Please specify issue!'})
+    
+    files = [file for file in request.files.getlist('files') if file.filename]
+    if not files:
+        return jsonify({'status': 'error', 'message': 'No files selected!'})
+    
+    # Backpressure: refuse new work before touching disk when the queue is already full
+    if upload_queue.full():
+        return queue_full_response()
+    
+    images, outcomes = collect_batch_images(files, session['user_id'])
+    if not images:
+        return jsonify({'status': 'error', 'message': 'No valid images in batch!', 'results': outcomes})
+    
+    batch_id = uuid.uuid4().hex
+    for image in images:
+        image['job_id'] = uuid.uuid4().hex
+    db = get_db()
+    cursor = db.cursor()
+    try:
+        cursor.executemany("""
+            INSERT INTO upload_job (job_id, batch_id, user_id, issue, description, file_path, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+        """, [(image['job_id'], batch_id, session['user_id'], issue, description, image['relative_path'],
+               image['content_hash']) for image in images])
+        db.commit()
+    except mysql.connector.Error as err:
+        db.rollback()
+        log.error('batch.job_insert_failed', error=str(err))
+        discard_batch_images(images)
+        return jsonify({'status': 'error', 'message': f'Database error: {err.msg}', 'results': outcomes})
+    
+    # The whole batch is one queue entry: the worker that picks up its first job claims the rest
+    try:
+        upload_queue.put_nowait(images[0]['job_id'])
+    except queue.Full:
+        cursor.execute("DELETE FROM upload_job WHERE batch_id = %s", (batch_id,))
+        db.commit()
+        discard_batch_images(images)
+        return queue_full_response()
+    
+    for image in images:
+        schedule_thumbnails(image['full_path'], image['relative_path'])
+        outcomes.append({
+            'filename': image['filename'],
+            'status': 'queued',
+            'job_id': image['job_id'],
+            'status_url': url_for('upload_status', job_id=image['job_id'])
+        })
+    log.info('batch.queued', batch_id=batch_id, jobs=len(images), queue_depth=upload_queue.qsize())
+    
+    return jsonify({
+        'status': 'queued',
+        'message': f'Queued {len(images)} of {len(outcomes)} files for analysis.',
+        'batch_id': batch_id,
+        'queued': len(images),
+        'failed': len(outcomes) - len(images),
+        'job_ids': [image['job_id'] for image in images],
+        'results': outcomes
+    }), 202
+
+@app.route('/api/prescriptions')
+def api_prescriptions():
+    """Keyset-paginated prescription list: pass the previous response's next_cursor as ?before="""
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    before = request.args.get('before')
+    try:
+        limit = min(max(int(request.args.get('limit', LISTING_PAGE_SIZE)), 1), LISTING_MAX_PAGE_SIZE)
+        before = decode_listing_cursor(before) if before else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid cursor or limit!'}), 400
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    rows, next_cursor = list_prescriptions(cursor, session['user_id'], before, limit)
+    
+    return jsonify({
+        'status': 'success',
+        'prescriptions': [listing_item(row) for row in rows],
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None
+    })
+
+@app.route('/api/export')
+def export_prescriptions():
+    """Stream the user's prescriptions and medicines as NDJSON (default) or CSV
+
+    ?format=ndjson|csv; ?since=<ISO timestamp> exports only prescriptions
+    created or edited since then, plus 'deleted' records for prescriptions
+    deleted since; ?include_text=1 adds the OCR text; ?gzip=1 (or an
+    Accept-Encoding that accepts gzip) compresses. The X-Export-Next-Since
+    header is the since value for the next incremental export. It overlaps
+    this export by EXPORT_SINCE_OVERLAP seconds, so records may repeat and
+    consumers should upsert by prescription_id.
+    """
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'status': 'error', 'message': 'Format must be ndjson or csv!'}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if request.args.get('since') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid since timestamp!'}), 400
+    include_text = request.args.get('include_text') == '1'
+    compress = request.args.get('gzip') == '1' or request.accept_encodings['gzip'] > 0
+    
+    if not export_slots.acquire(blocking=False):
+        response = jsonify({'status': 'error', 'message': 'Too many exports running, please retry shortly.'})
+        response.headers['Retry-After'] = str(EXPORT_RETRY_AFTER)
+        return response, 429
+    # A dedicated connection, not get_db(): it must stay open after this view returns
+    try:
+        conn = db_pool.acquire()
+    except Exception:
+        export_slots.release()
+        raise
+    
+    def release():
+        try:
+            # Discard rows a disconnected client never read, or the session reset fails
+            conn.consume_results()
+        finally:
+            try:
+                db_pool.release(conn)
+            finally:
+                export_slots.release()
+    
+    try:
+        # Deletions queued by this process must be in prescription_log before it is read
+        if PRESCRIPTION_LOG_MODE == 'batched' and not audit_writer.flush(EXPORT_AUDIT_FLUSH_TIMEOUT):
+            log.warning('export.audit_flush_timeout', timeout=EXPORT_AUDIT_FLUSH_TIMEOUT)
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT NOW() AS now, NOW() - INTERVAL %s SECOND AS next_since", (EXPORT_SINCE_OVERLAP,))
+        times = cursor.fetchone()
+        started_at, next_since = times['now'], times['next_since']
+        deletions = export_deletions(cursor, session['user_id'], since) if since is not None else []
+        execute_export_query(cursor, session['user_id'], since, include_text)
+    except Exception:
+        release()
+        raise
+    
+    records = export_prescriptions_iter(cursor, include_text)
+    if export_format == 'csv':
+        lines, mimetype = export_csv_lines(deletions, records, include_text), 'text/csv'
+    else:
+        lines, mimetype = export_ndjson_lines(deletions, records), 'application/x-ndjson'
+    response = Response(export_chunks(lines, compress), mimetype=mimetype)
+    response.call_on_close(release)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    response.headers['Content-Disposition'] = \
+        f'attachment; filename="medivault-export-{started_at:%Y%m%dT%H%M%S}.{export_format}"'
+    response.headers['X-Export-Next-Since'] = next_since.isoformat()
+    return response
+
+@app.route('/upload/<job_id>/status')
+def upload_status(job_id):
+    """Poll the progress of a queued upload"""
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    cursor.execute("""
+        SELECT job_id, status, stage, message, prescription_id, result
+        FROM upload_job
+        WHERE job_id = %s AND user_id = %s
+    """, (job_id, session['user_id']))
+    job = cursor.fetchone()
+    
+    if not job:
+        return jsonify({'status': 'error', 'message': 'Upload job not found!'}), 404
+    
+    return jsonify({
+        'status': 'success',
+        'job_id': job['job_id'],
+        'job_status': job['status'],
+        'stage': job['stage'],
+        'progress': UPLOAD_STAGE_PROGRESS.get(job['stage'], 0),
+        'message': job['message'],
+        'prescription_id': job['prescription_id'],
+        'result': json.loads(job['result']) if job['result'] else None
+    })
+
+@app.route('/prescription/<int:prescription_id>')
+def view_prescription(prescription_id):
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    cursor.execute("""
+        SELECT * FROM prescription 
+        WHERE prescription_id = %s AND user_id = %s
+    """, (prescription_id, session['user_id']))
+    prescription = cursor.fetchone()
+    
+    if not prescription:
+        flash('Prescription not found!', 'danger')
+        return redirect(url_for('dashboard'))
+    
+    cursor.execute("""
+        SELECT * FROM prescription_medication 
+        WHERE prescription_id = %s
+    """, (prescription_id,))
+    medicines = cursor.fetchall()
+    
+    cursor.execute("SELECT GetDaysSinceLastIssue(%s, %s) as days_since_last", 
+                (session['user_id'], prescription['issue']))
+    days_result = cursor.fetchone()
+    prescription['days_since_last_issue'] = days_result['days_since_last'] if days_result else -1
+
+    return render_template('view_prescription.html', prescription=prescription, medicines=medicines)
+
+@app.route('/prescription/<int:prescription_id>/edit', methods=['GET', 'POST'])
+def edit_prescription(prescription_id):
+    """UPDATE operation with GUI"""
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    if request.method == 'POST':
+        issue = request.form.get('issue')
+        description = request.form.get('description')
+        doctor_name = request.form.get('doctor_name')
+        
+        cursor.execute("""
+            UPDATE prescription 
+            SET issue = %s, description = %s, doctor_name = %s
+            WHERE prescription_id = %s AND user_id = %s
+        """, (issue, description, doctor_name, prescription_id, session['user_id']))
+        db.commit()
+        search_index.refresh_prescription(cursor, session['user_id'], prescription_id)
+        
+        flash('Prescription updated successfully!', 'success')
+        return redirect(url_for('view_prescription', prescription_id=prescription_id))
+    
+    cursor.execute("""
+        SELECT * FROM prescription 
+        WHERE prescription_id = %s AND user_id = %s
+    """, (prescription_id, session['user_id']))
+    prescription = cursor.fetchone()
+    
+    return render_template('edit_prescription.html', prescription=prescription)
+
+@app.route('/prescription/<int:prescription_id>/delete', methods=['POST'])
+def delete_prescription(prescription_id):
+    """DELETE operation with GUI"""
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    try:
+        # Get file path before deletion
+        cursor.execute("""
+            SELECT file_path FROM prescription 
+            WHERE prescription_id = %s AND user_id = %s
+        """, (prescription_id, session['user_id']))
+        result = cursor.fetchone()
+        
+        if result:
+            # Delete prescription (logged by the trigger, or queued below in batched mode)
+            defer_prescription_log(cursor)
+            cursor.execute("""
+                DELETE FROM prescription 
+                WHERE prescription_id = %s AND user_id = %s
+            """, (prescription_id, session['user_id']))
+            db.commit()
+            log_prescription_events(session['user_id'], [prescription_id], 'DELETED')
+            search_index.remove_prescription(session['user_id'], prescription_id)
+            
+            # Delete file
+            file_path = os.path.join('static', result['file_path'])
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            remove_thumbnails(result['file_path'])
+            
+            return jsonify({'status': 'success', 'message': 'Prescription deleted!'})
+        return jsonify({'status': 'error', 'message': 'Prescription not found!'})
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': str(e)})
+
+@app.route('/search', methods=['POST'])
+def search():
+    """Ranked, typo-tolerant search over medicines, issues, doctors and OCR text"""
+    if 'user_id' not in session:
+        return jsonify({'status': 'error', 'message': 'Not logged in!'})
+    
+    query = request.json.get('query', '').strip()
+    
+    if not query:
+        return jsonify({'status': 'error', 'message': 'Enter search query!'})
+    
+    try:
+        page = max(int(request.json.get('page', 1) or 1), 1)
+        per_page = min(max(int(request.json.get('per_page', SEARCH_PAGE_SIZE) or SEARCH_PAGE_SIZE), 1), 50)
+    except (TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': 'Invalid page or per_page!'}), 400
+    
+    db = get_db()
+    cursor = db.cursor(dictionary=True)
+    
+    hits, total = search_index.search(cursor, session['user_id'], query, page, per_page)
+    
+    # One row per medicine, as the dashboard groups rows by prescription
+    results = []
+    for doc, score in hits:
+        for med in doc['medicines'] or [{'medicine_name': '', 'dosage': '', 'frequency': ''}]:
+            results.append({
+                'prescription_id': doc['prescription_id'],
+                'issue': doc['issue'],
+                'doctor': doc['doctor_name'] or 'Not specified',
+                'date': doc['prescription_date'].strftime('%d %b %Y') if doc['prescription_date'] else 'Not specified',
+                'medicine_name': med['medicine_name'],
+                'dosage': med['dosage'],
+                'frequency': med['frequency'],
+                'score': score
+            })
+    
+    # Log query (written by the audit writer after the response)
+    log_search_query(session['user_id'], query, [r['prescription_id'] for r in results])
+    
+    return jsonify({
+        'status': 'success',
+        'query': query,
+        'results': results,
+        'count': len(results),
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'has_more': page * per_page < total
+    })
+
+@app.route('/health/ocr')
+def ocr_health():
+    """Which OCR engines are enabled and loaded in this process, and how the engine policy scores them"""
+    return jsonify({'status': 'success', 'engines': {name: backend.status() for name, backend in ocr_backends.items()},
+                    'policy': ocr_policy.stats()})
+
+@app.route('/health/analytics')
+def analytics_health():
+    """Analytics latency against its budget, and cache effectiveness"""
+    return jsonify({
+        'status': 'success',
+        'latency': analytics_budget.stats(),
+        'cache': {'hits': analytics_cache.hits, 'misses': analytics_cache.misses}
+    })
+
+@app.route('/health/fusion')
+def fusion_health():
+    """How many uploads the local fast path served without calling the LLM"""
+    with fusion_stats_lock:
+        stats = dict(fusion_stats)
+    total = stats['fast_path'] + stats['llm']
+    stats['fast_path_fraction'] = round(stats['fast_path'] / total, 3) if total else 0.0
+    return jsonify({'status': 'success', 'fusion': stats})
+
+@app.route('/health/groq')
+def groq_health():
+    """Fusion client call counts, circuit state and latency histogram"""
+    return jsonify({'status': 'success', 'groq': groq_client.stats()})
+
+@app.route('/health/db')
+def db_health():
+    """Database pool health and wait-time metrics"""
+    try:
+        with db_pool.connection() as conn:
+            conn.ping(reconnect=False)
+        healthy = True
+    except mysql.connector.Error:
+        healthy = False
+    return jsonify({'status': 'success' if healthy else 'error', 'pool': db_pool.stats()}), 200 if healthy else 503
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus text exposition of span histograms, request counters and component stats"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/logout')
+def logout():
+    session.clear()
+    flash('Logged out successfully.', 'info')
+    return redirect(url_for('index'))
+
+@app.cli.command('check-stats')
+@click.option('--repair', is_flag=True, help='Rebuild the statistics of every drifted user.')
+def check_stats_command(repair):
+    """Compare user_stats with the base tables and optionally repair drift"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        cur.callproc('CheckUserStats')
+        drifted = [row for result in cur.stored_results() for row in result.fetchall()]
+        for row in drifted:
+            click.echo(f"user {row['user_id']}: prescriptions {row['stored_prescriptions']}/{row['actual_prescriptions']}, "
+                       f"doctors {row['stored_doctors']}/{row['actual_doctors']}, "
+                       f"months {row['stored_months']}/{row['actual_months']}, "
+                       f"medicines {row['stored_medicines']}/{row['actual_medicines']} (stored/actual)")
+        if repair:
+            for row in drifted:
+                cur.callproc('RebuildUserStats', [row['user_id']])
+            conn.commit()
+        cur.close()
+    click.echo(f"{len(drifted)} user(s) with drifted statistics" + (", repaired" if repair and drifted else ""))
+
+@app.cli.command('rebuild-stats')
+@click.option('--user', 'user_id', type=int, help='Only rebuild this user.')
+def rebuild_stats_command(user_id):
+    """Recompute user_stats from scratch (e.g. after installing the stats tables on an existing database)"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        if user_id is None:
+            cur.execute("SELECT user_id FROM user")
+            user_ids = [row[0] for row in cur.fetchall()]
+        else:
+            user_ids = [user_id]
+        for uid in user_ids:
+            cur.callproc('RebuildUserStats', [uid])
+            conn.commit()
+        cur.close()
+    click.echo(f"Rebuilt statistics for {len(user_ids)} user(s)")
+
+@app.cli.command('normalize-medicines')
+@click.option('--batch-size', default=200, show_default=True, help='Distinct names per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only report how the names would be matched.')
+def normalize_medicines_command(batch_size, dry_run):
+    """Fill prescription_medication.medicine_id for rows saved before normalization existed"""
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT medicine_name, COUNT(*) FROM prescription_medication
+            WHERE medicine_id IS NULL GROUP BY medicine_name
+        """)
+        pending = cur.fetchall()
+        if dry_run:
+            medicine_catalog.index(cur)
+            for name, count in pending:
+                medicine_id, how = medicine_catalog.match(name)
+                click.echo(f"{name!r} ({count} rows): " + (f"{how} -> {medicine_id}" if medicine_id else "new medicine"))
+            cur.close()
+            return
+        updated = 0
+        for start in range(0, len(pending), batch_size):
+            names = [name for name, count in pending[start:start + batch_size]]
+            medicine_ids = medicine_catalog.resolve(cur, names)
+            for name in names:
+                if name not in medicine_ids:
+                    continue
+                # Touching updated_at bumps data_version (TRIGGER 6) for the analytics cache and the
+                # search index, and puts the prescriptions in the next incremental export
+                cur.execute("""
+                    UPDATE prescription p
+                    JOIN prescription_medication pm ON pm.prescription_id = p.prescription_id
+                    SET p.updated_at = CURRENT_TIMESTAMP
+                    WHERE pm.medicine_id IS NULL AND pm.medicine_name = %s
+                """, (name,))
+                cur.execute("""
+                    UPDATE prescription_medication SET medicine_id = %s
+                    WHERE medicine_id IS NULL AND medicine_name = %s
+                """, (medicine_ids[name], name))
+                updated += cur.rowcount
+            conn.commit()
+            click.echo(f"  {min(start + batch_size, len(pending))}/{len(pending)} names, {updated} rows")
+        cur.close()
+    click.echo(f"Linked {updated} medication row(s) to the medicine table; "
+               f"{medicine_catalog.stats()['matches']['created']} new medicine(s)")
+
+@app.cli.command('verify-medicines')
+@click.argument('names', nargs=-1)
+@click.option('--min-users', type=int, help='Also verify every name found on prescriptions of at least this many users.')
+def verify_medicines_command(names, min_users):
+    """Let the fast-path parser trust medicines added from extracted names
+
+    With no arguments, lists the unverified medicines and how many users'
+    prescriptions mention each.
+    """
+    with db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT m.medicine_name, COUNT(DISTINCT p.user_id) AS users
+            FROM medicine m
+            LEFT JOIN prescription_medication pm ON pm.medicine_id = m.medicine_id
+            LEFT JOIN prescription p ON p.prescription_id = pm.prescription_id
+            WHERE m.verified = 0
+            GROUP BY m.medicine_id, m.medicine_name
+            ORDER BY users DESC, m.medicine_name
+        """)
+        unverified = cur.fetchall()
+        chosen = set(name.casefold() for name in names)
+        chosen.update(name.casefold() for name, users in unverified if min_users is not None and users >= min_users)
+        if not names and min_users is None:
+            for name, users in unverified:
+                click.echo(f"{name!r}: {users} user(s)")
+            cur.close()
+            return
+        verify = [name for name, users in unverified if name.casefold() in chosen]
+        if verify:
+            cur.execute(f"UPDATE medicine SET verified = 1 WHERE verified = 0 AND medicine_name IN "
+                        f"({', '.join(['%s'] * len(verify))})", verify)
+            conn.commit()
+        cur.close()
+    medicine_catalog.invalidate()
+    click.echo(f"Verified {len(verify)} medicine(s)")
+
+if OCR_WARMUP:
+    warm_up_ocr_backends()
+
+if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,528 @@
+"""MediVault benchmark harness
+
+Two suites, both run against deterministic local stubs instead of the real
+OCR engines and Groq, so numbers only move when our code does:
+
+    python benchmark.py micro                  # OCR stage, fusion parsing, date parsing
+    python benchmark.py load --duration 60     # /dashboard, /analytics, /search, /upload
+    python benchmark.py all --baseline benchmark_baseline.json
+
+Each run reports p50/p95/p99 latency and operations per second. Pass
+--baseline to compare against a stored run (the exit status is 1 on a
+regression) and --save-baseline to write the current run as the new one.
+
+The stubs:
+  * OCR: every engine in app.ocr_backends / OCR_ENGINES / OCR_BATCH_ENGINES
+    returns the ground-truth text of the synthetic image it is given, after
+    --ocr-latency-ms. Preprocessing still runs for real.
+  * Groq: a local HTTP server that app.py is pointed at through
+    MEDIVAULT_GROQ_API_URL, answering after --groq-latency-ms.
+
+Both suites need the MySQL database from Medivault.sql (app.py opens its
+connection pool on import). The load suite seeds benchmark users
+(bench<N>@medivault.test) with prescriptions unless --no-seed is given.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+import requests
+from PIL import Image, ImageDraw, ImageFont
+
+BENCH_EMAIL = 'bench{}@medivault.test'
+BENCH_PASSWORD = 'benchmark'
+
+MEDICINES = [
+    ('Paracetamol', '500mg'), ('Amoxicillin', '250mg'), ('Azithromycin', '500mg'), ('Cetirizine', '10mg'),
+    ('Ibuprofen', '400mg'), ('Pantoprazole', '40mg'), ('Metformin', '500mg'), ('Amlodipine', '5mg'),
+    ('Atorvastatin', '10mg'), ('Omeprazole', '20mg'), ('Dolo 650', '650mg'), ('Montelukast', '10mg'),
+    ('Levocetirizine', '5mg'), ('Doxycycline', '100mg'), ('Ranitidine', '150mg'), ('Vitamin D3', '60000iu'),
+]
+FREQUENCIES = ['once daily', 'twice daily', 'thrice daily', 'at bedtime', 'BID', 'TID', 'QD']
+DOCTORS = ['Anita Sharma', 'Rahul Mehta', 'Priya Nair', 'Vikram Rao', 'Sunita Iyer', 'Arjun Kapoor']
+ISSUES = ['fever', 'cold', 'tooth pain', 'back pain', 'allergy', 'diabetes follow-up', 'blood pressure',
+          'stomach ache', 'migraine', 'skin rash']
+
+# Share of each scenario in the load mix
+LOAD_MIX = {'dashboard': 40, 'analytics': 20, 'search': 30, 'upload': 10}
+
+# ---------------------------------------------------------------------------
+# Synthetic prescription corpus
+# ---------------------------------------------------------------------------
+
+class SyntheticPrescription:
+    def __init__(self, index, rng, noisy):
+        self.index = index
+        self.doctor = rng.choice(DOCTORS)
+        self.issue = rng.choice(ISSUES)
+        self.date = date(2024, 1, 1) + timedelta(days=rng.randrange(600))
+        self.medicines = [(name, dosage, rng.choice(FREQUENCIES), f"{rng.choice([3, 5, 7, 10, 14])} days")
+                          for name, dosage in rng.sample(MEDICINES, rng.randint(1, 4))]
+        self.noisy = noisy
+        self.text = '\n'.join(
+            ["City Care Clinic", f"Dr. {self.doctor}", f"Date: {self.date.strftime('%d/%m/%Y')}", "Rx"]
+            + [f"{n}. {name} {dosage} {frequency} x {duration}"
+               for n, (name, dosage, frequency, duration) in enumerate(self.medicines, start=1)]
+        )
+
+    def engine_text(self, engine):
+        """What each stub engine 'reads'; noisy documents disagree so fusion falls back to Groq"""
+        if not self.noisy:
+            return self.text
+        if engine == 'easyocr':
+            return self.text.lower().replace('mg', ' rng')
+        if engine == 'google_vision':
+            return '\n'.join(line[::-1] if line[:1].isdigit() else line for line in self.text.splitlines())
+        return self.text
+
+    def render(self, rng):
+        image = Image.new('L', (1240, 1754), 255)
+        draw = ImageDraw.Draw(image)
+        try:
+            font = ImageFont.load_default(size=36)
+        except TypeError:
+            # Pillow < 10.1 has only the fixed bitmap font
+            font = ImageFont.load_default()
+        y = 120
+        for line in self.text.splitlines():
+            draw.text((100, y), line, fill=0, font=font)
+            y += 70
+        # A slight tilt, as on a phone photo, so deskew has work to do
+        return image.rotate(rng.uniform(-3, 3), resample=Image.BICUBIC, fillcolor=255)
+
+    def parsed_data(self):
+        return {
+            'doctor_name': f"Dr. {self.doctor}",
+            'date': self.date.strftime('%d/%m/%Y'),
+            'medicines': [{'name': name, 'dosage': dosage, 'frequency': frequency, 'duration': duration}
+                          for name, dosage, frequency, duration in self.medicines]
+        }
+
+class Corpus:
+    """Synthetic prescription images on disk, looked up by content hash"""
+
+    def __init__(self, size, noise, seed):
+        rng = random.Random(seed)
+        self.directory = tempfile.mkdtemp(prefix='medivault-bench-')
+        self.documents = []
+        self.paths = []
+        self.by_hash = {}
+        for index in range(size):
+            document = SyntheticPrescription(index, rng, noisy=rng.random() < noise)
+            buffer = io.BytesIO()
+            document.render(rng).save(buffer, format='PNG')
+            data = buffer.getvalue()
+            path = os.path.join(self.directory, f"prescription_{index}.png")
+            with open(path, 'wb') as out:
+                out.write(data)
+            self.documents.append(document)
+            self.paths.append(path)
+            self.by_hash[hashlib.sha256(data).hexdigest()] = document
+
+    def document_for(self, ocr_image):
+        return self.by_hash.get(hashlib.sha256(ocr_image.source_buffer).hexdigest(), self.documents[0])
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+# ---------------------------------------------------------------------------
+# Stubs
+# ---------------------------------------------------------------------------
+
+class GroqStubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    reply = json.dumps({
+        'doctor_name': 'Dr. Stub',
+        'date': '01/01/2025',
+        'medicines': [{'name': 'Paracetamol', 'dosage': '500mg', 'frequency': 'BID', 'duration': '5 days'}]
+    })
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.latency)
+        body = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': self.reply}}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_groq_stub(latency_ms):
+    GroqStubHandler.latency = latency_ms / 1000
+    server = ThreadingHTTPServer(('127.0.0.1', 0), GroqStubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='groq-stub', daemon=True).start()
+    return server
+
+def install_ocr_stubs(medivault, corpus, latency_ms):
+    """Swap every OCR engine for a stub that returns the corpus text after latency_ms"""
+    latency = latency_ms / 1000
+
+    def make_engine(name):
+        def engine(ocr_image):
+            time.sleep(latency)
+            return corpus.document_for(ocr_image).engine_text(name)
+        engine.__name__ = f"ocr_with_{name}"
+        return engine
+
+    def make_batch_engine(name):
+        def batch_engine(ocr_images):
+            time.sleep(latency * len(ocr_images))
+            return [corpus.document_for(ocr_image).engine_text(name) for ocr_image in ocr_images]
+        batch_engine.__name__ = f"ocr_batch_with_{name}"
+        return batch_engine
+
+    for backend in medivault.ocr_backends.values():
+        backend.loader = lambda: 'stub'
+        backend.loaded = False
+        backend.client = None
+    medivault.OCR_ENGINES[:] = [(name, label, make_engine(name)) for name, label, engine_fn in medivault.OCR_ENGINES]
+    for name in medivault.OCR_BATCH_ENGINES:
+        medivault.OCR_BATCH_ENGINES[name] = make_batch_engine(name)
+
+def load_app(groq_latency_ms):
+    """Import app.py pointed at the Groq stub; must run before anything else imports it"""
+    groq_stub = start_groq_stub(groq_latency_ms)
+    os.environ['MEDIVAULT_GROQ_API_URL'] = f"http://127.0.0.1:{groq_stub.server_port}/openai/v1/chat/completions"
+    os.environ.setdefault('MEDIVAULT_LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('MEDIVAULT_SLOW_REQUEST_MS', '0')
+    # Every run exercises all engines, so results stay comparable with the baseline
+    os.environ.setdefault('MEDIVAULT_OCR_POLICY', 'fixed')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as medivault
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    return medivault
+
+# ---------------------------------------------------------------------------
+# Measurement and reporting
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+def summarize(samples, wall_seconds, errors=0):
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'errors': errors,
+        'ops_per_second': round(len(ordered) / wall_seconds, 2) if wall_seconds else 0.0,
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3)
+    }
+
+def time_calls(fn, inputs, iterations):
+    samples = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        call_started = time.perf_counter()
+        fn(inputs[i % len(inputs)])
+        samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started)
+
+def print_report(title, results):
+    click.echo(f"\n{title}")
+    click.echo(f"{'name':<28}{'count':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in results.items():
+        click.echo(f"{name:<28}{stats['count']:>8}{stats['errors']:>8}{stats['ops_per_second']:>10.1f}"
+                   f"{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+
+def compare_with_baseline(results, baseline, tolerance):
+    """Print p95 and throughput changes; returns the names that regressed beyond tolerance"""
+    regressions = []
+    click.echo(f"\nComparison with baseline (tolerance {tolerance:.0%})")
+    click.echo(f"{'name':<34}{'p95 ms':>12}{'change':>10}{'ops/s':>12}{'change':>10}")
+    for suite, suite_results in results.items():
+        for name, stats in suite_results.items():
+            old = baseline.get(suite, {}).get(name)
+            if not old:
+                continue
+            p95_change = stats['p95_ms'] / old['p95_ms'] - 1 if old['p95_ms'] else 0.0
+            ops_change = stats['ops_per_second'] / old['ops_per_second'] - 1 if old['ops_per_second'] else 0.0
+            regressed = p95_change > tolerance or ops_change < -tolerance
+            if regressed:
+                regressions.append(f"{suite}.{name}")
+            click.echo(f"{suite + '.' + name:<34}{stats['p95_ms']:>12.2f}{p95_change:>+10.1%}"
+                       f"{stats['ops_per_second']:>12.1f}{ops_change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+# ---------------------------------------------------------------------------
+# Microbenchmarks
+# ---------------------------------------------------------------------------
+
+def seed_medicine_catalog(medivault):
+    """The fast-path parser only recognises names in the medicine master table"""
+    with medivault.db_pool.connection() as conn:
+        cur = conn.cursor()
+        cur.executemany("INSERT IGNORE INTO medicine (medicine_name, common_dosage) VALUES (%s, %s)", MEDICINES)
+        conn.commit()
+        cur.close()
+
+def run_micro(medivault, corpus, iterations):
+    seed_medicine_catalog(medivault)
+    texts = [[document.engine_text(engine) for engine in ('tesseract', 'easyocr', 'google_vision')]
+             for document in corpus.documents]
+    dates = [document.date.strftime(fmt) for document in corpus.documents
+             for fmt in ('%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y')] + ['', 'not a date', '31/02/2024']
+    ocr_iterations = max(iterations // 10, len(corpus.paths))
+    return {
+        'preprocess_for_ocr': time_calls(medivault.preprocess_for_ocr, corpus.paths, ocr_iterations),
+        'extract_text_triple_ocr': time_calls(medivault.extract_text_triple_ocr, corpus.paths, ocr_iterations),
+        'fast_path_parse': time_calls(medivault.fast_path_parse, texts, iterations),
+        'fuse_prescription': time_calls(lambda three: medivault.fuse_prescription(*three), texts,
+                                        max(iterations // 10, len(texts))),
+        'parse_prescription_date': time_calls(medivault.parse_prescription_date, dates, iterations * 10)
+    }
+
+# ---------------------------------------------------------------------------
+# Load generator
+# ---------------------------------------------------------------------------
+
+def seed_database(medivault, corpus, users, prescriptions_per_user):
+    """Create the benchmark users and top each one up to prescriptions_per_user prescriptions"""
+    seed_medicine_catalog(medivault)
+    # Seeded rows point at copies of the corpus images so the pages have real files to show
+    relative_paths = []
+    for index, path in enumerate(corpus.paths):
+        name = f"bench_corpus_{index}.png"
+        shutil.copyfile(path, os.path.join(medivault.UPLOAD_FOLDER, name))
+        relative_paths.append(f"uploads/{name}")
+    password = medivault.generate_password_hash(BENCH_PASSWORD)
+    with medivault.db_pool.connection() as conn:
+        cur = conn.cursor(dictionary=True)
+        for n in range(users):
+            email = BENCH_EMAIL.format(n)
+            cur.execute("INSERT IGNORE INTO user (name, email, password) VALUES (%s, %s, %s)",
+                        (f"Bench User {n}", email, password))
+            cur.execute("SELECT user_id FROM user WHERE email = %s", (email,))
+            user_id = cur.fetchone()['user_id']
+            cur.execute("SELECT COUNT(*) AS total FROM prescription WHERE user_id = %s", (user_id,))
+            missing = prescriptions_per_user - cur.fetchone()['total']
+            items = []
+            for i in range(max(missing, 0)):
+                document = corpus.documents[(n + i) % len(corpus.documents)]
+                items.append({
+                    'issue': document.issue,
+                    'description': 'benchmark seed',
+                    'parsed_data': document.parsed_data(),
+                    'relative_path': relative_paths[document.index],
+                    'combined_text': medivault.combine_ocr_texts(document.text, document.text, document.text)
+                })
+            if items:
+                medivault.save_prescription_batch(cur, user_id, items)
+            conn.commit()
+        cur.close()
+
+def start_server(medivault):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, medivault.app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+class LoadRecorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.pending_uploads = []
+
+    def record(self, name, seconds, ok):
+        with self.lock:
+            self.samples.setdefault(name, [])
+            self.errors.setdefault(name, 0)
+            if ok:
+                self.samples[name].append(seconds)
+            else:
+                self.errors[name] += 1
+
+def virtual_user(base_url, user_number, corpus, recorder, deadline, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.post(f"{base_url}/login", data={'email': BENCH_EMAIL.format(user_number), 'password': BENCH_PASSWORD})
+    scenarios = list(LOAD_MIX)
+    weights = [LOAD_MIX[name] for name in scenarios]
+    while time.monotonic() < deadline:
+        scenario = rng.choices(scenarios, weights)[0]
+        started = time.perf_counter()
+        try:
+            if scenario == 'dashboard':
+                response = session.get(f"{base_url}/dashboard")
+                ok = response.status_code == 200
+            elif scenario == 'analytics':
+                response = session.get(f"{base_url}/analytics")
+                ok = response.status_code == 200
+            elif scenario == 'search':
+                query = rng.choice([rng.choice(MEDICINES)[0], rng.choice(ISSUES), rng.choice(DOCTORS).split()[0]])
+                response = session.post(f"{base_url}/search", json={'query': query})
+                ok = response.status_code == 200 and response.json().get('status') == 'success'
+            else:
+                document = rng.choice(corpus.documents)
+                with open(corpus.paths[document.index], 'rb') as image_file:
+                    response = session.post(f"{base_url}/upload",
+                                            data={'issue': document.issue, 'description': 'benchmark upload'},
+                                            files={'file': (f"bench_{document.index}.png", image_file, 'image/png')})
+                if response.status_code == 429:
+                    scenario = 'upload_rejected'
+                    ok = True
+                else:
+                    ok = response.status_code == 202
+                    if ok:
+                        with recorder.lock:
+                            recorder.pending_uploads.append((response.json()['status_url'], started, session))
+        except requests.RequestException:
+            ok = False
+        recorder.record(scenario, time.perf_counter() - started, ok)
+
+def poll_uploads(base_url, recorder, stop):
+    """Record upload_pipeline: time from POST /upload until the job is done"""
+    while not stop.is_set() or recorder.pending_uploads:
+        with recorder.lock:
+            pending, recorder.pending_uploads = recorder.pending_uploads, []
+        still_running = []
+        for status_url, started, session in pending:
+            try:
+                job = session.get(f"{base_url}{status_url}").json()
+            except (requests.RequestException, ValueError):
+                recorder.record('upload_pipeline', 0.0, False)
+                continue
+            if job.get('job_status') in ('done', 'failed'):
+                recorder.record('upload_pipeline', time.perf_counter() - started, job['job_status'] == 'done')
+            else:
+                still_running.append((status_url, started, session))
+        with recorder.lock:
+            recorder.pending_uploads.extend(still_running)
+        time.sleep(0.2)
+
+def run_load(medivault, corpus, users, concurrency, duration, drain_timeout):
+    server, base_url = start_server(medivault)
+    recorder = LoadRecorder()
+    stop = threading.Event()
+    poller = threading.Thread(target=poll_uploads, args=(base_url, recorder, stop), daemon=True)
+    poller.start()
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=virtual_user,
+                                args=(base_url, n % users, corpus, recorder, deadline, n), daemon=True)
+               for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    # Let queued uploads finish so upload_pipeline includes them
+    stop.set()
+    poller.join(timeout=drain_timeout)
+    server.shutdown()
+    return {name: summarize(samples, wall_seconds, recorder.errors[name])
+            for name, samples in sorted(recorder.samples.items())}
+
+# ---------------------------------------------------------------------------
+# CLI
+# ---------------------------------------------------------------------------
+
+def run_suites(suites, options):
+    medivault = load_app(options['groq_latency_ms'])
+    corpus = Corpus(options['corpus_size'], options['noise'], options['seed'])
+    install_ocr_stubs(medivault, corpus, options['ocr_latency_ms'])
+    # Start every run from an empty result cache so runs are comparable
+    medivault.ocr_cache = medivault.ResultCache(os.path.join(corpus.directory, 'cache'),
+                                                medivault.OCR_CACHE_MEMORY_ENTRIES,
+                                                medivault.OCR_CACHE_DISK_MAX_BYTES)
+    results = {}
+    try:
+        if 'micro' in suites:
+            results['micro'] = run_micro(medivault, corpus, options['iterations'])
+            print_report('Microbenchmarks', results['micro'])
+        if 'load' in suites:
+            if options['seed_db']:
+                seed_database(medivault, corpus, options['users'], options['prescriptions'])
+            results['load'] = run_load(medivault, corpus, options['users'], options['concurrency'],
+                                       options['duration'], options['drain_timeout'])
+            print_report('Load test', results['load'])
+    finally:
+        corpus.cleanup()
+
+    regressions = []
+    if options['baseline'] and os.path.exists(options['baseline']):
+        with open(options['baseline'], 'r', encoding='utf-8') as baseline_file:
+            regressions = compare_with_baseline(results, json.load(baseline_file), options['tolerance'])
+    if options['output']:
+        with open(options['output'], 'w', encoding='utf-8') as output_file:
+            json.dump(results, output_file, indent=2)
+    if options['save_baseline'] and options['baseline']:
+        with open(options['baseline'], 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+        click.echo(f"\nSaved baseline to {options['baseline']}")
+    if regressions:
+        click.echo(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+def common_options(fn):
+    options = [
+        click.option('--corpus-size', default=20, show_default=True, help='Synthetic prescription images.'),
+        click.option('--noise', default=0.2, show_default=True,
+                     help='Fraction of images whose engines disagree, forcing the Groq path.'),
+        click.option('--ocr-latency-ms', default=50, show_default=True, help='Stub latency per OCR engine call.'),
+        click.option('--groq-latency-ms', default=300, show_default=True, help='Stub Groq response latency.'),
+        click.option('--seed', default=42, show_default=True, help='Random seed for the corpus and load mix.'),
+        click.option('--baseline', type=click.Path(dir_okay=False), help='Baseline JSON to compare against.'),
+        click.option('--save-baseline', is_flag=True, help='Write this run to --baseline.'),
+        click.option('--tolerance', default=0.10, show_default=True,
+                     help='Allowed p95 increase / throughput drop before a result counts as a regression.'),
+        click.option('--output', type=click.Path(dir_okay=False), help='Write results as JSON.'),
+        click.option('--iterations', default=1000, show_default=True, help='Microbenchmark iterations.'),
+        click.option('--users', default=10, show_default=True, help='Benchmark users to seed and log in as.'),
+        click.option('--prescriptions', default=200, show_default=True, help='Seeded prescriptions per user.'),
+        click.option('--no-seed', 'seed_db', is_flag=True, flag_value=False, default=True,
+                     help='Use the benchmark users already in the database.'),
+        click.option('--concurrency', default=8, show_default=True, help='Concurrent virtual users.'),
+        click.option('--duration', default=30, show_default=True, help='Load test length in seconds.'),
+        click.option('--drain-timeout', default=60, show_default=True,
+                     help='Seconds to wait for queued uploads after the load stops.'),
+    ]
+    for option in reversed(options):
+        fn = option(fn)
+    return fn
+
+@click.group()
+def cli():
+    """MediVault benchmarks (OCR engines and Groq are stubbed)"""
+
+@cli.command()
+@common_options
+def micro(**options):
+    """OCR stage, fusion parsing and date parsing"""
+    run_suites({'micro'}, options)
+
+@cli.command()
+@common_options
+def load(**options):
+    """End-to-end load on /dashboard, /analytics, /search and /upload"""
+    run_suites({'load'}, options)
+
+@cli.command(name='all')
+@common_options
+def run_all(**options):
+    """Both suites"""
+    run_suites({'micro', 'load'}, options)
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,16 @@
+"""Database settings shared by app.py and the standalone scripts (generate_data.py)
+
+Kept out of app.py so tools that only need to reach the database do not
+import the Flask application and start its pools and executors.
+"""
+
+import os
+
+# Database connection; MEDIVAULT_DB_* environment variables override the defaults
+DB_CONFIG = {
+    'host': os.environ.get('MEDIVAULT_DB_HOST', "localhost"),
+    'user': os.environ.get('MEDIVAULT_DB_USER', "root"),
+    'password': os.environ.get('MEDIVAULT_DB_PASSWORD', "sql123"),
+    'database': os.environ.get('MEDIVAULT_DB_NAME', "MediVault"),
+    'ssl_disabled': True
+}
@@ -0,0 +1,370 @@
+"""Synthetic data generator and bulk loader for the MediVault schema
+
+Fills user, prescription, prescription_medication, prescription_log and
+ai_query_log with realistic volumes for scaling tests:
+
+    python generate_data.py --users 100000 --prescriptions-per-user 20
+    python generate_data.py --users 100000 --method load-data --workers 8
+
+Distributions: prescriptions per user are log-normal (most users have a
+handful, a long tail has hundreds); issues and medicines follow a Zipf-like
+popularity curve; each user sees a few regular doctors.
+
+Rows are written with multi-row INSERTs (or LOAD DATA LOCAL INFILE with
+--method load-data, which needs local_infile enabled on the server). Each
+session sets @medivault_bulk_load, which makes the per-row insert triggers
+skip, so the loader writes what they would have written itself:
+prescription.medicine_count, the CREATED rows in prescription_log, and
+user_stats / user_doctor_count / user_month_count through
+RebuildUserStatsRange once a chunk of users is loaded.
+
+Output is deterministic for a given --seed, whatever --workers is.
+"""
+
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import click
+import mysql.connector
+from werkzeug.security import generate_password_hash
+
+from config import DB_CONFIG
+
+# (name, common dosage, common frequency), most prescribed first
+MEDICINES = [
+    ('Paracetamol', '500mg', 'TID'), ('Amoxicillin', '500mg', 'TID'), ('Cetirizine', '10mg', 'QD'),
+    ('Azithromycin', '500mg', 'QD'), ('Pantoprazole', '40mg', 'QD'), ('Ibuprofen', '400mg', 'BID'),
+    ('Dolo 650', '650mg', 'TID'), ('Metformin', '500mg', 'BID'), ('Amlodipine', '5mg', 'QD'),
+    ('Omeprazole', '20mg', 'QD'), ('Atorvastatin', '10mg', 'QD'), ('Montelukast', '10mg', 'QD'),
+    ('Levocetirizine', '5mg', 'QD'), ('Cefixime', '200mg', 'BID'), ('Doxycycline', '100mg', 'BID'),
+    ('Diclofenac', '50mg', 'BID'), ('Ranitidine', '150mg', 'BID'), ('Vitamin D3', '60000iu', 'Weekly'),
+    ('Telmisartan', '40mg', 'QD'), ('Losartan', '50mg', 'QD'), ('Glimepiride', '2mg', 'QD'),
+    ('Ondansetron', '4mg', 'TID'), ('Domperidone', '10mg', 'TID'), ('Metronidazole', '400mg', 'TID'),
+    ('Ciprofloxacin', '500mg', 'BID'), ('Aceclofenac', '100mg', 'BID'), ('Prednisolone', '10mg', 'QD'),
+    ('Salbutamol', '2mg', 'TID'), ('Levothyroxine', '50mcg', 'QD'), ('Clopidogrel', '75mg', 'QD'),
+    ('Aspirin', '75mg', 'QD'), ('Rosuvastatin', '10mg', 'QD'), ('Esomeprazole', '40mg', 'QD'),
+    ('Fexofenadine', '120mg', 'QD'), ('Loratadine', '10mg', 'QD'), ('Amoxiclav', '625mg', 'BID'),
+    ('Ofloxacin', '200mg', 'BID'), ('Fluconazole', '150mg', 'QD'), ('Ivermectin', '12mg', 'QD'),
+    ('Hydroxychloroquine', '200mg', 'BID'), ('Folic Acid', '5mg', 'QD'), ('Calcium Carbonate', '500mg', 'BID'),
+    ('Iron Sucrose', '100mg', 'QD'), ('Vitamin B12', '1500mcg', 'QD'), ('Zinc Sulfate', '20mg', 'QD'),
+    ('Tramadol', '50mg', 'BID'), ('Gabapentin', '300mg', 'QD'), ('Sertraline', '50mg', 'QD'),
+    ('Escitalopram', '10mg', 'QD'), ('Alprazolam', '0.25mg', 'QD'), ('Propranolol', '40mg', 'BID'),
+    ('Metoprolol', '50mg', 'BID'), ('Furosemide', '40mg', 'QD'), ('Spironolactone', '25mg', 'QD'),
+    ('Insulin Glargine', '10units', 'QD'), ('Sitagliptin', '100mg', 'QD'), ('Linagliptin', '5mg', 'QD'),
+    ('Budesonide', '200mcg', 'BID'), ('Mupirocin', '2%', 'TID'), ('Clotrimazole', '1%', 'BID'),
+]
+FREQUENCIES = [('QD', 30), ('BID', 30), ('TID', 20), ('QID', 5), ('HS', 8), ('SOS', 7)]
+DURATIONS = [('3 days', 15), ('5 days', 30), ('7 days', 25), ('10 days', 10), ('14 days', 8), ('1 month', 8),
+             ('3 months', 4)]
+ISSUES = [
+    'fever', 'cold', 'cough', 'throat infection', 'headache', 'migraine', 'back pain', 'tooth pain',
+    'stomach ache', 'acidity', 'diarrhea', 'allergy', 'skin rash', 'diabetes follow-up', 'blood pressure',
+    'thyroid', 'cholesterol', 'asthma', 'urinary infection', 'joint pain', 'vitamin deficiency', 'anxiety',
+    'insomnia', 'eye infection', 'ear pain', 'sprain', 'viral infection', 'fungal infection', 'anemia',
+    'general checkup',
+]
+FIRST_NAMES = ['Anita', 'Rahul', 'Priya', 'Vikram', 'Sunita', 'Arjun', 'Kavita', 'Rohan', 'Meera', 'Sanjay',
+               'Deepa', 'Amit', 'Neha', 'Karthik', 'Pooja', 'Suresh', 'Lakshmi', 'Manoj', 'Divya', 'Ajay']
+LAST_NAMES = ['Sharma', 'Mehta', 'Nair', 'Rao', 'Iyer', 'Kapoor', 'Gupta', 'Reddy', 'Menon', 'Patel',
+              'Joshi', 'Das', 'Banerjee', 'Pillai', 'Singh', 'Kulkarni', 'Chopra', 'Verma', 'Bose', 'Shetty']
+MEDICINES_PER_PRESCRIPTION = [(1, 25), (2, 35), (3, 20), (4, 12), (5, 8)]
+
+# Load order matters for the foreign keys (they are not checked during the load, but keep it honest)
+TABLE_COLUMNS = {
+    'user': ('user_id', 'name', 'email', 'password', 'created_at'),
+    'prescription': ('prescription_id', 'user_id', 'issue', 'description', 'doctor_name', 'prescription_date',
+                     'file_path', 'extracted_text', 'created_at', 'updated_at', 'medicine_count'),
+    'prescription_medication': ('prescription_id', 'medicine_id', 'medicine_name', 'dosage', 'frequency',
+                                'duration'),
+    'prescription_log': ('user_id', 'prescription_id', 'action_type', 'action_timestamp'),
+    'ai_query_log': ('user_id', 'query_text', 'matched_prescription_ids', 'response_summary', 'created_at'),
+}
+
+def zipf_weights(count, exponent=1.0):
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+def cumulative(weights):
+    total = 0
+    result = []
+    for weight in weights:
+        total += weight
+        result.append(total)
+    return result
+
+# ---------------------------------------------------------------------------
+# Row generation (runs in the worker processes)
+# ---------------------------------------------------------------------------
+
+class ChunkGenerator:
+    """Rows for one contiguous range of users; deterministic for (seed, chunk)"""
+
+    def __init__(self, task):
+        self.task = task
+        self.rng = random.Random(f"{task['seed']}:{task['chunk']}")
+        self.doctors = task['doctors']
+        self.medicine_ids = task['medicine_ids']
+        self.medicine_cum = cumulative(zipf_weights(len(MEDICINES), 1.1))
+        self.issue_cum = cumulative(zipf_weights(len(ISSUES), 0.9))
+        self.frequency_names, frequency_weights = zip(*FREQUENCIES)
+        self.frequency_cum = cumulative(frequency_weights)
+        self.duration_names, duration_weights = zip(*DURATIONS)
+        self.duration_cum = cumulative(duration_weights)
+        self.count_values, count_weights = zip(*MEDICINES_PER_PRESCRIPTION)
+        self.count_cum = cumulative(count_weights)
+
+    def pick(self, values, cum):
+        return self.rng.choices(values, cum_weights=cum)[0]
+
+    def generate(self):
+        rows = {table: [] for table in TABLE_COLUMNS}
+        task = self.task
+        now = task['now']
+        span_seconds = int(task['years'] * 365 * 86400)
+        prescription_id = task['first_prescription_id']
+        for offset, count in enumerate(task['counts']):
+            user_id = task['first_user_id'] + offset
+            rng = self.rng
+            # Each user joined at some point in the window and has a few regular doctors
+            joined = now - timedelta(seconds=rng.randrange(span_seconds))
+            active_seconds = max(int((now - joined).total_seconds()), 1)
+            regular_doctors = rng.sample(self.doctors, rng.randint(1, 3))
+            rows['user'].append((user_id, f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                                 f"user{user_id}@medivault.test", task['password_hash'], joined))
+
+            created = sorted(joined + timedelta(seconds=rng.randrange(active_seconds)) for _ in range(count))
+            kept_ids = []
+            kept_terms = []
+            for created_at in created:
+                if rng.random() < task['deleted_fraction']:
+                    # Created and later deleted: only the audit trail remains, as after a real delete
+                    deleted_at = min(created_at + timedelta(days=rng.randint(0, 60)), now)
+                    rows['prescription_log'].append((user_id, prescription_id, 'CREATED', created_at))
+                    rows['prescription_log'].append((user_id, prescription_id, 'DELETED', deleted_at))
+                    prescription_id += 1
+                    continue
+                self.prescription(rows, prescription_id, user_id, created_at, regular_doctors, kept_terms)
+                kept_ids.append(prescription_id)
+                prescription_id += 1
+            self.queries(rows, user_id, joined, active_seconds, kept_ids, kept_terms)
+        return rows
+
+    def prescription(self, rows, prescription_id, user_id, created_at, regular_doctors, kept_terms):
+        rng = self.rng
+        issue = self.pick(ISSUES, self.issue_cum)
+        doctor = None
+        if rng.random() > 0.05:
+            doctor = rng.choice(regular_doctors) if rng.random() < 0.85 else rng.choice(self.doctors)
+        prescription_date = (created_at - timedelta(days=rng.randint(0, 5))).date() if rng.random() > 0.1 else None
+        medicine_count = self.pick(self.count_values, self.count_cum)
+        # Distinct medicines; sampling with replacement and dropping repeats keeps the popularity skew
+        chosen = list(dict.fromkeys(self.pick(MEDICINES, self.medicine_cum) for _ in range(medicine_count)))
+        lines = []
+        for name, dosage, common_frequency in chosen:
+            frequency = common_frequency if rng.random() < 0.7 else self.pick(self.frequency_names, self.frequency_cum)
+            duration = self.pick(self.duration_names, self.duration_cum)
+            rows['prescription_medication'].append((prescription_id, self.medicine_ids.get(name), name, dosage,
+                                                    frequency, duration))
+            lines.append(f"{name} {dosage} {frequency} x {duration}")
+        header = [f"Dr. {doctor}" if doctor else "", f"Date: {prescription_date:%d/%m/%Y}" if prescription_date else ""]
+        rows['prescription'].append((
+            prescription_id, user_id, issue, '' if rng.random() < 0.6 else f"Follow up for {issue}",
+            doctor, prescription_date, f"uploads/synthetic/{prescription_id}.png",
+            '\n'.join(line for line in header + lines if line), created_at, created_at, len(chosen)
+        ))
+        rows['prescription_log'].append((user_id, prescription_id, 'CREATED', created_at))
+        kept_terms.append((prescription_id, issue, [name for name, dosage, frequency in chosen]))
+
+    def queries(self, rows, user_id, joined, active_seconds, kept_ids, kept_terms):
+        rng = self.rng
+        mean = self.task['queries_per_user']
+        if mean <= 0:
+            return
+        # Poisson via exponential gaps
+        count, elapsed = 0, rng.expovariate(1.0)
+        while elapsed < mean:
+            count += 1
+            elapsed += rng.expovariate(1.0)
+        for _ in range(count):
+            if kept_terms and rng.random() < 0.8:
+                prescription_id, issue, names = rng.choice(kept_terms)
+                query = rng.choice(names) if rng.random() < 0.6 else issue
+                matched = [pid for pid, other_issue, other_names in kept_terms
+                           if query == other_issue or query in other_names][:50]
+            else:
+                query = self.pick(MEDICINES, self.medicine_cum)[0]
+                matched = []
+            rows['ai_query_log'].append((user_id, query, ','.join(map(str, matched)),
+                                         f'Found {len(matched)} results',
+                                         joined + timedelta(seconds=rng.randrange(active_seconds))))
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+
+def insert_rows(cur, table, columns, rows, batch_size):
+    """Multi-row INSERTs; mysql.connector rewrites executemany into one statement per batch"""
+    sql = f"INSERT INTO `{table}` ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    for start in range(0, len(rows), batch_size):
+        cur.executemany(sql, rows[start:start + batch_size])
+
+def tsv_field(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+def load_data_rows(cur, table, columns, rows, batch_size):
+    """LOAD DATA LOCAL INFILE from a temporary tab-separated file"""
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.tsv', delete=False, newline='') as out:
+        path = out.name
+        for row in rows:
+            out.write('\t'.join(tsv_field(value) for value in row))
+            out.write('\n')
+    try:
+        cur.execute(f"""
+            LOAD DATA LOCAL INFILE '{path.replace(os.sep, '/')}' INTO TABLE `{table}`
+            CHARACTER SET utf8mb4 FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+            ({', '.join(columns)})
+        """)
+    finally:
+        os.remove(path)
+
+WRITERS = {'insert': insert_rows, 'load-data': load_data_rows}
+
+def load_chunk(task):
+    """Generate and load one chunk of users in its own connection and transaction"""
+    started = time.perf_counter()
+    rows = ChunkGenerator(task).generate()
+    generated = time.perf_counter()
+    conn = mysql.connector.connect(**task['db_config'], autocommit=False,
+                                   allow_local_infile=task['method'] == 'load-data')
+    try:
+        cur = conn.cursor()
+        cur.execute("SET @medivault_bulk_load = 1")
+        # Keys are generated unique and every reference points at a row in the same chunk
+        cur.execute("SET unique_checks = 0, foreign_key_checks = 0")
+        writer = WRITERS[task['method']]
+        for table, columns in TABLE_COLUMNS.items():
+            writer(cur, table, columns, rows[table], task['batch_size'])
+        conn.commit()
+        last_user_id = task['first_user_id'] + len(task['counts']) - 1
+        cur.callproc('RebuildUserStatsRange', (task['first_user_id'], last_user_id))
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+    return {
+        'chunk': task['chunk'],
+        'rows': {table: len(table_rows) for table, table_rows in rows.items()},
+        'generate_seconds': generated - started,
+        'load_seconds': time.perf_counter() - generated
+    }
+
+# ---------------------------------------------------------------------------
+# Planning (main process)
+# ---------------------------------------------------------------------------
+
+def prescription_counts(rng, users, mean, max_per_user):
+    """Log-normal counts with the requested mean, capped at max_per_user"""
+    sigma = 1.0
+    mu = math.log(max(mean, 1)) - sigma ** 2 / 2
+    return [min(max(int(round(rng.lognormvariate(mu, sigma))), 1), max_per_user) for _ in range(users)]
+
+def prepare_database(db_config):
+    """Next free user and prescription ids, plus medicine master ids (inserting any missing names)"""
+    conn = mysql.connector.connect(**db_config)
+    cur = conn.cursor()
+    cur.executemany("INSERT IGNORE INTO medicine (medicine_name, common_dosage, common_frequency) VALUES (%s, %s, %s)",
+                    MEDICINES)
+    conn.commit()
+    cur.execute("SELECT medicine_name, medicine_id FROM medicine")
+    medicine_ids = dict(cur.fetchall())
+    cur.execute("SELECT COALESCE(MAX(user_id), 0) FROM user")
+    next_user_id = cur.fetchone()[0] + 1
+    # Deleted prescriptions only survive in the log; never reuse their ids
+    cur.execute("""
+        SELECT GREATEST(
+            (SELECT COALESCE(MAX(prescription_id), 0) FROM prescription),
+            (SELECT COALESCE(MAX(prescription_id), 0) FROM prescription_log)
+        )
+    """)
+    next_prescription_id = cur.fetchone()[0] + 1
+    cur.close()
+    conn.close()
+    return next_user_id, next_prescription_id, medicine_ids
+
+@click.command()
+@click.option('--users', default=10000, show_default=True, help='Users to create.')
+@click.option('--prescriptions-per-user', default=20.0, show_default=True,
+              help='Mean prescriptions per user (log-normal), including deleted ones.')
+@click.option('--max-per-user', default=1000, show_default=True, help='Cap on prescriptions for a single user.')
+@click.option('--queries-per-user', default=5.0, show_default=True, help='Mean ai_query_log rows per user.')
+@click.option('--deleted-fraction', default=0.02, show_default=True,
+              help='Share of prescriptions that were deleted (log rows only).')
+@click.option('--years', default=3.0, show_default=True, help='History window for created_at.')
+@click.option('--doctors', default=2000, show_default=True, help='Distinct doctors across all users.')
+@click.option('--password', default='password123', show_default=True, help='Password of every generated user.')
+@click.option('--method', type=click.Choice(list(WRITERS)), default='insert', show_default=True,
+              help="Multi-row INSERTs, or LOAD DATA LOCAL INFILE (needs local_infile=ON on the server).")
+@click.option('--chunk-users', default=1000, show_default=True, help='Users per transaction.')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows per INSERT statement.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Loader processes.')
+@click.option('--seed', default=1, show_default=True, help='Random seed; same seed, same data.')
+def main(users, prescriptions_per_user, max_per_user, queries_per_user, deleted_fraction, years, doctors,
+         password, method, chunk_users, batch_size, workers, seed):
+    """Generate synthetic MediVault data and bulk-load it into the configured database"""
+    rng = random.Random(seed)
+    next_user_id, next_prescription_id, medicine_ids = prepare_database(DB_CONFIG)
+    counts = prescription_counts(rng, users, prescriptions_per_user, max_per_user)
+    doctor_names = sorted({f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{'' if n < 400 else f' {n}'}"
+                           for n in range(doctors)})
+    shared = {
+        'db_config': DB_CONFIG,
+        'seed': seed,
+        'now': datetime.now().replace(microsecond=0),
+        'years': years,
+        'deleted_fraction': deleted_fraction,
+        'queries_per_user': queries_per_user,
+        'doctors': doctor_names,
+        'medicine_ids': medicine_ids,
+        'password_hash': generate_password_hash(password),
+        'method': method,
+        'batch_size': batch_size,
+    }
+    tasks = []
+    for chunk, start in enumerate(range(0, users, chunk_users)):
+        chunk_counts = counts[start:start + chunk_users]
+        tasks.append({**shared, 'chunk': chunk, 'counts': chunk_counts,
+                      'first_user_id': next_user_id + start, 'first_prescription_id': next_prescription_id})
+        next_prescription_id += sum(chunk_counts)
+
+    click.echo(f"Loading {users} users, ~{sum(counts)} prescriptions in {len(tasks)} chunks "
+               f"with {workers} worker(s) ({method})")
+    totals = {table: 0 for table in TABLE_COLUMNS}
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for done, result in enumerate(pool.imap_unordered(load_chunk, tasks), start=1):
+            for table, count in result['rows'].items():
+                totals[table] += count
+            elapsed = time.perf_counter() - started
+            loaded = sum(totals.values())
+            click.echo(f"  chunk {done}/{len(tasks)}: {loaded} rows, {loaded / elapsed:,.0f} rows/s "
+                       f"(generate {result['generate_seconds']:.1f}s, load {result['load_seconds']:.1f}s)")
+    elapsed = time.perf_counter() - started
+
+    click.echo(f"\nLoaded {sum(totals.values())} rows in {elapsed:.1f}s "
+               f"({sum(totals.values()) / elapsed:,.0f} rows/s)")
+    for table, count in totals.items():
+        click.echo(f"  {table:<25}{count:>12}")
+    click.echo(f"Every generated user logs in with password '{password}'.")
+
+if __name__ == '__main__':
+    main()
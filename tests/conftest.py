@@ -0,0 +1,13 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def no_background_workers(monkeypatch):
+    """Requests through the test client must not start upload workers that talk to MySQL"""
+    import app
+    monkeypatch.setattr(app, 'ensure_upload_workers', lambda: None)
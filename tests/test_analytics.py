@@ -0,0 +1,136 @@
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app
+
+
+def join_row(prescription_id, issue, created_at, medicine_count, medicine=None, medicine_id=None,
+             catalog_name=None, dosage=None):
+    return {'prescription_id': prescription_id, 'issue': issue, 'doctor_name': 'Dr. Rao',
+            'prescription_date': None, 'created_at': created_at, 'medicine_count': medicine_count,
+            'medicine_id': medicine_id, 'medicine_name': medicine, 'dosage': dosage, 'catalog_name': catalog_name}
+
+
+class AnalyticsCursor:
+    """Iterates over compute_user_analytics' join rows and answers the data_version read"""
+
+    def __init__(self, rows, data_version=1):
+        self.rows = rows
+        self.data_version = data_version
+        self.analytics_queries = 0
+        self.result = []
+
+    def execute(self, sql, params=()):
+        if 'data_version' in sql:
+            self.result = [{'data_version': self.data_version}]
+        else:
+            self.analytics_queries += 1
+            self.result = list(self.rows)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def __iter__(self):
+        return iter(self.result)
+
+
+def sample_rows():
+    january, february = datetime(2026, 1, 10), datetime(2026, 2, 3)
+    return [
+        join_row(1, 'Fever', january, 2, 'Paracetmol', 7, 'Paracetamol', '500mg'),
+        join_row(1, 'Fever', january, 2, 'Azee', None, None, '500mg'),
+        join_row(2, 'fever', february, 3, 'Tab. Paracetamol', 7, 'Paracetamol', '650mg'),
+        join_row(2, 'fever', february, 3, 'azee', None, None, None),
+        join_row(2, 'fever', february, 3, 'Pan 40', 9, 'Pantoprazole', '40mg'),
+        join_row(3, 'Cough', february, 0),
+    ]
+
+
+def test_aggregates_come_from_one_query():
+    cursor = AnalyticsCursor(sample_rows())
+    result = app.compute_user_analytics(cursor, 1)
+    assert cursor.analytics_queries == 1
+    assert result['monthly_stats'] == [{'month': '2026-02', 'count': 2}, {'month': '2026-01', 'count': 1}]
+    assert result['top_issues'] == [{'issue': 'Fever', 'count': 2}, {'issue': 'Cough', 'count': 1}]
+    medicines = {med['medicine_name']: med for med in result['medicine_stats']}
+    assert [med['medicine_name'] for med in result['medicine_stats']][:2] == ['Paracetamol', 'Azee']
+    assert medicines['Paracetamol']['usage_count'] == 2
+    assert medicines['Paracetamol']['dosages_used'] == '500mg,650mg'
+    assert medicines['Azee']['usage_count'] == 2
+    assert medicines['Pantoprazole']['dosages_used'] == '40mg'
+
+
+def test_complex_prescriptions_use_the_stored_medicine_count():
+    result = app.compute_user_analytics(AnalyticsCursor(sample_rows()), 1)
+    # Average over prescriptions with medicines is 2.5, so only the three-medicine one qualifies
+    assert [(pres['prescription_id'], pres['medicine_count']) for pres in result['complex_prescriptions']] == [(2, 3)]
+
+
+def test_days_since_use_counts_from_today():
+    created_at = datetime.combine(date.today() - timedelta(days=4), datetime.min.time())
+    result = app.compute_user_analytics(AnalyticsCursor([join_row(1, 'Fever', created_at, 1, 'Dolo')]), 1)
+    assert result['medicine_stats'][0]['avg_days_since_last_use'] == 4
+
+
+def test_cache_is_invalidated_when_data_version_changes():
+    cache = app.AnalyticsCache(max_users=10, ttl=60)
+    cache.put(1, 5, {'monthly_stats': []})
+    assert cache.get(1, 5) == {'monthly_stats': []}
+    assert cache.get(1, 6) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_cache_entries_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(app.time, 'monotonic', lambda: now[0])
+    cache = app.AnalyticsCache(max_users=10, ttl=60)
+    cache.put(1, 5, {'monthly_stats': []})
+    now[0] += 59
+    assert cache.get(1, 5) is not None
+    now[0] += 1
+    assert cache.get(1, 5) is None
+
+
+def test_cache_evicts_the_least_recently_used_user():
+    cache = app.AnalyticsCache(max_users=2, ttl=60)
+    cache.put(1, 1, 'one')
+    cache.put(2, 1, 'two')
+    cache.get(1, 1)
+    cache.put(3, 1, 'three')
+    assert list(cache.entries) == [1, 3]
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cursor_obj = cursor
+
+    def cursor(self, dictionary=False):
+        return self.cursor_obj
+
+
+@pytest.fixture
+def analytics_client(monkeypatch):
+    cursor = AnalyticsCursor(sample_rows())
+    monkeypatch.setattr(app.db_pool, 'acquire', lambda: FakeConnection(cursor))
+    monkeypatch.setattr(app.db_pool, 'release', lambda conn: None)
+    monkeypatch.setattr(app, 'analytics_cache', app.AnalyticsCache(max_users=10, ttl=60))
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    client.cursor = cursor
+    return client
+
+
+def test_route_recomputes_only_after_a_write(analytics_client):
+    first = analytics_client.get('/analytics')
+    assert first.status_code == 200
+    assert 'desc="computed"' in first.headers['Server-Timing']
+    second = analytics_client.get('/analytics')
+    assert 'desc="cache"' in second.headers['Server-Timing']
+    assert analytics_client.cursor.analytics_queries == 1
+    # A prescription insert, edit or delete bumps user_stats.data_version
+    analytics_client.cursor.data_version += 1
+    third = analytics_client.get('/analytics')
+    assert 'desc="computed"' in third.headers['Server-Timing']
+    assert analytics_client.cursor.analytics_queries == 2
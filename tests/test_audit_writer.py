@@ -0,0 +1,111 @@
+import contextlib
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+class FakeConnection:
+    def __init__(self, pool):
+        self.pool = pool
+        self.pending = []
+
+    def cursor(self):
+        return self
+
+    def executemany(self, sql, rows):
+        self.pending.append((sql.split()[2], list(rows)))
+
+    def commit(self):
+        if self.pool.failures_left:
+            self.pool.failures_left -= 1
+            raise RuntimeError('Lost connection to MySQL server')
+        self.pool.committed += self.pending
+
+    def close(self):
+        pass
+
+
+class FakePool:
+    def __init__(self, failures=0):
+        self.failures_left = failures
+        self.committed = []
+
+    @contextlib.contextmanager
+    def connection(self):
+        yield FakeConnection(self)
+
+
+@pytest.fixture
+def writer(monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    writers = []
+
+    def make(pool, queue_size=100, enqueue_timeout=0.5):
+        monkeypatch.setattr(app, 'db_pool', pool)
+        writers.append(app.AuditWriter(queue_size, flush_rows=50, flush_interval=0.05,
+                                       enqueue_timeout=enqueue_timeout))
+        return writers[-1]
+    yield make
+    for audit_writer in writers:
+        audit_writer.close(timeout=2)
+
+
+def log_row(prescription_id):
+    return (1, prescription_id, 'INSERT', datetime(2026, 1, 1))
+
+
+def test_rows_are_grouped_per_table(writer):
+    pool = FakePool()
+    audit_writer = writer(pool)
+    audit_writer.write('prescription_log', log_row(1))
+    audit_writer.write('ai_query_log', (1, 'fever', '1', 'Found 1 results', datetime(2026, 1, 1)))
+    audit_writer.write('prescription_log', log_row(2))
+    assert audit_writer.flush(2)
+    assert dict(pool.committed) == {'prescription_log': [log_row(1), log_row(2)],
+                                    'ai_query_log': [(1, 'fever', '1', 'Found 1 results', datetime(2026, 1, 1))]}
+    assert audit_writer.stats()['written'] == 3
+
+
+def test_failed_flush_is_retried(writer):
+    pool = FakePool(failures=app.AUDIT_FLUSH_RETRIES - 1)
+    audit_writer = writer(pool)
+    audit_writer.write('prescription_log', log_row(1))
+    assert audit_writer.flush(2)
+    assert pool.committed == [('prescription_log', [log_row(1)])]
+    stats = audit_writer.stats()
+    assert (stats['written'], stats['failed'], stats['flushes']) == (1, 0, 1)
+
+
+def test_rows_are_counted_lost_after_the_last_retry(writer):
+    pool = FakePool(failures=app.AUDIT_FLUSH_RETRIES)
+    audit_writer = writer(pool)
+    audit_writer.write('prescription_log', log_row(1))
+    audit_writer.write('prescription_log', log_row(2))
+    # flush() still returns: the rows were given up on, not left waiting
+    assert audit_writer.flush(2)
+    assert pool.committed == []
+    stats = audit_writer.stats()
+    assert (stats['written'], stats['failed']) == (0, 2)
+
+
+def test_close_drains_the_queue(writer):
+    pool = FakePool()
+    audit_writer = writer(pool)
+    for prescription_id in range(120):
+        audit_writer.write('prescription_log', log_row(prescription_id))
+    audit_writer.close(timeout=2)
+    assert not audit_writer.thread.is_alive()
+    assert sum(len(rows) for table, rows in pool.committed) == 120
+    assert audit_writer.stats()['queued'] == 0
+
+
+def test_full_queue_drops_the_row(writer, monkeypatch):
+    audit_writer = writer(FakePool(), queue_size=1, enqueue_timeout=0.01)
+    # No flusher thread, so the queue stays full
+    monkeypatch.setattr(audit_writer, '_ensure_started', lambda: None)
+    audit_writer.write('prescription_log', log_row(1))
+    audit_writer.write('prescription_log', log_row(2))
+    stats = audit_writer.stats()
+    assert (stats['enqueued'], stats['dropped'], stats['queued']) == (1, 1, 1)
@@ -0,0 +1,73 @@
+import json
+import random
+
+import pytest
+
+import app
+import benchmark
+
+
+def test_percentile_picks_the_nearest_rank():
+    values = [i / 100 for i in range(1, 101)]
+    assert benchmark.percentile(values, 0.50) == 0.51
+    assert benchmark.percentile(values, 0.99) == 1.0
+    assert benchmark.percentile(values, 1.0) == 1.0
+    assert benchmark.percentile([], 0.95) == 0.0
+
+
+def test_summarize_reports_milliseconds_and_throughput():
+    stats = benchmark.summarize([0.003, 0.001, 0.002, 0.004], wall_seconds=2.0, errors=1)
+    assert stats == {'count': 4, 'errors': 1, 'ops_per_second': 2.0, 'mean_ms': 2.5,
+                     'p50_ms': 3.0, 'p95_ms': 4.0, 'p99_ms': 4.0}
+    assert benchmark.summarize([], wall_seconds=0)['ops_per_second'] == 0.0
+
+
+def run(p95_ms, ops_per_second):
+    return {'count': 100, 'errors': 0, 'ops_per_second': ops_per_second, 'mean_ms': p95_ms / 2,
+            'p50_ms': p95_ms / 2, 'p95_ms': p95_ms, 'p99_ms': p95_ms}
+
+
+def test_baseline_comparison_flags_latency_and_throughput_regressions():
+    baseline = {'micro': {'fusion': run(10.0, 100.0), 'dates': run(1.0, 1000.0), 'ocr': run(50.0, 20.0)},
+                'load': {'dashboard': run(20.0, 50.0)}}
+    results = {'micro': {'fusion': run(10.9, 100.0), 'dates': run(1.2, 1000.0), 'ocr': run(50.0, 17.0),
+                         'new_benchmark': run(5.0, 10.0)},
+               'load': {'dashboard': run(19.0, 55.0)}}
+    assert benchmark.compare_with_baseline(results, baseline, tolerance=0.10) == ['micro.dates', 'micro.ocr']
+
+
+def test_zero_baseline_values_never_count_as_regressions():
+    baseline = {'micro': {'fusion': run(0.0, 0.0)}}
+    assert benchmark.compare_with_baseline({'micro': {'fusion': run(5.0, 1.0)}}, baseline, tolerance=0.1) == []
+
+
+def test_load_recorder_counts_errors_apart_from_samples():
+    recorder = benchmark.LoadRecorder()
+    recorder.record('search', 0.02, ok=True)
+    recorder.record('search', 5.0, ok=False)
+    recorder.record('upload', 0.5, ok=True)
+    assert recorder.samples == {'search': [0.02], 'upload': [0.5]}
+    assert recorder.errors == {'search': 1, 'upload': 0}
+
+
+def test_corpus_documents_are_deterministic_and_noisy_ones_disagree():
+    first = benchmark.SyntheticPrescription(0, random.Random(7), noisy=True)
+    again = benchmark.SyntheticPrescription(0, random.Random(7), noisy=True)
+    assert first.text == again.text
+    assert first.engine_text('tesseract') == first.text
+    assert first.engine_text('easyocr') != first.text
+    clean = benchmark.SyntheticPrescription(1, random.Random(7), noisy=False)
+    assert {clean.engine_text(name) for name in ('tesseract', 'easyocr', 'google_vision')} == {clean.text}
+
+
+@pytest.fixture
+def groq_stub():
+    server = benchmark.start_groq_stub(latency_ms=0)
+    yield f"http://127.0.0.1:{server.server_port}/openai/v1/chat/completions"
+    server.shutdown()
+    server.server_close()
+
+
+def test_groq_stub_speaks_the_chat_completions_format(groq_stub):
+    client = app.GroqClient(groq_stub, 'key', 'model', max_retries=0)
+    assert json.loads(client.complete('prompt'))['doctor_name'] == 'Dr. Stub'
@@ -0,0 +1,36 @@
+import importlib
+
+import pytest
+
+import config
+
+
+@pytest.fixture
+def reload_config(monkeypatch):
+    """Re-import config.py under the patched environment, and restore it afterwards"""
+    for name in ('MEDIVAULT_DB_HOST', 'MEDIVAULT_DB_USER', 'MEDIVAULT_DB_PASSWORD', 'MEDIVAULT_DB_NAME'):
+        monkeypatch.delenv(name, raising=False)
+    yield lambda: importlib.reload(config).DB_CONFIG
+    monkeypatch.undo()
+    importlib.reload(config)
+
+
+def test_defaults_without_environment(reload_config):
+    assert reload_config() == {'host': 'localhost', 'user': 'root', 'password': 'sql123',
+                               'database': 'MediVault', 'ssl_disabled': True}
+
+
+def test_environment_overrides_each_setting(reload_config, monkeypatch):
+    monkeypatch.setenv('MEDIVAULT_DB_HOST', 'db.internal')
+    monkeypatch.setenv('MEDIVAULT_DB_USER', 'medivault')
+    monkeypatch.setenv('MEDIVAULT_DB_PASSWORD', 's3cret')
+    monkeypatch.setenv('MEDIVAULT_DB_NAME', 'MediVaultTest')
+    assert reload_config() == {'host': 'db.internal', 'user': 'medivault', 'password': 's3cret',
+                               'database': 'MediVaultTest', 'ssl_disabled': True}
+
+
+def test_unset_variables_keep_their_defaults(reload_config, monkeypatch):
+    monkeypatch.setenv('MEDIVAULT_DB_HOST', 'replica')
+    db_config = reload_config()
+    assert db_config['host'] == 'replica'
+    assert (db_config['user'], db_config['database']) == ('root', 'MediVault')
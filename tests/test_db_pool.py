@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+import app
+
+
+class FakeRawConnection:
+    def __init__(self, connection_id):
+        self.connection_id = connection_id
+        self.pings = 0
+        self.closed = 0
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        self.pings += 1
+        if self.stale:
+            self.connection_id += 100
+            self.stale = False
+
+    stale = False
+
+    def close(self):
+        self.closed += 1
+
+
+class FakeMySQLPool:
+    def __init__(self, size):
+        self.connections = [FakeRawConnection(n) for n in range(1, size + 1)]
+        self.fail = False
+
+    def get_connection(self):
+        if self.fail:
+            raise app.mysql.connector.errors.InterfaceError('Lost connection')
+        return self.connections.pop(0)
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    created = []
+
+    def connector_pool(pool_size, **kwargs):
+        created.append(FakeMySQLPool(pool_size))
+        return created[-1]
+    monkeypatch.setattr(app.pooling, 'MySQLConnectionPool', connector_pool)
+
+    def make(size=1, wait_timeout=0.05, health_check_interval=30):
+        pool = app.DatabasePool(size, wait_timeout, health_check_interval, host='db.invalid')
+        pool.created = created
+        return pool
+    return make
+
+
+def give_back(pool, conn):
+    """What the mysql pool does with a closed connection: make it available again"""
+    pool.release(conn)
+    pool.pool.connections.append(conn._conn)
+
+
+def test_connections_are_opened_on_first_use(make_pool):
+    pool = make_pool()
+    assert pool.created == []
+    with pool.connection() as conn:
+        assert conn.connection_id == 1
+    assert len(pool.created) == 1
+
+
+def test_acquire_times_out_when_every_connection_is_in_use(make_pool):
+    pool = make_pool(size=1)
+    conn = pool.acquire()
+    with pytest.raises(app.mysql.connector.errors.PoolError):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+    give_back(pool, conn)
+    assert pool.acquire().connection_id == 1
+
+
+def test_waiter_gets_the_connection_when_it_is_released(make_pool):
+    pool = make_pool(size=1, wait_timeout=2)
+    conn = pool.acquire()
+    threading.Timer(0.05, give_back, (pool, conn)).start()
+    assert pool.acquire().connection_id == 1
+    stats = pool.stats()
+    assert (stats['acquisitions'], stats['in_use'], stats['timeouts']) == (2, 1, 0)
+    assert stats['wait_seconds_max'] > 0
+
+
+def test_failed_checkout_frees_the_slot(make_pool):
+    pool = make_pool(size=1)
+    pool.pool.fail = True
+    with pytest.raises(app.mysql.connector.errors.InterfaceError):
+        pool.acquire()
+    pool.pool.fail = False
+    assert pool.acquire().connection_id == 1
+
+
+def test_idle_connection_is_pinged_and_reconnected(make_pool):
+    pool = make_pool(size=1, health_check_interval=0)
+    raw = pool.pool.connections[0]
+    raw.stale = True
+    conn = pool.acquire()
+    assert conn.connection_id == 101
+    assert pool.stats()['reconnects'] == 1
+
+
+def test_recently_used_connection_skips_the_ping(make_pool):
+    pool = make_pool(size=1, health_check_interval=30)
+    give_back(pool, pool.acquire())
+    raw = pool.pool.connections[0]
+    pings = raw.pings
+    pool.acquire()
+    assert raw.pings == pings
@@ -0,0 +1,178 @@
+import csv
+import gzip
+import io
+import json
+import threading
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+def join_rows(prescriptions):
+    """The rows execute_export_query returns: one per medicine, or one with NULL medicine columns"""
+    rows = []
+    for prescription in prescriptions:
+        base = {'prescription_id': prescription['id'], 'created_at': datetime(2026, 1, prescription['id']),
+                'updated_at': datetime(2026, 2, prescription['id']), 'issue': 'Fever', 'description': '',
+                'doctor_name': 'Dr. Rao', 'prescription_date': None, 'file_path': 'uploads/x.png',
+                'medicine_count': len(prescription['medicines'])}
+        empty = {'medicine_id': None, 'medicine_name': None, 'dosage': None, 'frequency': None,
+                 'duration': None, 'notes': None}
+        for name in prescription['medicines'] or [None]:
+            rows.append({**base, **empty, **({'medicine_id': 7, 'medicine_name': name, 'dosage': '500mg'}
+                                            if name else {})})
+    return rows
+
+
+class FakeCursor:
+    def __init__(self, rows, deletions=()):
+        self.rows = list(rows)
+        self.deletions = list(deletions)
+        self.queries = []
+
+    def execute(self, sql, params=None):
+        self.queries.append((sql, params))
+
+    def fetchone(self):
+        return {'now': datetime(2026, 3, 1, 12, 0, 0), 'next_since': datetime(2026, 3, 1, 11, 59, 0)}
+
+    def fetchall(self):
+        return self.deletions
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return batch
+
+
+def test_records_group_adjacent_medicine_rows(monkeypatch):
+    monkeypatch.setattr(app, 'EXPORT_FETCH_ROWS', 2)
+    cursor = FakeCursor(join_rows([{'id': 1, 'medicines': ['Dolo', 'Azee', 'Pan']}, {'id': 2, 'medicines': []}]))
+    records = list(app.export_prescriptions_iter(cursor, include_text=False))
+    assert [record['prescription_id'] for record in records] == [1, 2]
+    assert [medicine['medicine_name'] for medicine in records[0]['medicines']] == ['Dolo', 'Azee', 'Pan']
+    assert records[1]['medicines'] == []
+    assert records[0]['updated_at'] == datetime(2026, 2, 1)
+
+
+def test_ndjson_lines_put_deletions_first():
+    deletions = [{'prescription_id': 9, 'deleted_at': datetime(2026, 2, 3)}]
+    records = [{'prescription_id': 1, 'created_at': datetime(2026, 1, 1), 'medicines': []}]
+    lines = [json.loads(line) for line in app.export_ndjson_lines(deletions, records)]
+    assert lines == [
+        {'record_type': 'deleted', 'prescription_id': 9, 'deleted_at': '2026-02-03T00:00:00'},
+        {'record_type': 'prescription', 'prescription_id': 1, 'created_at': '2026-01-01T00:00:00', 'medicines': []},
+    ]
+
+
+def test_csv_lines_write_one_row_per_medicine():
+    cursor = FakeCursor(join_rows([{'id': 1, 'medicines': ['Dolo', 'Azee']}, {'id': 2, 'medicines': []}]))
+    records = app.export_prescriptions_iter(cursor, include_text=False)
+    text = ''.join(app.export_csv_lines([{'prescription_id': 5, 'deleted_at': datetime(2026, 2, 1)}], records, False))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [(row['record_type'], row['prescription_id'], row['medicine_name']) for row in rows] == [
+        ('deleted', '5', ''), ('prescription', '1', 'Dolo'), ('prescription', '1', 'Azee'), ('prescription', '2', '')]
+    assert rows[1]['updated_at'] == '2026-02-01T00:00:00'
+
+
+def test_chunks_are_bounded_and_lossless(monkeypatch):
+    monkeypatch.setattr(app, 'EXPORT_CHUNK_BYTES', 100)
+    lines = [f"line {n:04d} {'x' * 30}\n" for n in range(50)]
+    chunks = list(app.export_chunks(iter(lines), compress=False))
+    assert b''.join(chunks).decode() == ''.join(lines)
+    assert len(chunks) > 1
+    assert all(len(chunk) < 100 + 40 for chunk in chunks)
+
+
+def test_gzip_chunks_form_one_stream(monkeypatch):
+    monkeypatch.setattr(app, 'EXPORT_CHUNK_BYTES', 100)
+    lines = [f"record {n}\n" for n in range(500)]
+    data = b''.join(app.export_chunks(iter(lines), compress=True))
+    assert gzip.decompress(data).decode() == ''.join(lines)
+
+
+def test_empty_export_yields_nothing_uncompressed_and_valid_gzip_compressed():
+    assert list(app.export_chunks(iter([]), compress=False)) == []
+    assert gzip.decompress(b''.join(app.export_chunks(iter([]), compress=True))) == b''
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cursor_obj = cursor
+
+    def cursor(self, dictionary=False):
+        return self.cursor_obj
+
+    def consume_results(self):
+        pass
+
+
+@pytest.fixture
+def export_client(monkeypatch):
+    cursor = FakeCursor(join_rows([{'id': 1, 'medicines': ['Dolo']}]))
+    monkeypatch.setattr(app.db_pool, 'acquire', lambda: FakeConnection(cursor))
+    monkeypatch.setattr(app.db_pool, 'release', lambda conn: None)
+    monkeypatch.setattr(app, 'ensure_upload_workers', lambda: None)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    client.cursor = cursor
+    return client
+
+
+@pytest.mark.parametrize('accept_encoding, compressed', [
+    ('gzip', True),
+    ('gzip, deflate, br', True),
+    ('gzip;q=0.5, identity', True),
+    ('*', True),
+    ('gzip;q=0', False),
+    ('*;q=1, gzip;q=0', False),
+    ('identity', False),
+    ('', False),
+])
+def test_gzip_follows_accept_encoding_q_values(export_client, accept_encoding, compressed):
+    response = export_client.get('/api/export', headers={'Accept-Encoding': accept_encoding})
+    response.close()
+    assert (response.headers.get('Content-Encoding') == 'gzip') == compressed
+    assert 'Accept-Encoding' in response.headers.get('Vary', '')
+    body = gzip.decompress(response.data) if compressed else response.data
+    assert json.loads(body)['prescription_id'] == 1
+
+
+def test_next_since_overlaps_the_export(export_client):
+    response = export_client.get('/api/export?since=2026-02-01T00:00:00')
+    response.close()
+    assert response.headers['X-Export-Next-Since'] == '2026-03-01T11:59:00'
+    export_sql = export_client.cursor.queries[-1][0]
+    assert 'p.updated_at >= %s' in export_sql
+
+
+def test_export_flushes_buffered_audit_rows_in_batched_mode(export_client, monkeypatch):
+    calls = []
+    monkeypatch.setattr(app, 'PRESCRIPTION_LOG_MODE', 'batched')
+    monkeypatch.setattr(app.audit_writer, 'flush', lambda timeout: calls.append(timeout) or True)
+    export_client.get('/api/export?since=2026-02-01T00:00:00').close()
+    assert calls == [app.EXPORT_AUDIT_FLUSH_TIMEOUT]
+
+
+def test_audit_writer_flush_waits_for_queued_rows(monkeypatch):
+    written = []
+    release = threading.Event()
+    writer = app.AuditWriter(queue_size=100, flush_rows=10, flush_interval=0.05, enqueue_timeout=0.1)
+
+    def slow_write(batch):
+        release.wait(1)
+        written.extend(batch)
+    monkeypatch.setattr(writer, '_write', slow_write)
+    writer.write('prescription_log', (1, 2, 'DELETED', datetime(2026, 1, 1)))
+    assert writer.flush(timeout=0.05) is False
+    release.set()
+    assert writer.flush(timeout=2) is True
+    assert written == [('prescription_log', (1, 2, 'DELETED', datetime(2026, 1, 1)))]
+    writer.close(timeout=1)
+
+
+def test_audit_writer_flush_without_rows_returns_at_once():
+    writer = app.AuditWriter(queue_size=10, flush_rows=10, flush_interval=0.05, enqueue_timeout=0.1)
+    assert writer.flush(timeout=0) is True
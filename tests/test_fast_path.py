@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    """Fill the in-memory medicine catalog so no database is needed"""
+    def load(*names):
+        by_first_token, by_key, trigrams = {}, {}, {}
+        for medicine_id, name in enumerate(names, start=1):
+            app.MedicineCatalog._add(by_first_token, by_key, trigrams, medicine_id, name)
+        monkeypatch.setattr(app.medicine_catalog, 'by_first_token', by_first_token)
+        monkeypatch.setattr(app.medicine_catalog, 'by_key', by_key)
+        monkeypatch.setattr(app.medicine_catalog, 'trigrams', trigrams)
+        monkeypatch.setattr(app.medicine_catalog, 'loaded_at', time.monotonic())
+    return load
+
+
+PRESCRIPTION = """Dr. Anil Sharma
+Date: 12/05/2024
+Tab. Paracetamol 500 mg
+1-0-1 for 5 days
+Cap. Amoxicillin 250 mg
+TID x 7 days
+Syp Ambroxol 10 ml
+twice daily
+Tab. Pantoprazole 40 mg
+once daily before food
+"""
+
+
+def test_agreeing_engines_take_the_fast_path(catalog):
+    catalog('Paracetamol', 'Amoxicillin', 'Ambroxol', 'Pantoprazole')
+    parsed, confidence = app.fast_path_parse([PRESCRIPTION, PRESCRIPTION, PRESCRIPTION])
+    assert confidence == pytest.approx(1.0)
+    assert [med['name'] for med in parsed['medicines']] == ['Paracetamol', 'Amoxicillin', 'Ambroxol', 'Pantoprazole']
+    paracetamol = parsed['medicines'][0]
+    assert (paracetamol['dosage'], paracetamol['frequency'], paracetamol['duration']) == ('500mg', 'BID', '5 days')
+    assert parsed['doctor_name'] == 'Dr. Anil Sharma'
+    assert parsed['date'] == '12/05/2024'
+
+
+def test_unknown_medicines_fall_back_to_llm(catalog):
+    # Only one of four medicines is in the catalog; the other three must not be silently dropped
+    catalog('Paracetamol')
+    parsed, confidence = app.fast_path_parse([PRESCRIPTION, PRESCRIPTION, PRESCRIPTION])
+    assert parsed is None
+    assert confidence == 0.0
+
+
+def test_parse_reports_unmatched_rx_lines(catalog):
+    catalog('Paracetamol')
+    parse = app.parse_engine_text(PRESCRIPTION, app.medicine_catalog.index())
+    assert parse['rx_lines'] == 8
+    assert parse['unmatched_rx_lines'] == ['Cap. Amoxicillin 250 mg', 'TID x 7 days', 'Syp Ambroxol 10 ml',
+                                           'twice daily', 'Tab. Pantoprazole 40 mg', 'once daily before food']
+    assert app.parse_coverage([parse]) == pytest.approx(2 / 8)
+
+
+def test_strength_below_a_medicine_is_a_new_entry(catalog):
+    catalog('Paracetamol')
+    parse = app.parse_engine_text("Paracetamol\nAmoxicillin 250mg TID", app.medicine_catalog.index())
+    assert parse['unmatched_rx_lines'] == ['Amoxicillin 250mg TID']
+
+
+def test_disagreeing_engines_lower_confidence(catalog):
+    catalog('Paracetamol', 'Cetirizine')
+    first = "Paracetamol 500mg BID\nCetirizine 10mg HS"
+    second = "Paracetamol 650mg BID\nCetirizine 5mg HS"
+    parsed, confidence = app.fast_path_parse([first, second, ''])
+    assert parsed is not None
+    assert confidence < app.FAST_PATH_MIN_CONFIDENCE
+
+
+def test_single_clean_engine_takes_the_fast_path(catalog):
+    # The adaptive OCR policy often runs one engine; a clean read still skips the LLM
+    catalog('Paracetamol', 'Cetirizine')
+    text = "Paracetamol 500mg twice daily\nCetirizine 10mg at night"
+    parsed, confidence = app.fast_path_parse([text, '', ''])
+    assert confidence >= app.FAST_PATH_SINGLE_ENGINE_MIN_CONFIDENCE
+    assert [(med['name'], med['dosage']) for med in parsed['medicines']] == [('Paracetamol', '500mg'),
+                                                                           ('Cetirizine', '10mg')]
+
+
+def test_single_engine_without_dosages_falls_back_to_llm(catalog):
+    catalog('Paracetamol', 'Cetirizine')
+    parsed, confidence = app.fast_path_parse(["Paracetamol twice daily\nCetirizine at night", '', ''])
+    assert parsed is None
+
+
+def test_single_noisy_engine_falls_back_to_llm(catalog):
+    catalog('Paracetamol')
+    parsed, confidence = app.fast_path_parse(["Paracetamol 500mg rn@l1 x#q ~~ 0O|l :: BID", '', ''])
+    assert parsed is None
+
+
+def test_fuse_prescription_uses_llm_when_fast_path_declines(catalog, monkeypatch):
+    catalog('Paracetamol')
+    llm_result = {'doctor_name': '', 'date': '', 'medicines': [{'name': 'Amoxicillin'}]}
+    monkeypatch.setattr(app, 'parse_prescription_with_groq_fusion', lambda *texts: llm_result)
+    parsed, method = app.fuse_prescription(PRESCRIPTION, PRESCRIPTION, PRESCRIPTION)
+    assert method == 'llm'
+    assert parsed is llm_result
@@ -0,0 +1,124 @@
+import pytest
+import requests
+
+import app
+
+
+class FakeResponse:
+    def __init__(self, status_code, content='{}'):
+        self.status_code = status_code
+        self.headers = {}
+        self.content = content
+
+    def json(self):
+        return {'choices': [{'message': {'content': self.content}}]}
+
+
+class FakeSession:
+    """Stands in for requests.Session; each post() returns or raises the next scripted outcome"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        outcome = self.outcomes.pop(0) if self.outcomes else FakeResponse(200)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def make_client(outcomes, **options):
+    options.setdefault('max_retries', 0)
+    options.setdefault('breaker_threshold', 2)
+    options.setdefault('breaker_cooldown', 30)
+    client = app.GroqClient('http://groq.invalid', 'key', 'model', **options)
+    client.session = FakeSession(outcomes)
+    return client
+
+
+def test_success_returns_message_content():
+    client = make_client([FakeResponse(200, '{"medicines": []}')])
+    assert client.complete('prompt') == '{"medicines": []}'
+    assert client.stats()['calls']['ok'] == 1
+
+
+def test_retries_retryable_status_then_succeeds(monkeypatch):
+    monkeypatch.setattr(app.time, 'sleep', lambda seconds: None)
+    client = make_client([FakeResponse(503), FakeResponse(200, 'ok')], max_retries=2)
+    assert client.complete('prompt') == 'ok'
+    assert client.stats()['calls']['retries'] == 1
+
+
+def test_non_retryable_status_fails_without_retry():
+    client = make_client([FakeResponse(400)], max_retries=3)
+    with pytest.raises(app.FusionError):
+        client.complete('prompt')
+    assert client.session.posts == 1
+
+
+def test_breaker_opens_after_threshold_and_rejects():
+    client = make_client([requests.ConnectionError('down')] * 2)
+    for _ in range(2):
+        with pytest.raises(app.FusionError):
+            client.complete('prompt')
+    assert client.stats()['circuit'] == 'open'
+    with pytest.raises(app.FusionError, match='circuit breaker'):
+        client.complete('prompt')
+    assert client.session.posts == 2
+    assert client.stats()['calls']['rejected'] == 1
+
+
+def test_half_open_trial_success_closes_breaker(monkeypatch):
+    client = make_client([requests.ConnectionError('down')] * 2 + [FakeResponse(200, 'ok')])
+    for _ in range(2):
+        with pytest.raises(app.FusionError):
+            client.complete('prompt')
+    client.opened_at -= client.breaker_cooldown
+    assert client.complete('prompt') == 'ok'
+    assert client.stats()['circuit'] == 'closed'
+    assert client.trial_in_progress is False
+
+
+def test_unexpected_exception_in_trial_releases_half_open_slot():
+    client = make_client([requests.ConnectionError('down')] * 2 + [RuntimeError('boom'), FakeResponse(200, 'ok')])
+    for _ in range(2):
+        with pytest.raises(app.FusionError):
+            client.complete('prompt')
+    client.opened_at -= client.breaker_cooldown
+    with pytest.raises(RuntimeError):
+        client.complete('prompt')
+    assert client.trial_in_progress is False
+    # The failed trial re-opened the breaker; once the cooldown passes another trial is allowed
+    client.opened_at -= client.breaker_cooldown
+    assert client.complete('prompt') == 'ok'
+
+
+def test_fusion_error_propagates_from_llm_parse(monkeypatch):
+    def unavailable(prompt):
+        raise app.FusionError('Groq circuit breaker is open')
+    monkeypatch.setattr(app.groq_client, 'complete', unavailable)
+    with pytest.raises(app.FusionError):
+        app.parse_prescription_with_groq_fusion('a', 'b', 'c')
+
+
+def test_non_json_llm_answer_raises_fusion_error(monkeypatch):
+    monkeypatch.setattr(app.groq_client, 'complete', lambda prompt: 'Sorry, I cannot read this.')
+    with pytest.raises(app.FusionError):
+        app.parse_prescription_with_groq_fusion('a', 'b', 'c')
+
+
+def test_backoff_sleep_does_not_hold_a_concurrency_slot(monkeypatch):
+    client = make_client([FakeResponse(503), FakeResponse(200, 'ok')], max_retries=1, max_concurrency=1)
+    free_during_backoff = []
+
+    def sleep(seconds):
+        # Another caller must be able to take the only slot while this one waits to retry
+        acquired = client.slots.acquire(blocking=False)
+        free_during_backoff.append(acquired)
+        if acquired:
+            client.slots.release()
+    monkeypatch.setattr(app.time, 'sleep', sleep)
+    assert client.complete('prompt') == 'ok'
+    assert free_during_backoff == [True]
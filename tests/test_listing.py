@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import pytest
+
+import app
+
+
+class KeysetCursor:
+    """Evaluates list_prescriptions' keyset query over in-memory rows"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.result = []
+
+    def execute(self, sql, params):
+        user_id, *keyset, limit = params
+        rows = [row for row in self.rows if row['user_id'] == user_id]
+        if keyset:
+            created_at, _, prescription_id = keyset
+            rows = [row for row in rows if (row['created_at'], row['prescription_id']) < (created_at, prescription_id)]
+        rows.sort(key=lambda row: (row['created_at'], row['prescription_id']), reverse=True)
+        self.result = rows[:limit]
+
+    def fetchall(self):
+        return self.result
+
+
+def make_row(prescription_id, created_at, user_id=1):
+    return {'prescription_id': prescription_id, 'user_id': user_id, 'created_at': created_at,
+            'issue': '', 'doctor_name': '', 'prescription_date': None, 'file_path': '', 'medicine_count': 0}
+
+
+def test_cursor_round_trip():
+    row = make_row(42, datetime(2026, 3, 4, 5, 6, 7))
+    assert app.decode_listing_cursor(app.encode_listing_cursor(row)) == (datetime(2026, 3, 4, 5, 6, 7), 42)
+
+
+@pytest.mark.parametrize('value', ['', 'garbage', '2026-03-04T05:06:07', '2026-03-04T05:06:07_x', 'yesterday_4'])
+def test_malformed_cursor_raises_value_error(value):
+    with pytest.raises(ValueError):
+        app.decode_listing_cursor(value)
+
+
+def test_pages_cover_every_row_once_across_timestamp_ties():
+    same_second = datetime(2026, 1, 2, 10, 0, 0)
+    rows = [make_row(n, same_second) for n in range(1, 6)]
+    rows += [make_row(n, datetime(2026, 1, 1, 10, 0, n)) for n in range(6, 9)]
+    rows += [make_row(99, same_second, user_id=2)]
+    cursor = KeysetCursor(rows)
+    seen, before = [], None
+    while True:
+        page, next_cursor = app.list_prescriptions(cursor, 1, before, limit=2)
+        seen += [row['prescription_id'] for row in page]
+        if next_cursor is None:
+            break
+        before = app.decode_listing_cursor(next_cursor)
+    assert seen == [5, 4, 3, 2, 1, 8, 7, 6]
+
+
+def test_last_full_page_has_no_next_cursor():
+    cursor = KeysetCursor([make_row(n, datetime(2026, 1, n)) for n in range(1, 5)])
+    page, next_cursor = app.list_prescriptions(cursor, 1, limit=4)
+    assert len(page) == 4
+    assert next_cursor is None
+
+
+def test_api_rejects_bad_cursor():
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    response = client.get('/api/prescriptions?before=not-a-cursor')
+    assert response.status_code == 400
+    response = client.get('/api/prescriptions?limit=ten')
+    assert response.status_code == 400
@@ -0,0 +1,77 @@
+import pytest
+
+import app
+
+
+class FakeCursor:
+    """A dictionary cursor over an in-memory medicine table"""
+
+    def __init__(self, medicines):
+        self.medicines = list(medicines)
+        self.result = []
+        self.inserted = []
+
+    def execute(self, sql, params=()):
+        if sql.startswith('SELECT medicine_id, medicine_name, verified FROM medicine WHERE'):
+            wanted = {name.casefold() for name in params}
+            rows = [row for row in self.medicines if row[1].casefold() in wanted]
+        else:
+            rows = self.medicines
+        self.result = [{'medicine_id': medicine_id, 'medicine_name': name, 'verified': verified}
+                       for medicine_id, name, verified in rows]
+
+    def executemany(self, sql, rows):
+        for (name,) in rows:
+            if all(existing.casefold() != name.casefold() for medicine_id, existing, verified in self.medicines):
+                self.medicines.append((len(self.medicines) + 1, name, 0))
+                self.inserted.append(name)
+
+    def fetchall(self):
+        return self.result
+
+
+@pytest.fixture
+def catalog(monkeypatch):
+    catalog = app.MedicineCatalog(reload_interval=300, min_similarity=app.MEDICINE_MATCH_MIN_SIMILARITY)
+
+    def no_pool():
+        raise AssertionError('reloaded on a second pooled connection')
+    monkeypatch.setattr(app.db_pool, 'connection', no_pool)
+    return catalog
+
+
+@pytest.mark.parametrize('name, plausible', [
+    ('Paracetamol', True),
+    ('Tab. Augmentin 625', True),
+    ('B-Complex', True),
+    ('Unknown', False),
+    ('rn@l1', False),
+    ('xqzt', False),
+    ('Take one tablet after food twice daily', False),
+])
+def test_plausible_medicine_name(name, plausible):
+    assert app.plausible_medicine_name(name) is plausible
+
+
+def test_resolve_reloads_on_the_callers_cursor(catalog):
+    cur = FakeCursor([(1, 'Paracetamol', 1)])
+    assert catalog.resolve(cur, ['Paracetmol']) == {'Paracetmol': 1}
+
+
+def test_resolve_adds_plausible_names_unverified_and_skips_garbage(catalog):
+    cur = FakeCursor([(1, 'Paracetamol', 1)])
+    resolved = catalog.resolve(cur, ['Tab. Montair LC', 'Unknown', 'rn@l1'])
+    assert cur.inserted == ['Montair LC']
+    assert set(resolved) == {'Tab. Montair LC'}
+    assert catalog.stats()['matches']['rejected'] == 2
+    # Later spellings normalize onto the new row, but the fast-path parser does not trust it
+    assert catalog.match('Montair-LC')[0] == resolved['Tab. Montair LC']
+    assert 'montair' not in catalog.index(cur)
+    assert 'paracetamol' in catalog.index(cur)
+
+
+def test_unverified_names_are_not_fast_path_matches(catalog):
+    cur = FakeCursor([(1, 'Paracetamol', 1), (2, 'Montair LC', 0)])
+    parse = app.parse_engine_text("Paracetamol 500mg BID\nMontair LC 10mg HS", catalog.index(cur))
+    assert list(parse['medicines']) == ['Paracetamol']
+    assert parse['unmatched_rx_lines'] == ['Montair LC 10mg HS']
@@ -0,0 +1,84 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+
+def test_registry_renders_prometheus_text():
+    registry = app.MetricsRegistry()
+    requests_total = registry.counter('demo_requests_total', 'Requests', ('route',))
+    latency = registry.histogram('demo_seconds', 'Latency', ('kind',), buckets=(0.1, 1))
+    registry.register_stats('demo_pool', 'Pool statistics', lambda: {
+        'in_use': 2, 'healthy': True, 'calls': {'ok': 5, 'error': 1}, 'name': 'primary'})
+
+    def broken():
+        raise RuntimeError('collector down')
+    registry.register_stats('demo_broken', 'Never rendered', broken)
+    requests_total.inc(route='dashboard')
+    requests_total.inc(route='dashboard')
+    latency.observe(0.05, kind='sql')
+    latency.observe(0.5, kind='sql')
+    text = registry.render()
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert '# TYPE demo_requests_total counter' in lines
+    assert 'demo_requests_total{route="dashboard"} 2' in lines
+    assert '# TYPE demo_seconds histogram' in lines
+    assert 'demo_seconds_bucket{kind="sql",le="0.1"} 1' in lines
+    assert 'demo_seconds_bucket{kind="sql",le="1.0"} 2' in lines
+    assert 'demo_seconds_bucket{kind="sql",le="+Inf"} 2' in lines
+    assert 'demo_seconds_count{kind="sql"} 2' in lines
+    assert '# TYPE demo_pool_in_use gauge' in lines
+    assert 'demo_pool_healthy 1' in lines
+    assert 'demo_pool_calls{key="error"} 1' in lines
+    # Strings are not samples, and a failing collector does not break the scrape
+    assert not any(line.startswith(('demo_pool_name', 'demo_broken')) for line in lines)
+
+
+def test_label_values_are_escaped():
+    assert app.prometheus_labels({'route': 'a"b\\c\nd'}) == '{route="a\\"b\\\\c\\nd"}'
+
+
+def test_request_records_a_route_span_and_counter():
+    client = app.app.test_client()
+    assert client.get('/logout').status_code == 302
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    count = re.search(r'^medivault_span_duration_seconds_count\{kind="route",name="logout"\} (\d+)$', body, re.M)
+    assert count and int(count.group(1)) >= 1
+    assert re.search(r'^medivault_http_requests_total\{route="logout",method="GET",status="302"\} \d+$', body, re.M)
+
+
+def test_spans_nest_under_the_current_span():
+    with app.span('upload', kind='job') as root:
+        with app.span('tesseract', kind='ocr', attempt=0):
+            pass
+
+        def query():
+            with app.span('SELECT prescription', kind='sql'):
+                pass
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(app.with_current_span(query)).result()
+    assert [node.name for node in root.children] == ['tesseract', 'SELECT prescription']
+    tree = root.tree()
+    assert tree['children'][0]['attrs'] == {'attempt': 0}
+    assert tree['ms'] is not None
+
+
+def test_sql_span_name_is_low_cardinality():
+    assert app.sql_span_name("SELECT * FROM prescription WHERE user_id = %s") == 'SELECT prescription'
+    assert app.sql_span_name("INSERT INTO `ai_query_log` (user_id) VALUES (%s)") == 'INSERT ai_query_log'
+    assert app.sql_span_name("COMMIT") == 'COMMIT'
+
+
+def test_slow_root_span_logs_its_tree(monkeypatch):
+    warnings = []
+    monkeypatch.setattr(app, 'SLOW_REQUEST_MS', 1)
+    monkeypatch.setattr(app.log, 'warning', lambda event, **fields: warnings.append((event, fields)))
+    root = app.Span('analytics', 'route')
+    root.started -= 1
+    root.finish()
+    assert warnings[0][0] == 'slow_trace'
+    assert warnings[0][1]['tree']['name'] == 'analytics'
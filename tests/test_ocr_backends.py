@@ -0,0 +1,66 @@
+import subprocess
+import sys
+import threading
+
+import app
+
+
+def test_loader_runs_once_across_threads(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_ENABLED_ENGINES', ['stub'])
+    calls = []
+    entered = threading.Event()
+    finish = threading.Event()
+
+    def loader():
+        calls.append(threading.get_ident())
+        entered.set()
+        finish.wait(1)
+        return 'client'
+    backend = app.OCRBackend('stub', 'Stub OCR', loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(backend.get())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    entered.wait(1)
+    finish.set()
+    for thread in threads:
+        thread.join(1)
+    assert results == ['client'] * 4
+    assert len(calls) == 1
+    assert backend.status()['available'] is True
+
+
+def test_disabled_engine_is_never_loaded(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_ENABLED_ENGINES', ['tesseract'])
+
+    def loader():
+        raise AssertionError('disabled engine was loaded')
+    backend = app.OCRBackend('easyocr', 'EasyOCR', loader)
+    assert backend.get() is None
+    assert backend.status() == {'enabled': False, 'loaded': False, 'available': False,
+                                'load_seconds': None, 'error': None}
+
+
+def test_failed_load_is_recorded_and_not_retried(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_ENABLED_ENGINES', ['stub'])
+    calls = []
+
+    def loader():
+        calls.append(1)
+        raise ImportError('No module named easyocr')
+    backend = app.OCRBackend('stub', 'Stub OCR', loader)
+    assert backend.get() is None
+    assert backend.get() is None
+    assert len(calls) == 1
+    status = backend.status()
+    assert status['loaded'] is True and status['available'] is False
+    assert status['error'] == 'No module named easyocr'
+
+
+def test_importing_app_loads_no_ocr_engine():
+    script = ("import sys, app; "
+              "print(sorted(name for name in ('easyocr', 'torch', 'google.cloud.vision') if name in sys.modules)); "
+              "print([name for name, backend in app.ocr_backends.items() if backend.loaded])")
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=app.os.path.dirname(app.__file__)).stdout
+    assert output.strip().splitlines()[-2:] == ['[]', '[]']
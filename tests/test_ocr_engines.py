@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+import app
+
+# Abandoned engines keep running on the executor; the fixture lets them finish before the test ends
+release = threading.Event()
+
+
+def engine(name, seconds=0.0, text='', error=None):
+    def run(ocr_image):
+        release.wait(seconds)
+        if error is not None:
+            raise error
+        return text
+    run.__name__ = f"ocr_with_{name}"
+    return (name, name, run)
+
+
+@pytest.fixture
+def deadlines(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_EXECUTION_MODE', 'parallel')
+    monkeypatch.setattr(app, 'OCR_ENGINE_TIMEOUTS', {'fast': 1.0, 'slow': 0.2, 'broken': 1.0})
+    release.clear()
+    yield
+    release.set()
+    time.sleep(0.05)
+
+
+def test_parallel_engines_share_one_start_time(deadlines):
+    texts, timings = {}, {}
+    started = time.monotonic()
+    app.run_ocr_engines([engine('fast', 0.15, 'Dolo 650'), engine('slow', 0.15, 'Dolo 650')], None, texts, timings)
+    # Run side by side, not one after the other
+    assert time.monotonic() - started < 0.28
+    assert texts == {'fast': 'Dolo 650', 'slow': 'Dolo 650'}
+    assert {name: timing['status'] for name, timing in timings.items()} == {'fast': 'ok', 'slow': 'ok'}
+
+
+def test_engine_past_its_deadline_is_abandoned(deadlines):
+    texts, timings = {}, {}
+    started = time.monotonic()
+    app.run_ocr_engines([engine('fast', 0.0, 'Azee 500'), engine('slow', 1.0, 'late')], None, texts, timings)
+    elapsed = time.monotonic() - started
+    assert elapsed < 0.6
+    assert texts == {'fast': 'Azee 500', 'slow': ''}
+    assert timings['slow']['status'] == 'timeout'
+    assert timings['fast']['status'] == 'ok'
+
+
+def test_deadline_counts_from_the_shared_start(deadlines):
+    # 'slow' was already running while 'fast' was awaited, so it gets no fresh 0.2s of its own
+    texts, timings = {}, {}
+    started = time.monotonic()
+    app.run_ocr_engines([engine('fast', 0.3, 'x'), engine('slow', 1.0, 'late')], None, texts, timings)
+    assert time.monotonic() - started < 0.45
+    assert timings['slow']['status'] == 'timeout'
+
+
+def test_engine_errors_are_reported_not_raised(deadlines):
+    texts, timings = {}, {}
+    app.run_ocr_engines([engine('broken', error=RuntimeError('no tessdata')), engine('fast', text='ok')],
+                        None, texts, timings)
+    assert texts['broken'] == ''
+    assert timings['broken']['status'] == 'error'
+    assert timings['fast']['status'] == 'ok'
+
+
+def test_sequential_mode_runs_every_engine_without_deadlines(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_EXECUTION_MODE', 'sequential')
+    monkeypatch.setattr(app, 'OCR_ENGINE_TIMEOUTS', {'slow': 0.01})
+    texts, timings = {}, {}
+    app.run_ocr_engines([engine('slow', 0.05, 'late but kept')], None, texts, timings)
+    assert texts == {'slow': 'late but kept'}
+    assert timings['slow']['status'] == 'ok'
+
+
+def test_sequential_mode_runs_engines_in_order(monkeypatch):
+    monkeypatch.setattr(app, 'OCR_EXECUTION_MODE', 'sequential')
+    release.set()
+    texts, timings = {}, {}
+    app.run_ocr_engines([engine('fast', 0.0, 'a'), engine('broken', 0.0, error=RuntimeError('no binary'))],
+                        None, texts, timings)
+    assert texts == {'fast': 'a', 'broken': ''}
+    assert {name: timing['status'] for name, timing in timings.items()} == {'fast': 'ok', 'broken': 'error'}
+
+
+def test_execution_mode_comes_from_the_environment():
+    import subprocess
+    import sys
+    script = "import app; print(app.OCR_EXECUTION_MODE)"
+    output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True,
+                            cwd=app.os.path.dirname(app.__file__),
+                            env={**app.os.environ, 'MEDIVAULT_OCR_EXECUTION': 'sequential'}).stdout
+    assert output.strip().splitlines()[-1] == 'sequential'
+
+
+def test_engine_at_its_in_flight_cap_is_shed(deadlines, monkeypatch):
+    monkeypatch.setattr(app, 'ocr_engine_slots', app.OCREngineSlots({'slow': 1}, 2))
+    texts, timings = {}, {}
+    app.run_ocr_engines([engine('fast', 0.0, 'a'), engine('slow', 5.0, 'late')], None, texts, timings)
+    assert timings['slow']['status'] == 'timeout'
+    # The abandoned call still holds slow's only slot; the next upload does not wait on it
+    started = time.monotonic()
+    app.run_ocr_engines([engine('fast', 0.0, 'b'), engine('slow', 5.0, 'late')], None, texts, timings)
+    assert time.monotonic() - started < 0.1
+    assert texts == {'fast': 'b', 'slow': ''}
+    assert timings['slow'] == {'seconds': 0.0, 'status': 'shed'}
+    assert app.ocr_engine_slots.stats() == {'in_flight': {'fast': 0, 'slow': 1}, 'shed': {'slow': 1}}
+
+
+def test_slot_is_returned_when_the_abandoned_call_finishes(deadlines, monkeypatch):
+    slots = app.OCREngineSlots({'slow': 1}, 2)
+    monkeypatch.setattr(app, 'ocr_engine_slots', slots)
+    app.run_ocr_engines([engine('slow', 5.0, 'late')], None, {}, {})
+    release.set()
+    deadline = time.monotonic() + 1
+    while slots.stats()['in_flight']['slow'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.clear()
+    texts, timings = {}, {}
+    app.run_ocr_engines([engine('slow', 0.0, 'on time')], None, texts, timings)
+    assert (texts['slow'], timings['slow']['status']) == ('on time', 'ok')
@@ -0,0 +1,125 @@
+import pytest
+
+import app
+
+ENGINES = ['tesseract', 'easyocr', 'google_vision']
+
+
+def make_policy(min_samples=2, explore_rate=0.0):
+    policy = app.OCRPolicy(min_samples, min_agreement=0.85, explore_rate=explore_rate, smoothing=0.5,
+                           history_rows=100)
+    # Skip the ocr_engine_run history query
+    policy.loaded = True
+    return policy
+
+
+def scores(overall, medicine=None, dosage=None, doctor=None):
+    return {'overall': overall, 'medicine': medicine, 'dosage': dosage, 'doctor': doctor}
+
+
+def train(policy, engine, seconds, agreement, runs=2, image_class='printed', **fields):
+    for _ in range(runs):
+        policy.record(engine, image_class, seconds, 'ok', scores(agreement, **fields))
+
+
+@pytest.fixture(autouse=True)
+def no_exploration(monkeypatch):
+    monkeypatch.setattr(app.random, 'random', lambda: 0.5)
+
+
+def test_runs_every_engine_while_learning():
+    policy = make_policy()
+    train(policy, 'tesseract', 0.5, 0.95)
+    train(policy, 'easyocr', 2.0, 0.95, runs=1)
+    assert policy.first_engine('printed', ['tesseract', 'easyocr']) is None
+    assert policy.decisions['all_learning'] == 1
+
+
+def test_picks_the_fastest_engine_that_agrees_enough():
+    policy = make_policy()
+    train(policy, 'tesseract', 0.5, 0.6)
+    train(policy, 'easyocr', 2.0, 0.95)
+    train(policy, 'google_vision', 1.0, 0.9)
+    assert policy.first_engine('printed', ENGINES) == 'google_vision'
+    # Statistics are per image class
+    assert policy.first_engine('handwritten', ENGINES) is None
+
+
+def test_all_engines_required_when_none_agrees_enough():
+    policy = make_policy()
+    train(policy, 'tesseract', 0.5, 0.6)
+    train(policy, 'easyocr', 2.0, 0.7)
+    assert policy.first_engine('printed', ['tesseract', 'easyocr']) is None
+    assert policy.decisions['all_required'] == 1
+
+
+def test_explores_at_the_configured_rate(monkeypatch):
+    policy = make_policy(explore_rate=0.1)
+    train(policy, 'tesseract', 0.5, 0.95)
+    monkeypatch.setattr(app.random, 'random', lambda: 0.05)
+    assert policy.first_engine('printed', ['tesseract']) is None
+    monkeypatch.setattr(app.random, 'random', lambda: 0.5)
+    assert policy.first_engine('printed', ['tesseract']) == 'tesseract'
+    assert policy.decisions['explore'] == 1
+
+
+def test_failures_do_not_move_latency_or_agreement():
+    policy = make_policy()
+    train(policy, 'tesseract', 1.0, 0.9, runs=1)
+    policy.record('tesseract', 'printed', 30.0, 'timeout', None)
+    # Unscored runs (a single engine ran) count towards latency only
+    policy.record('tesseract', 'printed', 3.0, 'ok', None)
+    entry = policy.stats()['engines']['tesseract']['printed']
+    assert (entry['runs'], entry['failures'], entry['scored']) == (2, 1, 1)
+    assert entry['seconds'] == 2.0
+    assert entry['agreement']['overall'] == 0.9
+
+
+def test_field_engine_uses_defaults_until_every_engine_is_trained():
+    policy = make_policy()
+    train(policy, 'tesseract', 0.5, 0.9, doctor=0.9)
+    assert policy.field_engine('doctor', ['tesseract', 'google_vision']) == app.OCR_DEFAULT_FIELD_ENGINES['doctor']
+    train(policy, 'google_vision', 1.0, 0.8, doctor=0.5, image_class='handwritten')
+    assert policy.field_engine('doctor', ['tesseract', 'google_vision']) == 'tesseract'
+
+
+@pytest.fixture
+def trained_pipeline(monkeypatch):
+    """extract_text_triple_ocr with fake engines and a policy that trusts tesseract alone"""
+    ran = []
+
+    def fake_engine(name):
+        def run(ocr_image):
+            ran.append(name)
+            return f"{name} text"
+        return (name, name, run)
+
+    policy = make_policy()
+    train(policy, 'tesseract', 0.5, 0.95)
+    train(policy, 'easyocr', 2.0, 0.8)
+    train(policy, 'google_vision', 1.0, 0.8)
+    monkeypatch.setattr(app, 'ocr_policy', policy)
+    monkeypatch.setattr(app, 'OCR_POLICY', 'adaptive')
+    monkeypatch.setattr(app, 'OCR_ENABLED_ENGINES', set(ENGINES))
+    monkeypatch.setattr(app, 'OCR_ENGINES', [fake_engine(name) for name in ENGINES])
+    monkeypatch.setattr(app, 'preprocess_for_ocr', lambda path: (None, {'before_pixels': 1, 'after_pixels': 1}))
+    monkeypatch.setattr(app, 'classify_image', lambda ocr_image: 'printed')
+    return ran
+
+
+def test_confident_first_engine_skips_the_rest(trained_pipeline, monkeypatch):
+    monkeypatch.setattr(app, 'ocr_text_confidence', lambda text: 0.9)
+    *texts, timings = app.extract_text_triple_ocr('rx.png')
+    assert trained_pipeline == ['tesseract']
+    assert texts == ['tesseract text', '', '']
+    assert timings['easyocr']['status'] == timings['google_vision']['status'] == 'skipped'
+    assert timings['policy']['escalated'] is False
+
+
+def test_unconfident_first_engine_escalates(trained_pipeline, monkeypatch):
+    monkeypatch.setattr(app, 'ocr_text_confidence', lambda text: app.OCR_POLICY_ESCALATE_CONFIDENCE / 2)
+    *texts, timings = app.extract_text_triple_ocr('rx.png')
+    assert sorted(trained_pipeline) == sorted(ENGINES)
+    assert texts == [f"{name} text" for name in ENGINES]
+    assert timings['policy']['escalated'] is True
+    assert app.ocr_policy.decisions['escalated'] == 1
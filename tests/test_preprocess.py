@@ -0,0 +1,80 @@
+import pytest
+from PIL import Image, ImageDraw
+
+import app
+
+
+def text_page(width=600, height=400, tilt=0.0):
+    """White page with dark bars standing in for lines of text, rotated counter-clockwise by tilt degrees"""
+    page = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for top in range(60, height - 60, 30):
+        draw.rectangle((80, top, width - 80, top + 10), fill=0)
+    return page.rotate(tilt, resample=Image.BICUBIC, fillcolor=255) if tilt else page
+
+
+def save(image, tmp_path, name='page.png'):
+    path = tmp_path / name
+    image.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('tilt', [-3.0, 2.0, 4.5])
+def test_skew_angle_undoes_the_tilt(tilt):
+    assert app.estimate_skew_angle(text_page(tilt=tilt)) == pytest.approx(-tilt, abs=app.PREPROCESS_SKEW_STEP)
+
+
+@pytest.mark.parametrize('page', [
+    text_page(),
+    Image.new('L', (100, 100), 255),
+    Image.new('L', (100, 100), 128),
+    Image.new('L', (100, 100), 0),
+])
+def test_straight_blank_and_filled_pages_are_not_rotated(page):
+    assert app.estimate_skew_angle(page) == 0.0
+
+
+def test_blank_page_keeps_its_size(tmp_path):
+    ocr_image, report = app.preprocess_for_ocr(save(Image.new('RGB', (100, 100), 'white'), tmp_path))
+    assert ocr_image.size == (100, 100)
+    assert report['before_pixels'] == report['after_pixels'] == 10000
+
+
+def test_tilted_page_is_straightened(tmp_path):
+    ocr_image, report = app.preprocess_for_ocr(save(text_page(tilt=3.0), tmp_path))
+    # Rotating with expand grows the canvas
+    assert ocr_image.size[0] > 600 and ocr_image.size[1] > 400
+    assert app.estimate_skew_angle(ocr_image.image) == 0.0
+    assert set(report['steps_ms']) == {'downscale', 'grayscale', 'deskew', 'binarize'}
+
+
+def test_large_photo_is_downscaled(tmp_path):
+    ocr_image, report = app.preprocess_for_ocr(save(Image.new('RGB', (4000, 3000), 'white'), tmp_path))
+    assert max(ocr_image.size) == app.PREPROCESS_MAX_LONG_EDGE
+    assert report['after_pixels'] < report['before_pixels'] == 12000000
+
+
+def test_disabled_steps_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'PREPROCESS_STEPS', dict.fromkeys(app.PREPROCESS_STEPS, False))
+    ocr_image, report = app.preprocess_for_ocr(save(text_page(tilt=3.0), tmp_path))
+    assert report['steps_ms'] == {}
+    assert ocr_image.modified is False
+
+
+def test_crop_keeps_a_margin_around_the_text():
+    page = Image.new('L', (400, 300), 255)
+    ImageDraw.Draw(page).rectangle((100, 80, 199, 119), fill=0)
+    cropped = app.crop_to_text(page)
+    margin = app.PREPROCESS_CROP_MARGIN
+    assert cropped.size == (100 + 2 * margin, 40 + 2 * margin)
+
+
+def test_crop_is_clamped_to_the_page():
+    page = Image.new('L', (200, 100), 255)
+    ImageDraw.Draw(page).rectangle((0, 0, 49, 9), fill=0)
+    assert app.crop_to_text(page).size == (50 + app.PREPROCESS_CROP_MARGIN, 10 + app.PREPROCESS_CROP_MARGIN)
+
+
+def test_crop_leaves_a_blank_page_alone():
+    page = Image.new('L', (200, 100), 255)
+    assert app.crop_to_text(page).size == (200, 100)
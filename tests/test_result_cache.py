@@ -0,0 +1,74 @@
+import os
+
+import app
+
+
+def entry(n):
+    return {'ocr': [f"text {n}", '', ''], 'ocr_timings': {}, 'fused': None}
+
+
+def test_key_depends_on_content_and_config(tmp_path):
+    cache = app.ResultCache(str(tmp_path), 10, 10 ** 6)
+    key = cache.key_for('a' * 64, {'version': 1})
+    assert key == cache.key_for('a' * 64, {'version': 1})
+    assert key != cache.key_for('b' * 64, {'version': 1})
+    assert key != cache.key_for('a' * 64, {'version': 2})
+
+
+def test_memory_then_disk_hits(tmp_path):
+    cache = app.ResultCache(str(tmp_path), 10, 10 ** 6)
+    cache.put('k1', entry(1))
+    assert cache.get('k1') == entry(1)
+    assert cache.get('missing') is None
+    # A new process starts with an empty memory tier and finds the entry on disk
+    restarted = app.ResultCache(str(tmp_path), 10, 10 ** 6)
+    assert restarted.disk_bytes == cache.disk_bytes
+    assert restarted.get('k1') == entry(1)
+    assert restarted.get('k1') == entry(1)
+    assert (cache.stats()['memory_hits'], cache.stats()['misses']) == (1, 1)
+    assert (restarted.stats()['disk_hits'], restarted.stats()['memory_hits']) == (1, 1)
+
+
+def test_memory_tier_is_lru_bounded(tmp_path):
+    cache = app.ResultCache(str(tmp_path), 2, 10 ** 6)
+    cache.put('k1', entry(1))
+    cache.put('k2', entry(2))
+    cache.get('k1')
+    cache.put('k3', entry(3))
+    assert list(cache.memory) == ['k1', 'k3']
+    # Still served from disk
+    assert cache.get('k2') == entry(2)
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path):
+    size = len(app.json.dumps(entry(1)).encode('utf-8'))
+    cache = app.ResultCache(str(tmp_path), 10, size * 3)
+    for n, key in enumerate(['k1', 'k2', 'k3']):
+        cache.put(key, entry(n))
+        os.utime(cache._path(key), (1000 + n, 1000 + n))
+    cache.put('k4', entry(4))
+    # Trimmed to 90% of the budget, oldest first
+    assert [os.path.exists(cache._path(key)) for key in ('k1', 'k2', 'k3', 'k4')] == [False, False, True, True]
+    assert cache.disk_bytes == size * 2
+    assert cache.stats()['evictions'] == 2
+
+
+def test_corrupt_entry_is_a_miss(tmp_path):
+    cache = app.ResultCache(str(tmp_path), 10, 10 ** 6)
+    path = cache._path('broken')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as cache_file:
+        cache_file.write('{not json')
+    assert cache.get('broken') is None
+    assert cache.stats()['misses'] == 1
+
+
+def test_cache_config_does_not_load_engines(monkeypatch):
+    def loader():
+        raise AssertionError('engine loaded to build a cache key')
+    for backend in app.ocr_backends.values():
+        monkeypatch.setattr(backend, 'loader', loader)
+        monkeypatch.setattr(backend, 'loaded', False)
+    config = app.ocr_cache_config()
+    assert sorted(config['engines']) == sorted(name for name in app.OCR_ENABLED_ENGINES if name in app.ocr_backends)
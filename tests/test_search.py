@@ -0,0 +1,152 @@
+from datetime import datetime, timedelta
+
+import app
+
+
+def make_doc(prescription_id, issue='', doctor_name='', medicines=(), text='', created_at=None):
+    return {
+        'prescription_id': prescription_id,
+        'issue': issue,
+        'doctor_name': doctor_name,
+        'prescription_date': None,
+        'extracted_text': text,
+        'created_at': created_at or datetime(2026, 1, 1) + timedelta(days=prescription_id),
+        'medicines': [{'medicine_name': name, 'catalog_name': None, 'dosage': '', 'frequency': ''}
+                      for name in medicines]
+    }
+
+
+def build_index(*docs):
+    index = app.UserSearchIndex()
+    for doc in docs:
+        index.add(doc)
+    return index
+
+
+def test_medicine_match_outranks_text_match():
+    index = build_index(make_doc(1, text='paracetamol mentioned in notes'),
+                        make_doc(2, medicines=['Paracetamol']))
+    assert [prescription_id for prescription_id, score in index.search('paracetamol')] == [2, 1]
+
+
+def test_documents_matching_more_terms_rank_first():
+    index = build_index(make_doc(1, medicines=['Paracetamol']),
+                        make_doc(2, issue='Fever', text='paracetamol'))
+    assert [prescription_id for prescription_id, score in index.search('paracetamol fever')] == [2, 1]
+
+
+def test_prefix_and_typo_matches_score_below_exact():
+    index = build_index(make_doc(1, medicines=['Amoxicillin']), make_doc(2, medicines=['Amoxil']))
+    exact = dict(index.search('amoxil'))
+    assert exact[2] > exact.get(1, 0)
+    assert sorted(prescription_id for prescription_id, score in index.search('amox')) == [1, 2]
+    typo = dict(index.search('amoxicilin'))
+    assert 0 < typo[1] < app.SEARCH_FIELD_WEIGHTS['medicine']
+
+
+def test_ties_break_on_newest_first():
+    index = build_index(make_doc(1, issue='Cough'), make_doc(2, issue='Cough'))
+    assert [prescription_id for prescription_id, score in index.search('cough')] == [2, 1]
+
+
+def test_remove_drops_document_and_vocabulary():
+    index = build_index(make_doc(1, medicines=['Cetirizine']), make_doc(2, medicines=['Dolo']))
+    index.remove(1)
+    assert index.search('cetirizine') == []
+    assert 'cetirizine' not in index.postings
+
+
+class FakeDatabase:
+    """Just enough of MySQL for SearchIndex: data_version, NOW(), the document query and the id query"""
+
+    def __init__(self):
+        self.now = datetime(2026, 3, 1, 12, 0, 0)
+        self.version = 1
+        self.rows = {}
+        self.document_queries = []
+
+    def put(self, doc):
+        self.rows[doc['prescription_id']] = (doc, self.now)
+        self.version += 1
+
+    def delete(self, prescription_id):
+        del self.rows[prescription_id]
+        self.version += 1
+
+    def cursor(self):
+        return FakeCursor(self)
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, sql, params=()):
+        if 'data_version' in sql:
+            self.result = [{'data_version': self.db.version}]
+        elif 'NOW()' in sql:
+            self.result = [{'synced_at': self.db.now - timedelta(seconds=params[0])}]
+        elif 'LEFT JOIN' in sql:
+            updated_since = params[1] if 'updated_at' in sql else None
+            self.db.document_queries.append(updated_since)
+            self.result = []
+            for doc, updated_at in self.db.rows.values():
+                if updated_since is not None and updated_at < updated_since:
+                    continue
+                base = {key: doc[key] for key in ('prescription_id', 'issue', 'doctor_name', 'prescription_date',
+                                                  'extracted_text', 'created_at')}
+                for medicine in doc['medicines'] or [{'medicine_name': None, 'catalog_name': None,
+                                                      'dosage': None, 'frequency': None}]:
+                    self.result.append({**base, **medicine})
+        else:
+            self.result = [{'prescription_id': prescription_id} for prescription_id in self.db.rows]
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+
+def test_index_is_reused_while_data_version_is_unchanged():
+    db = FakeDatabase()
+    db.put(make_doc(1, medicines=['Dolo']))
+    search_index = app.SearchIndex(max_users=10)
+    search_index.search(db.cursor(), 7, 'dolo', 1, 10)
+    search_index.search(db.cursor(), 7, 'dolo', 1, 10)
+    assert db.document_queries == [None]
+
+
+def test_changes_from_other_processes_are_synced_incrementally():
+    db = FakeDatabase()
+    db.put(make_doc(1, medicines=['Dolo']))
+    db.put(make_doc(2, medicines=['Azee']))
+    search_index = app.SearchIndex(max_users=10)
+    assert search_index.search(db.cursor(), 7, 'crocin', 1, 10)[1] == 0
+    
+    # Another worker process adds one prescription, edits one and deletes one
+    db.now += timedelta(minutes=10)
+    db.put(make_doc(3, medicines=['Crocin']))
+    db.put(make_doc(1, medicines=['Pan']))
+    db.delete(2)
+    
+    assert [doc['prescription_id'] for doc, score in search_index.search(db.cursor(), 7, 'crocin', 1, 10)[0]] == [3]
+    assert search_index.search(db.cursor(), 7, 'dolo', 1, 10)[1] == 0
+    assert search_index.search(db.cursor(), 7, 'pan', 1, 10)[1] == 1
+    assert search_index.search(db.cursor(), 7, 'azee', 1, 10)[1] == 0
+    # One full build, then one reload limited to recently updated prescriptions
+    assert db.document_queries[0] is None
+    assert db.document_queries[1:] == [datetime(2026, 3, 1, 11, 59, 0)]
+    assert search_index.stats()['syncs'] == {'current': 3, 'built': 1, 'incremental': 1}
+
+
+def test_search_rejects_non_numeric_page(monkeypatch):
+    monkeypatch.setattr(app, 'ensure_upload_workers', lambda: None)
+    monkeypatch.setattr(app, 'get_db', lambda: None)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    response = client.post('/search', json={'query': 'dolo', 'page': 'two'})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
@@ -0,0 +1,279 @@
+import contextlib
+import io
+import queue
+
+import pytest
+
+import app
+
+
+class JobCursor:
+    """Runs the upload_job statements of the pipeline against JobStore"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self.result = None
+
+    def execute(self, sql, params=()):
+        jobs = self.conn.store.jobs
+        if "SET status = 'running'" in sql and 'batch_id' in sql:
+            claimed = [job_id for job_id, job in jobs.items()
+                       if job['batch_id'] == params[0] and job['status'] == 'queued']
+            self.conn.pending += [(job_id, {'status': 'running', 'stage': 'ocr'}) for job_id in claimed]
+            self.rowcount = len(claimed)
+        elif "SET status = 'running'" in sql:
+            job = jobs.get(params[0])
+            self.rowcount = 0
+            if job is not None and job['status'] == 'queued':
+                self.conn.pending.append((params[0], {'status': 'running', 'stage': 'ocr'}))
+                self.rowcount = 1
+        elif sql.lstrip().startswith('SELECT * FROM upload_job') and 'batch_id' in sql:
+            self.result = [dict(job) for job in jobs.values() if job['batch_id'] == params[0]
+                           and (job['status'], job['stage']) == ('running', 'ocr')]
+        elif sql.lstrip().startswith('SELECT * FROM upload_job'):
+            self.result = dict(jobs[params[0]])
+        elif 'SET stage = %s WHERE job_id IN' in sql:
+            self.conn.pending += [(job_id, {'stage': params[0]}) for job_id in params[1:]]
+        elif 'SET stage = %s' in sql:
+            stage, status, message, prescription_id, result, job_id = params
+            self.conn.pending.append((job_id, {'stage': stage, 'status': status, 'message': message,
+                                               'prescription_id': prescription_id, 'result': result}))
+        elif 'FROM medicine' in sql:
+            self.conn.store.catalog_reloads += 1
+            self.result = []
+
+    def executemany(self, sql, rows):
+        for row in rows:
+            self.execute(sql, row)
+
+    def fetchone(self):
+        return self.result
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class JobConnection:
+    def __init__(self, store):
+        self.store = store
+        self.pending = []
+
+    def cursor(self, dictionary=False):
+        return JobCursor(self)
+
+    def commit(self):
+        for job_id, changes in self.pending:
+            self.store.jobs[job_id].update(changes)
+            self.store.history.setdefault(job_id, []).append(changes['stage'])
+        self.store.commits.append(sorted({job_id for job_id, changes in self.pending if changes['stage'] == 'done'}))
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+
+
+class JobStore:
+    """An upload_job table behind a pool that records how many connections are held"""
+
+    def __init__(self, *jobs):
+        self.jobs = {job['job_id']: job for job in jobs}
+        self.history = {}
+        self.commits = []
+        self.in_use = 0
+        self.catalog_reloads = 0
+
+    @contextlib.contextmanager
+    def connection(self):
+        # A worker never needs two connections at once; nesting them can deadlock a full pool
+        assert self.in_use == 0, 'second pooled connection taken while one is held'
+        self.in_use += 1
+        conn = JobConnection(self)
+        try:
+            yield conn
+        finally:
+            # Uncommitted work is rolled back when the pool takes the connection back
+            conn.rollback()
+            self.in_use -= 1
+
+
+def make_job(job_id='job1', status='queued', batch_id=None):
+    return {'job_id': job_id, 'batch_id': batch_id, 'user_id': 7, 'issue': 'Fever', 'description': '', 'status': status,
+            'stage': 'queued', 'file_path': 'uploads/rx.png', 'content_hash': 'a' * 64, 'message': None,
+            'prescription_id': None, 'result': None}
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path):
+    store = JobStore(make_job())
+    calls = []
+
+    def extract(full_path):
+        calls.append(('ocr', store.in_use))
+        return 'Dolo 650', 'Dolo 650', '', {'tesseract': {'seconds': 0.1, 'status': 'ok'}}
+
+    def fuse(*texts):
+        calls.append(('fusion', store.in_use))
+        return {'doctor_name': '', 'date': '', 'medicines': [{'name': 'Dolo 650'}]}, 'fast_path'
+
+    monkeypatch.setattr(app, 'db_pool', store)
+    monkeypatch.setattr(app, 'medicine_catalog', app.MedicineCatalog(300, app.MEDICINE_MATCH_MIN_SIMILARITY))
+    monkeypatch.setattr(app, 'ocr_cache', app.ResultCache(str(tmp_path), 10, 10 ** 6))
+    monkeypatch.setattr(app, 'ocr_cache_config', lambda: {})
+    monkeypatch.setattr(app, 'extract_text_triple_ocr', extract)
+    monkeypatch.setattr(app, 'fuse_prescription', fuse)
+    monkeypatch.setattr(app, 'save_prescription', lambda cur, *args: 42)
+    monkeypatch.setattr(app.search_index, 'refresh_prescription', lambda cur, user_id, prescription_id: None)
+    monkeypatch.setattr(app, 'record_ocr_run', lambda *args: None)
+    store.calls = calls
+    return store
+
+
+def test_job_moves_through_every_stage(pipeline):
+    app.run_upload_job('job1')
+    job = pipeline.jobs['job1']
+    assert pipeline.history['job1'] == ['ocr', 'fusion', 'saving', 'done']
+    assert (job['status'], job['prescription_id']) == ('done', 42)
+    assert app.json.loads(job['result'])['fusion'] == 'fast_path'
+
+
+def test_no_connection_is_held_during_ocr_or_fusion(pipeline):
+    app.run_upload_job('job1')
+    assert pipeline.calls == [('ocr', 0), ('fusion', 0)]
+    assert pipeline.in_use == 0
+
+
+def test_job_claimed_elsewhere_is_left_alone(pipeline):
+    pipeline.jobs['job1']['status'] = 'running'
+    app.run_upload_job('job1')
+    assert pipeline.calls == []
+    assert 'job1' not in pipeline.history
+
+
+def test_unreadable_image_fails_the_job(pipeline, monkeypatch):
+    monkeypatch.setattr(app, 'extract_text_triple_ocr', lambda full_path: ('', ' ', '', {}))
+    app.run_upload_job('job1')
+    assert pipeline.history['job1'] == ['ocr', 'done']
+    assert (pipeline.jobs['job1']['status'], pipeline.jobs['job1']['message']) == ('failed', 'Could not extract text!')
+
+
+def test_save_error_rolls_back_and_fails_the_job(pipeline, monkeypatch):
+    def save(cur, *args):
+        raise app.mysql.connector.Error(msg='Deadlock found')
+    monkeypatch.setattr(app, 'save_prescription', save)
+    app.run_upload_job('job1')
+    job = pipeline.jobs['job1']
+    assert (job['status'], job['prescription_id']) == ('failed', None)
+    assert job['message'] == 'Database error: Deadlock found'
+
+
+def test_unexpected_error_marks_the_job_failed(pipeline, monkeypatch):
+    def crash(full_path):
+        raise RuntimeError('engine crashed')
+    monkeypatch.setattr(app, 'extract_text_triple_ocr', crash)
+    app.process_upload_job('job1')
+    job = pipeline.jobs['job1']
+    assert (job['stage'], job['status']) == ('done', 'failed')
+    assert pipeline.in_use == 0
+
+
+def test_full_queue_refuses_uploads_with_retry_after(monkeypatch):
+    full = queue.Queue(maxsize=1)
+    full.put('other-job')
+    monkeypatch.setattr(app, 'upload_queue', full)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 7
+    response = client.post('/upload', data={'issue': 'Fever', 'file': (io.BytesIO(b'png'), 'rx.png')},
+                           content_type='multipart/form-data')
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(app.UPLOAD_RETRY_AFTER)
+
+
+def test_stale_catalog_is_reloaded_on_the_claim_connection(pipeline, monkeypatch):
+    def fuse(*texts):
+        # The real fast path, which reads the catalog while no connection is held
+        app.fast_path_parse(list(texts))
+        return {'doctor_name': '', 'date': '', 'medicines': []}, 'llm'
+    monkeypatch.setattr(app, 'fuse_prescription', fuse)
+    app.run_upload_job('job1')
+    assert pipeline.catalog_reloads == 1
+    assert pipeline.jobs['job1']['status'] == 'done'
+
+
+@pytest.fixture
+def batch(pipeline, monkeypatch):
+    pipeline.jobs = {job['job_id']: job for job in (make_job(f"job{n}", batch_id='b1') for n in range(1, 4))}
+    for n, job in enumerate(pipeline.jobs.values()):
+        job['file_path'] = f"uploads/rx{n}.png"
+        job['content_hash'] = str(n) * 64
+    pipeline.ocr_batches = []
+    pipeline.saved = []
+
+    def extract_batch(paths):
+        pipeline.ocr_batches.append([path.rsplit('/', 1)[-1] for path in paths])
+        texts = [('Dolo 650', 'Dolo 650', '') if 'rx1' not in path else ('', '', '') for path in paths]
+        return texts, {'tesseract': {'seconds': 0.3, 'status': 'ok'}}
+
+    def save_batch(cur, user_id, items):
+        pipeline.saved.append([item['relative_path'] for item in items])
+        return list(range(100, 100 + len(items)))
+    monkeypatch.setattr(app, 'extract_text_batch', extract_batch)
+    monkeypatch.setattr(app, 'save_prescription_batch', save_batch)
+    return pipeline
+
+
+def test_batch_runs_one_ocr_batch_and_one_commit(batch):
+    app.run_upload_job('job2')
+    assert batch.ocr_batches == [['rx0.png', 'rx1.png', 'rx2.png']]
+    assert batch.saved == [['uploads/rx0.png', 'uploads/rx2.png']]
+    # Every job's final state lands in the transaction that inserted the prescriptions
+    assert [commit for commit in batch.commits if commit] == [['job1', 'job2', 'job3']]
+    statuses = {job_id: (job['status'], job['prescription_id']) for job_id, job in batch.jobs.items()}
+    assert statuses == {'job1': ('done', 100), 'job2': ('failed', None), 'job3': ('done', 101)}
+    assert batch.history['job1'] == ['ocr', 'fusion', 'saving', 'done']
+    assert batch.in_use == 0
+
+
+def test_batch_is_run_once_by_whichever_job_is_picked_up(batch):
+    app.run_upload_job('job1')
+    app.run_upload_job('job3')
+    assert len(batch.ocr_batches) == 1
+
+
+def test_batch_upload_takes_one_queue_entry(monkeypatch, tmp_path):
+    inserted = []
+
+    class InsertCursor:
+        def executemany(self, sql, rows):
+            inserted.extend(rows)
+
+    class InsertConnection:
+        def cursor(self, dictionary=False):
+            return InsertCursor()
+
+        def commit(self):
+            pass
+
+    upload_queue = queue.Queue(maxsize=2)
+    monkeypatch.setattr(app, 'upload_queue', upload_queue)
+    monkeypatch.setattr(app.db_pool, 'acquire', lambda: InsertConnection())
+    monkeypatch.setattr(app.db_pool, 'release', lambda conn: None)
+    monkeypatch.setattr(app, 'schedule_thumbnails', lambda full_path, relative_path: None)
+    monkeypatch.setitem(app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 7
+    response = client.post('/upload/batch', data={
+        'issue': 'Fever',
+        'files': [(io.BytesIO(b'one'), 'a.png'), (io.BytesIO(b'two'), 'b.png'), (io.BytesIO(b'three'), 'c.png')]
+    }, content_type='multipart/form-data')
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body['queued'] == 3
+    assert {row[1] for row in inserted} == {body['batch_id']}
+    assert upload_queue.qsize() == 1
+    assert upload_queue.get() == body['job_ids'][0]
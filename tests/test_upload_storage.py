@@ -0,0 +1,132 @@
+import hashlib
+import io
+import mmap
+import os
+
+import pytest
+
+import app
+
+
+class ChunkCountingStream(io.BytesIO):
+    def __init__(self, data):
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size=-1):
+        self.reads += 1
+        return super().read(size)
+
+
+class BrokenStream(io.BytesIO):
+    """A client that disconnects after the first chunk"""
+
+    def read(self, size=-1):
+        if self.tell():
+            raise OSError('Connection reset by peer')
+        return super().read(size)
+
+
+def test_stream_is_hashed_while_copied_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_CHUNK_SIZE', 1024)
+    data = os.urandom(5000)
+    stream = ChunkCountingStream(data)
+    target = tmp_path / 'upload.png'
+    digest = app.store_upload_stream(stream, str(target))
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert target.read_bytes() == data
+    # Five full or partial chunks, then the empty read that ends the copy
+    assert stream.reads == 6
+    assert list(tmp_path.iterdir()) == [target]
+
+
+def test_identical_uploads_share_one_content_hash(tmp_path):
+    # The hash is the content part of the OCR cache key, so a re-upload of the same image dedupes
+    data = b'prescription image bytes' * 1000
+    first = app.store_upload_stream(io.BytesIO(data), str(tmp_path / 'a.png'))
+    second = app.store_upload_bytes(data, str(tmp_path / 'b.png'))
+    assert first == second == app.file_sha256(str(tmp_path / 'a.png'))
+    assert app.store_upload_stream(io.BytesIO(data + b'!'), str(tmp_path / 'c.png')) != first
+
+
+def test_failed_copy_leaves_no_partial_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_CHUNK_SIZE', 4)
+    with pytest.raises(OSError):
+        app.store_upload_stream(BrokenStream(b'x' * 10), str(tmp_path / 'upload.png'))
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_small_images_are_read_and_large_ones_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'UPLOAD_MMAP_THRESHOLD', 1024)
+    small = tmp_path / 'small.png'
+    small.write_bytes(b's' * 1023)
+    large = tmp_path / 'large.png'
+    large.write_bytes(b'l' * 1024)
+    assert app.read_image_buffer(str(small)) == b's' * 1023
+    buffer = app.read_image_buffer(str(large))
+    try:
+        assert isinstance(buffer, mmap.mmap)
+        assert buffer[:] == b'l' * 1024
+    finally:
+        buffer.close()
+
+
+@pytest.fixture
+def thumbs(tmp_path, monkeypatch):
+    folder = tmp_path / 'thumbs'
+    monkeypatch.setattr(app, 'THUMBNAIL_FOLDER', str(folder))
+    return folder
+
+
+def test_thumbnail_url_falls_back_to_the_original(thumbs):
+    with app.app.test_request_context():
+        assert app.thumbnail_url('uploads/1_x.png') == '/static/uploads/1_x.png'
+        (thumbs / 'thumb').mkdir(parents=True)
+        (thumbs / 'thumb' / '1_x.jpg').write_bytes(b'jpeg')
+        assert app.thumbnail_url('uploads/1_x.png') == '/static/uploads/thumbs/thumb/1_x.jpg'
+        assert app.thumbnail_url('uploads/1_x.png', 'preview') == '/static/uploads/1_x.png'
+
+
+class DeleteCursor:
+    def __init__(self, row):
+        self.row = row
+        self.queries = []
+
+    def execute(self, sql, params=()):
+        self.queries.append(sql)
+
+    def fetchone(self):
+        return self.row
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cursor_obj = cursor
+        self.commits = 0
+
+    def cursor(self, dictionary=False):
+        return self.cursor_obj
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_delete_removes_the_upload_and_its_thumbnails(tmp_path, thumbs, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    upload = tmp_path / 'static' / 'uploads' / '1_x.png'
+    upload.parent.mkdir(parents=True)
+    upload.write_bytes(b'png')
+    for size_name in app.THUMBNAIL_SIZES:
+        (thumbs / size_name).mkdir(parents=True)
+        (thumbs / size_name / '1_x.jpg').write_bytes(b'jpeg')
+    conn = FakeConnection(DeleteCursor({'file_path': 'uploads/1_x.png'}))
+    monkeypatch.setattr(app.db_pool, 'acquire', lambda: conn)
+    monkeypatch.setattr(app.db_pool, 'release', lambda conn: None)
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+    response = client.post('/prescription/7/delete')
+    assert response.get_json()['status'] == 'success'
+    assert conn.commits == 1
+    assert not upload.exists()
+    assert not any(path.is_file() for path in thumbs.rglob('*'))
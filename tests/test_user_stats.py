@@ -0,0 +1,145 @@
+import pytest
+
+import app
+
+
+class StatsCursor:
+    """Answers the dashboard's user_stats read and the stats procedures from in-memory rows"""
+
+    def __init__(self, stats=None, drifted=(), user_ids=()):
+        self.stats = stats
+        self.drifted = list(drifted)
+        self.user_ids = list(user_ids)
+        self.queries = []
+        self.procs = []
+        self.result = []
+
+    def execute(self, sql, params=()):
+        self.queries.append((sql, params))
+        if 'FROM user_stats' in sql:
+            self.result = [self.stats] if self.stats else []
+        elif sql.strip() == 'SELECT user_id FROM user':
+            self.result = [(user_id,) for user_id in self.user_ids]
+        else:
+            self.result = []
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def callproc(self, name, args=()):
+        self.procs.append((name, list(args)))
+
+    def stored_results(self):
+        return [StoredResult(self.drifted)] if self.procs and self.procs[-1][0] == 'CheckUserStats' else []
+
+    def close(self):
+        pass
+
+
+class StoredResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self.cursor_obj = cursor
+        self.commits = 0
+
+    def cursor(self, dictionary=False):
+        return self.cursor_obj
+
+    def commit(self):
+        self.commits += 1
+
+
+@pytest.fixture
+def pooled(monkeypatch):
+    """Hand out one fake connection from the pool and return it"""
+    def install(cursor):
+        conn = FakeConnection(cursor)
+        monkeypatch.setattr(app.db_pool, 'acquire', lambda: conn)
+        monkeypatch.setattr(app.db_pool, 'release', lambda conn: None)
+        return conn
+    return install
+
+
+def drift_row(user_id):
+    return {'user_id': user_id, 'stored_prescriptions': 3, 'actual_prescriptions': 4,
+            'stored_doctors': 1, 'actual_doctors': 1, 'stored_months': 2, 'actual_months': 2,
+            'stored_medicines': 5, 'actual_medicines': 7}
+
+
+def dashboard_client():
+    client = app.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+        session['user_name'] = 'Asha'
+    return client
+
+
+def test_dashboard_reads_summary_from_user_stats(pooled):
+    cursor = StatsCursor(stats={'total_prescriptions': 12, 'total_doctors': 3,
+                                'active_months': 5, 'total_medicines': 27})
+    pooled(cursor)
+    response = dashboard_client().get('/dashboard')
+    assert response.status_code == 200
+    stats_queries = [(sql, params) for sql, params in cursor.queries if 'FROM user_stats' in sql]
+    assert len(stats_queries) == 1 and stats_queries[0][1] == (1,)
+    # No aggregate over the base tables on the dashboard path
+    assert not any('COUNT(' in sql.upper() for sql, params in cursor.queries)
+    body = response.get_data(as_text=True)
+    assert '>12<' in body and '>27<' in body
+
+
+def test_dashboard_without_stats_row_shows_zeros(pooled):
+    pooled(StatsCursor(stats=None))
+    response = dashboard_client().get('/dashboard')
+    assert response.status_code == 200
+    assert '>0<' in response.get_data(as_text=True)
+
+
+def test_check_stats_reports_drift_without_repairing(pooled):
+    cursor = StatsCursor(drifted=[drift_row(4)])
+    conn = pooled(cursor)
+    result = app.app.test_cli_runner().invoke(args=['check-stats'])
+    assert result.exit_code == 0
+    assert 'user 4: prescriptions 3/4' in result.output
+    assert '1 user(s) with drifted statistics' in result.output
+    assert cursor.procs == [('CheckUserStats', [])]
+    assert conn.commits == 0
+
+
+def test_check_stats_repair_rebuilds_each_drifted_user(pooled):
+    cursor = StatsCursor(drifted=[drift_row(4), drift_row(9)])
+    conn = pooled(cursor)
+    result = app.app.test_cli_runner().invoke(args=['check-stats', '--repair'])
+    assert result.exit_code == 0
+    assert cursor.procs == [('CheckUserStats', []), ('RebuildUserStats', [4]), ('RebuildUserStats', [9])]
+    assert conn.commits == 1
+    assert '2 user(s) with drifted statistics, repaired' in result.output
+
+
+def test_rebuild_stats_covers_every_user(pooled):
+    cursor = StatsCursor(user_ids=[1, 2, 3])
+    conn = pooled(cursor)
+    result = app.app.test_cli_runner().invoke(args=['rebuild-stats'])
+    assert result.exit_code == 0
+    assert cursor.procs == [('RebuildUserStats', [1]), ('RebuildUserStats', [2]), ('RebuildUserStats', [3])]
+    assert conn.commits == 3
+    assert 'Rebuilt statistics for 3 user(s)' in result.output
+
+
+def test_rebuild_stats_for_one_user(pooled):
+    cursor = StatsCursor(user_ids=[1, 2, 3])
+    pooled(cursor)
+    result = app.app.test_cli_runner().invoke(args=['rebuild-stats', '--user', '2'])
+    assert result.exit_code == 0
+    assert cursor.procs == [('RebuildUserStats', [2])]
+    assert cursor.queries == []